@@ -0,0 +1,561 @@
+"""
+Бенчмарки бота на временной базе со схемой Django.
+
+    python -m bot.benchmarks [имя ...] [--sizes small,medium] [--output baseline.json]
+    python -m bot.benchmarks handlers sql_queries --compare baseline.json
+
+Бенчмарки из SIZED_BENCHMARKS (обработчики, запросы sql_queries, отчет по зарплате в админке)
+гоняются на синтетической базе seed_data каждого размера из SIZES. С --compare результаты
+сравниваются с сохраненным прогоном: время, выросшее больше чем на --threshold, и пропускная
+способность, упавшая на столько же, считаются регрессией, и команда завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from aiogram import Bot
+
+from bot import sql_queries
+from bot.db import Database, create_database
+from bot.fsm_storage import SQLiteStorage
+from bot.outbox import Outbox, RateLimitMiddleware
+from bot.sql_queries import add_or_update_attendance, get_day_reminders, get_recorded_training_ids
+from bot.testing import (
+    POSTGRES_DSN, FakeSession, FakeTelegramServer, _manage, copy_database, create_postgres_database,
+    drop_postgres_database, migrate_database, seed_repository, seed_schedules, seed_synthetic, seed_trainings,
+)
+from bot.workers import UpdateQueue
+from bot.write_queue import AttendanceWriteQueue
+
+
+def _attendance(training_id, recording_date, attend_count=8):
+    return {
+        'training_id': training_id,
+        'attend_count': attend_count,
+        'recording_day': recording_date.strftime('%a').lower(),
+        'recording_date': recording_date,
+        'created_date': datetime.now(),
+        'update_date': datetime.now(),
+    }
+
+
+async def bench_attendance_burst(tmpdir, submissions=2000):
+    """Вечерний всплеск: submissions одновременных записей посещаемости от разных занятий."""
+    results = {}
+    for mode in ('commit_per_entry', 'write_queue'):
+        path = os.path.join(tmpdir, f'{mode}.sqlite3')
+        migrate_database(path)
+        trainings = seed_trainings(path, trainers=50, trainings_per_trainer=4)
+        rows = [
+            _attendance(training_id, date(2024, 3, 1) + timedelta(days=i // len(trainings)))
+            for i, (trainer_id, training_id) in enumerate(trainings * (submissions // len(trainings)))
+        ]
+
+        db = await Database(path).open()
+        queue = AttendanceWriteQueue(db).start()
+
+        async def commit_per_entry(data):
+            async with db.write() as conn:
+                await add_or_update_attendance(conn, data)
+
+        submit = queue.submit if mode == 'write_queue' else commit_per_entry
+        started = time.perf_counter()
+        await asyncio.gather(*(submit(data) for data in rows))
+        elapsed = time.perf_counter() - started
+
+        results[mode] = {
+            'submissions': len(rows),
+            'seconds': round(elapsed, 3),
+            'per_second': round(len(rows) / elapsed),
+            'transactions': queue.batches if mode == 'write_queue' else len(rows),
+        }
+        await queue.stop()
+        await db.close()
+    return results
+
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    return {
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+async def bench_update_latency(tmpdir, updates=200):
+    """Время от появления обновления до sendMessage через заглушку Bot API: polling против webhook."""
+    from aiohttp.test_utils import TestClient, TestServer
+
+    from bot.main import dp
+    from bot.webhook import create_app
+
+    storage, dp.fsm.storage = dp.fsm.storage, SQLiteStorage(os.path.join(tmpdir, 'fsm.sqlite3'))
+    results = {}
+    for mode in ('polling', 'webhook'):
+        telegram = await FakeTelegramServer().start()
+        bot = telegram.bot()
+        latencies = []
+
+        if mode == 'polling':
+            polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+
+            async def deliver(update):
+                telegram.updates.put_nowait(update)
+        else:
+            client = TestClient(TestServer(create_app(dp, bot, '/tg/', 'secret')))
+            await client.start_server()
+
+            async def deliver(update):
+                await client.post('/tg/', json=update, headers={'X-Telegram-Bot-Api-Secret-Token': 'secret'})
+
+        for i in range(updates):
+            started = time.perf_counter()
+            await deliver(telegram.message_update(1000 + i, '/start'))
+            sent_at, params = await telegram.sent.get()
+            latencies.append(sent_at - started)
+
+        if mode == 'polling':
+            await dp.stop_polling()
+            await polling
+        else:
+            await client.close()
+        await bot.session.close()
+        await telegram.stop()
+        results[mode] = _percentiles(latencies)
+    await dp.fsm.storage.close()
+    dp.fsm.storage = storage
+    return results
+
+
+async def bench_fsm_storage(tmpdir, users=2000):
+    """Диалог ввода посещаемости в FSM (состояние, данные, чтение, сброс): MemoryStorage против SQLite."""
+    results = {}
+    for mode in ('memory', 'sqlite'):
+        storage = MemoryStorage() if mode == 'memory' else SQLiteStorage(os.path.join(tmpdir, 'fsm_bench.sqlite3'))
+        latencies = []
+        started = time.perf_counter()
+        for user_id in range(users):
+            key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+            step_started = time.perf_counter()
+            await storage.set_state(key, 'AttendanceStates:attendance_count')
+            await storage.update_data(key, {'training_id': user_id, 'date': '2024-03-01'})
+            await storage.get_state(key)
+            await storage.get_data(key)
+            await storage.set_state(key, None)
+            await storage.set_data(key, {})
+            latencies.append(time.perf_counter() - step_started)
+        elapsed = time.perf_counter() - started
+        await storage.close()
+        results[mode] = {'dialogs_per_second': round(users / elapsed), **_percentiles(latencies)}
+    return results
+
+
+async def bench_sharded_workers(tmpdir, updates=1500, trainers=150, api_delay=0.03):
+    """
+    Режим с воркерами: пачка обновлений (зарплата и занятия на сегодня от разных тренеров) в очереди,
+    время до последнего ответа в заглушке Bot API при 1, 2 и 4 процессах. Лимит исходящих сообщений
+    снят (TELEGRAM_RATE), иначе замер показывал бы token bucket, а не пропускную способность воркеров.
+    """
+    from bot.main import start_worker
+
+    path = os.path.join(tmpdir, 'workers.sqlite3')
+    migrate_database(path)
+    seed_trainings(path, trainers=trainers, trainings_per_trainer=2)
+    seed_schedules(path, days=('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'))
+    telegram = await FakeTelegramServer(delay=api_delay).start()
+    # воркеры запускаются через spawn и читают настройки из окружения
+    os.environ.update(
+        SQLITE_PATH=path, BOT_API_URL=telegram.url, FSM_DB_PATH=os.path.join(tmpdir, 'workers_fsm.sqlite3'),
+        TELEGRAM_RATE='1000000',
+    )
+
+    texts = ('Зарплата за месяц', 'Занятия на сегодня')
+    results = {}
+    for workers in (1, 2, 4):
+        # как в продакшене: воркер делит TELEGRAM_RATE на BOT_WORKERS
+        os.environ.update(BOT_WORKERS=str(workers), UPDATES_DB_PATH=os.path.join(tmpdir, f'updates_{workers}.sqlite3'))
+        queue = await UpdateQueue(os.environ['UPDATES_DB_PATH']).open()
+        processes = [start_worker(shard) for shard in range(workers)]
+
+        # прогрев: по обновлению на каждый шард, чтобы не мерить запуск процессов
+        await queue.put([telegram.message_update(100000 + shard, '/start') for shard in range(workers)], workers)
+        for _ in range(workers):
+            await telegram.sent.get()
+
+        started = time.perf_counter()
+        await queue.put([telegram.message_update(100000 + i % trainers, texts[i % 2]) for i in range(updates)], workers)
+        for _ in range(updates):
+            sent_at, params = await telegram.sent.get()
+        elapsed = sent_at - started
+
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        await queue.close()
+        results[f'workers_{workers}'] = {'updates': updates, 'seconds': round(elapsed, 3), 'per_second': round(updates / elapsed)}
+
+    await telegram.stop()
+    return results
+
+
+async def bench_outbox(tmpdir, messages=300, flood_limit=30):
+    """
+    Рассылка на messages чатов через Outbox против заглушки Bot API с flood control
+    (flood_limit сообщений в секунду): без ограничения темпа и с token bucket на 25 сообщений/с.
+    """
+    import logging
+    import sqlite3
+
+    logging.getLogger('bot.outbox').setLevel(logging.ERROR)
+    template = os.path.join(tmpdir, 'outbox_template.sqlite3')
+    migrate_database(template)
+
+    results = {}
+    for mode, rate in (('unthrottled', 10000), ('token_bucket', 25)):
+        path = copy_database(template, os.path.join(tmpdir, f'outbox_{mode}.sqlite3'))
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.executemany(
+                "INSERT INTO training_outboundmessage (chat_id, text, reply_markup, status, attempts, error, created_date) "
+                "VALUES (?, 'Рассылка', '', 'pending', 0, '', ?)",
+                [(str(100000 + i), datetime.now()) for i in range(messages)]
+            )
+        conn.close()
+
+        telegram = await FakeTelegramServer(flood_limit=flood_limit).start()
+        bot = telegram.bot()
+        bot.session.middleware(RateLimitMiddleware(rate=rate))
+        db = await Database(path).open()
+        outbox = Outbox(bot, db)
+
+        started = time.perf_counter()
+        while await outbox.process():
+            pass
+        elapsed = time.perf_counter() - started
+
+        await db.close()
+        await bot.session.close()
+        await telegram.stop()
+        results[mode] = {
+            'messages': messages,
+            'seconds': round(elapsed, 2),
+            'per_second': round(messages / elapsed, 1),
+            'http_429': telegram.flood_errors,
+        }
+    return results
+
+
+async def _repository_load(db, trainings, clients, operations):
+    """operations запросов от clients параллельных клиентов: 8 из 10 — чтения, остальные — запись посещаемости."""
+    latencies = {'read': [], 'write': []}
+
+    async def client(number):
+        for i in range(number, operations, clients):
+            training_id = trainings[i % len(trainings)][1]
+            day = date(2024, 3, 1) + timedelta(days=i % 28)
+            started = time.perf_counter()
+            if i % 10 < 2:
+                kind = 'write'
+                async with db.write() as conn:
+                    await add_or_update_attendance(conn, _attendance(training_id, day, i % 20))
+            else:
+                kind = 'read'
+                async with db.read() as conn:
+                    if i % 2:
+                        await get_day_reminders(conn, day)
+                    else:
+                        await get_recorded_training_ids(conn, [training_id, training_id + 1, training_id + 2], day)
+            latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(clients)))
+    elapsed = time.perf_counter() - started
+    return {
+        'operations': operations,
+        'per_second': round(operations / elapsed),
+        **{kind: _percentiles(values) for kind, values in latencies.items()},
+    }
+
+
+async def bench_repository(tmpdir, operations=2000, clients=(1, 10, 50)):
+    """
+    Репозиторий бота под параллельной нагрузкой: SQLite (пул читателей и один писатель) против
+    PostgreSQL (пул asyncpg), если задан BOT_TEST_POSTGRES_DSN.
+    """
+    backends = {'sqlite': None}
+    if POSTGRES_DSN:
+        backends['postgresql'] = POSTGRES_DSN
+
+    results = {}
+    for backend, dsn in backends.items():
+        if dsn:
+            config = await create_postgres_database(dsn, 'bot_benchmark')
+        else:
+            path = os.path.join(tmpdir, 'repository.sqlite3')
+            migrate_database(path)
+            config = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+
+        db = await create_database(config).open()
+        trainings = await seed_repository(db, trainers=50, trainings_per_trainer=4, days=('mon', 'tue', 'wed', 'thu', 'fri'))
+        results[backend] = {
+            f'clients_{count}': await _repository_load(db, trainings, count, operations)
+            for count in clients
+        }
+        await db.close()
+        if dsn:
+            await drop_postgres_database(dsn, 'bot_benchmark')
+    return results
+
+
+async def bench_handlers(tmpdir, path, rounds=200):
+    """
+    Обработчики bot/main.py через Dispatcher.feed_raw_update с FakeSession вместо сети: время от
+    обновления до отправленного ответа для каждого сценария, тренеры по кругу.
+    """
+    from bot.main import dp, schedule_index
+
+    sql_queries.trainer_cache.clear()
+    sql_queries.salary_cache.clear()
+    schedule_index.invalidate()
+    saved = {key: dp.workflow_data.get(key) for key in ('db', 'attendance_queue')}
+    storage, dp.fsm.storage = dp.fsm.storage, MemoryStorage()
+    db = dp['db'] = await Database(path).open()
+    queue = dp['attendance_queue'] = AttendanceWriteQueue(db).start()
+    session = FakeSession()
+    bot = Bot(token='123456:BENCHMARK', session=session)
+    updates = FakeTelegramServer()
+
+    async with db.read() as conn:
+        async with conn.execute('SELECT tg_id FROM training_trainer ORDER BY id') as cursor:
+            users = [int(row[0]) for row in await cursor.fetchall()]
+
+    def buttons():
+        markup = session.calls[-1].reply_markup
+        return [button.callback_data for row in markup.inline_keyboard for button in row] if markup else []
+
+    history_buttons, missing_buttons = {}, {}
+    scenarios = {
+        'today': lambda user: [updates.message_update(user, 'Занятия на сегодня')],
+        'salary': lambda user: [updates.message_update(user, 'Зарплата за месяц')],
+        'history': lambda user: [updates.message_update(user, '/history')],
+        'history_older': lambda user: [updates.callback_update(user, history_buttons[user][-1])],
+        'missing': lambda user: [updates.message_update(user, '/missing')],
+        'attendance_entry': lambda user: [
+            updates.callback_update(user, missing_buttons[user][0]), updates.message_update(user, '12'),
+        ],
+    }
+    # кнопки следующей страницы и незаполненных занятий берутся из ответов предыдущих сценариев
+    pools = {'history_older': history_buttons, 'attendance_entry': missing_buttons}
+    results = {}
+    try:
+        for name, scenario in scenarios.items():
+            candidates = [user for user, found in pools[name].items() if found] if name in pools else users
+            if not candidates:
+                continue
+            latencies = []
+            for i in range(rounds):
+                user = candidates[i % len(candidates)]
+                started = time.perf_counter()
+                for update in scenario(user):
+                    await dp.feed_raw_update(bot, update)
+                latencies.append(time.perf_counter() - started)
+                if name == 'history':
+                    history_buttons[user] = buttons()
+                elif name == 'missing':
+                    missing_buttons[user] = buttons()
+            results[name] = _percentiles(latencies)
+    finally:
+        await queue.stop()
+        await db.close()
+        dp.fsm.storage = storage
+        dp.workflow_data.update(saved)
+    return results
+
+
+async def bench_sql_queries(tmpdir, path, repeat=50):
+    """Каждый запрос на чтение из bot/sql_queries.py и запись посещаемости со сброшенными кэшами."""
+    db = await Database(path).open()
+    async with db.read() as conn:
+        async with conn.execute('SELECT id, trainer_id FROM training_training ORDER BY id') as cursor:
+            trainings = [tuple(row) for row in await cursor.fetchall()]
+        async with conn.execute('SELECT MAX(recording_date) FROM training_attendance') as cursor:
+            last_day = date.fromisoformat((await cursor.fetchone())[0])
+
+    trainers = sorted({trainer_id for training_id, trainer_id in trainings})
+    month = last_day.replace(day=1)
+    months = [month, (month - timedelta(days=1)).replace(day=1), (month - timedelta(days=32)).replace(day=1)]
+
+    def arguments(i):
+        trainer_id = trainers[i % len(trainers)]
+        training_ids = [training_id for training_id, owner in trainings if owner == trainer_id]
+        return {
+            'get_trainer_by_phone': (f'996{i % len(trainers):09d}',),
+            'get_trainer_by_tg_id': (str(100000 + i % len(trainers)),),
+            'get_weekly_schedule': (),
+            'get_trainer_salary_for_months': (trainer_id, months),
+            'get_day_reminders': (last_day - timedelta(days=i % 7),),
+            'get_recorded_training_ids': (training_ids, last_day),
+            'get_trainer_trainings': (trainer_id,),
+            'get_attendance_history': (training_ids, 11, (last_day - timedelta(days=30 + i % 300), 10 ** 9)),
+            'get_missing_sessions': (trainer_id, last_day - timedelta(days=14), last_day, 20),
+            'get_pending_messages': (100,),
+        }
+
+    results = {}
+    for name in arguments(0):
+        function = getattr(sql_queries, name)
+        latencies = []
+        for i in range(repeat):
+            sql_queries.trainer_cache.clear()
+            sql_queries.salary_cache.clear()
+            async with db.read() as conn:
+                started = time.perf_counter()
+                await function(conn, *arguments(i)[name])
+                latencies.append(time.perf_counter() - started)
+        results[name] = _percentiles(latencies)
+
+    latencies = []
+    for i in range(repeat):
+        training_id = trainings[i % len(trainings)][0]
+        started = time.perf_counter()
+        async with db.write() as conn:
+            await add_or_update_attendance(conn, _attendance(training_id, last_day - timedelta(days=i % 28), i % 20))
+        latencies.append(time.perf_counter() - started)
+    results['add_or_update_attendance'] = _percentiles(latencies)
+    await db.close()
+    return results
+
+
+async def bench_salary_report(tmpdir, path):
+    """Действие download_salary_report в админке: команда benchmark_salary_report на копии базы."""
+    process = await asyncio.to_thread(_manage, 'benchmark_salary_report', SQLITE_PATH=str(path))
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+BENCHMARKS = {
+    'attendance_burst': bench_attendance_burst,
+    'update_latency': bench_update_latency,
+    'fsm_storage': bench_fsm_storage,
+    'sharded_workers': bench_sharded_workers,
+    'outbox': bench_outbox,
+    'repository': bench_repository,
+}
+
+
+SIZED_BENCHMARKS = {
+    'handlers': bench_handlers,
+    'sql_queries': bench_sql_queries,
+    'salary_report': bench_salary_report,
+}
+
+# Размеры синтетической базы: тренеры, занятий у тренера, лет посещаемости
+SIZES = {
+    'small': (20, 3, 1),
+    'medium': (100, 4, 3),
+    'large': (300, 4, 5),
+}
+DEFAULT_SIZES = ('small', 'medium')
+
+
+async def run(names, sizes=DEFAULT_SIZES, end_date=None):
+    """
+    Результаты по именам; у бенчмарков из SIZED_BENCHMARKS — по размерам базы. Шаблон каждого
+    размера заполняется один раз, а каждый бенчмарк получает свою копию.
+    """
+    end_date = end_date or date.today()
+    results = {'meta': {'end_date': end_date.isoformat(), 'sizes': {size: SIZES[size] for size in sizes}}}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        templates = {}
+        for name in names:
+            if name in BENCHMARKS:
+                results[name] = await BENCHMARKS[name](tmpdir)
+                continue
+            results[name] = {}
+            for size in sizes:
+                if size not in templates:
+                    templates[size] = os.path.join(tmpdir, f'synthetic_{size}.sqlite3')
+                    migrate_database(templates[size])
+                    await asyncio.to_thread(seed_synthetic, templates[size], *SIZES[size], end_date)
+                path = copy_database(templates[size], os.path.join(tmpdir, f'{name}_{size}.sqlite3'))
+                results[name][size] = await SIZED_BENCHMARKS[name](tmpdir, path)
+    return results
+
+
+def _metrics(results, prefix=''):
+    """Плоский словарь {'handlers.small.today.p95_ms': 1.2, ...} из вложенных результатов."""
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(_metrics(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[f'{prefix}{key}'] = value
+    return metrics
+
+
+def compare(baseline, current, threshold=0.2, min_ms=1.0):
+    """
+    Регрессии current относительно baseline: [(метрика, было, стало), ...]. Сравниваются только
+    времена (*_ms, *seconds) и пропускная способность (*per_second); счетчики вроде числа
+    транзакций и метаданные прогона не учитываются. Время, выросшее меньше чем на min_ms
+    миллисекунд, регрессией не считается: у запросов за доли миллисекунды это шум.
+    """
+    before = _metrics({key: value for key, value in baseline.items() if key != 'meta'})
+    after = _metrics({key: value for key, value in current.items() if key != 'meta'})
+    regressions = []
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        if name.endswith('per_second'):
+            worse = new < old * (1 - threshold)
+        elif name.endswith(('_ms', 'seconds')):
+            scale = 1 if name.endswith('_ms') else 1000
+            worse = new > old * (1 + threshold) and (new - old) * scale >= min_ms
+        else:
+            continue
+        if worse:
+            regressions.append((name, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bot.benchmarks')
+    parser.add_argument('names', nargs='*', metavar='имя',
+                        help=f'По умолчанию все: {", ".join([*BENCHMARKS, *SIZED_BENCHMARKS])}')
+    parser.add_argument('--sizes', type=lambda value: value.split(','), default=list(DEFAULT_SIZES),
+                        help=f'Размеры базы через запятую из {", ".join(SIZES)}')
+    parser.add_argument('--end-date', type=date.fromisoformat, help='Последний день синтетической посещаемости')
+    parser.add_argument('--output', help='Сохранить результаты в JSON как базовую линию')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Допустимое ухудшение, доля (0.2 = 20%%)')
+    parser.add_argument('--min-ms', type=float, default=1.0, help='Минимальный рост времени для регрессии, мс')
+    args = parser.parse_args(argv)
+    for kind, values, known in (('бенчмарки', args.names, [*BENCHMARKS, *SIZED_BENCHMARKS]), ('размеры', args.sizes, SIZES)):
+        unknown = set(values) - set(known)
+        if unknown:
+            parser.error(f'неизвестные {kind}: {", ".join(sorted(unknown))}')
+
+    results = asyncio.run(run(args.names or [*BENCHMARKS, *SIZED_BENCHMARKS], args.sizes, args.end_date))
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(json.load(baseline), results, args.threshold, args.min_ms)
+        for name, old, new in regressions:
+            print(f'РЕГРЕССИЯ {name}: {old} -> {new}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+    raise SystemExit(main())
@@ -0,0 +1,33 @@
+"""
+Ввод посещаемости за все занятия дня одним сообщением: "12 8 15" сопоставляется со слотами
+в порядке списка (по времени начала). Ошибка в одном числе не мешает записать остальные.
+"""
+import re
+
+
+# PositiveSmallIntegerField в training_attendance.attend_count
+MAX_ATTEND_COUNT = 32767
+SKIP = '-'
+
+
+def parse_counts(text: str, slot_count: int):
+    """
+    Возвращает ({номер слота: количество}, {номер слота: текст ошибки}); номера с нуля.
+    "-" пропускает слот, лишние числа сверх количества слотов считаются ошибкой.
+    """
+    tokens = [token for token in re.split(r'[\s,;]+', text.strip()) if token]
+    counts, errors = {}, {}
+    for index, token in enumerate(tokens):
+        if index >= slot_count:
+            errors[index] = f'«{token}» — лишнее число, занятий в списке {slot_count}'
+        elif token == SKIP:
+            continue
+        elif not token.isdigit():
+            errors[index] = f'«{token}» — не число'
+        elif int(token) > MAX_ATTEND_COUNT:
+            errors[index] = f'«{token}» — слишком большое число'
+        else:
+            counts[index] = int(token)
+    for index in range(len(tokens), slot_count):
+        errors[index] = 'количество не указано'
+    return counts, errors
@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+
+import aiosqlite
+
+
+class TTLCache:
+    """Ограниченный по размеру LRU-кэш с временем жизни записей и счетчиками попаданий."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is not None and item[1] < self.clock():
+            del self._data[key]
+            item = None
+        if item is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return item[0]
+
+    def set(self, key, value):
+        self._data[key] = (value, self.clock() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DataVersionWatcher:
+    """
+    Следит за PRAGMA data_version, которая меняется после коммитов других соединений (админки),
+    и вызывает подписчиков для сброса кэшей. Проверяет не чаще раза в check_interval секунд,
+    поэтому в остальное время кэши отвечают без обращения к базе.
+
+    Если бот сам пишет через отдельное соединение, watcher нужно привязать к нему через bind():
+    иначе собственные коммиты бота тоже будут выглядеть как внешние изменения.
+    """
+
+    def __init__(self, check_interval: float = 5):
+        self.check_interval = check_interval
+        self.conn = None
+        self._callbacks = []
+        self._data_version = None
+        self._checked_at = float('-inf')
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+        return callback
+
+    def bind(self, conn: aiosqlite.Connection):
+        self.conn = conn
+
+    async def check(self, conn: aiosqlite.Connection):
+        conn = self.conn or conn
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        if hasattr(conn, 'data_version'):
+            # PostgreSQL (bot.pg): своего data_version нет, счетчик ведут триггеры
+            data_version = await conn.data_version()
+        else:
+            async with conn.execute('PRAGMA data_version') as cursor:
+                data_version = (await cursor.fetchone())[0]
+        if data_version != self._data_version:
+            if self._data_version is not None:
+                for callback in self._callbacks:
+                    callback()
+            self._data_version = data_version
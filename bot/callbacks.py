@@ -0,0 +1,121 @@
+"""
+Компактный callback_data для кнопок ввода посещаемости.
+
+Кнопка сама несет schedule_id, training_id и дату занятия, поэтому обработчику не нужно ни
+искать занятие в базе, ни угадывать дату по времени нажатия. Формат: версия, затем
+base64url(schedule_id, training_id — по 4 байта, дни с 1970-01-01 — 2 байта) и первые 8 байт
+HMAC-SHA256 от них; всего 27 байт при лимите Telegram в 64. Подпись не дает подделать
+callback_data и записать посещаемость чужого занятия. Ключ — CALLBACK_SECRET или токен бота;
+без них модуль не импортируется: с пустым ключом подпись подделал бы кто угодно.
+
+Кнопки листания истории (HISTORY_PREFIX) несут только направление и ключ (дата, id) строки,
+от которой листать, а кнопка ввода всех занятий сразу (BULK_PREFIX) — только дату. Их не
+подписывают: тренер при нажатии определяется по отправителю, а история и занятия читаются
+только его, так что подмененные данные лишь откроют другую страницу его собственной истории
+или его же занятия за другой день.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import struct
+from datetime import date, timedelta
+from typing import NamedTuple, Optional
+
+
+ATTENDANCE_PREFIX = 'a1.'
+HISTORY_PREFIX = 'h1.'
+BULK_PREFIX = 'b1.'
+
+CALLBACK_SECRET = (os.getenv('CALLBACK_SECRET') or os.getenv('BOT_TOKEN') or '').encode()
+if not CALLBACK_SECRET:
+    raise RuntimeError('Задайте CALLBACK_SECRET или BOT_TOKEN: ими подписываются кнопки ввода посещаемости')
+
+_EPOCH = date(1970, 1, 1)
+_PAYLOAD = struct.Struct('>IIH')
+_SIGNATURE_SIZE = 8
+_HISTORY_PAYLOAD = struct.Struct('>?HI')
+_BULK_PAYLOAD = struct.Struct('>H')
+
+
+class AttendanceButton(NamedTuple):
+    schedule_id: int
+    training_id: int
+    date: date
+
+
+class HistoryButton(NamedTuple):
+    newer: bool
+    date: date
+    id: int
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload: bytes, secret: bytes) -> bytes:
+    if not secret:
+        raise ValueError('Пустой ключ подписи callback_data')
+    return hmac.new(secret, ATTENDANCE_PREFIX.encode() + payload, hashlib.sha256).digest()[:_SIGNATURE_SIZE]
+
+
+def pack_attendance(schedule_id: int, training_id: int, day: date, secret: bytes = CALLBACK_SECRET) -> str:
+    payload = _PAYLOAD.pack(schedule_id, training_id, (day - _EPOCH).days)
+    return ATTENDANCE_PREFIX + _b64encode(payload + _sign(payload, secret))
+
+
+def unpack_attendance(data: str, secret: bytes = CALLBACK_SECRET) -> Optional[AttendanceButton]:
+    """None, если версия не та, данные повреждены или подпись не сходится."""
+    if not data.startswith(ATTENDANCE_PREFIX):
+        return None
+    try:
+        raw = _b64decode(data[len(ATTENDANCE_PREFIX):])
+    except ValueError:
+        return None
+    if len(raw) != _PAYLOAD.size + _SIGNATURE_SIZE:
+        return None
+
+    payload, signature = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    if not hmac.compare_digest(signature, _sign(payload, secret)):
+        return None
+    schedule_id, training_id, days = _PAYLOAD.unpack(payload)
+    return AttendanceButton(schedule_id, training_id, _EPOCH + timedelta(days=days))
+
+
+def pack_history(newer: bool, day: date, pk: int) -> str:
+    return HISTORY_PREFIX + _b64encode(_HISTORY_PAYLOAD.pack(newer, (day - _EPOCH).days, pk))
+
+
+def unpack_history(data: str) -> Optional[HistoryButton]:
+    if not data.startswith(HISTORY_PREFIX):
+        return None
+    try:
+        raw = _b64decode(data[len(HISTORY_PREFIX):])
+    except ValueError:
+        return None
+    if len(raw) != _HISTORY_PAYLOAD.size:
+        return None
+    newer, days, pk = _HISTORY_PAYLOAD.unpack(raw)
+    return HistoryButton(newer, _EPOCH + timedelta(days=days), pk)
+
+
+def pack_bulk(day: date) -> str:
+    return BULK_PREFIX + _b64encode(_BULK_PAYLOAD.pack((day - _EPOCH).days))
+
+
+def unpack_bulk(data: str) -> Optional[date]:
+    if not data.startswith(BULK_PREFIX):
+        return None
+    try:
+        raw = _b64decode(data[len(BULK_PREFIX):])
+    except ValueError:
+        return None
+    if len(raw) != _BULK_PAYLOAD.size:
+        return None
+    days, = _BULK_PAYLOAD.unpack(raw)
+    return _EPOCH + timedelta(days=days)
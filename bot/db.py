@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiosqlite
+
+
+# Тот же файл, что и DATABASES['default'] в trainingmanager/settings.py
+DB_PATH = os.getenv('SQLITE_PATH', Path(__file__).resolve().parent.parent / 'db.sqlite3')
+
+# Соединений на чтение: как потоков у ThreadPoolExecutor — у каждого соединения aiosqlite свой поток
+DB_READERS = int(os.getenv('DB_READERS', min(32, (os.cpu_count() or 1) + 4)))
+
+# Те же настройки применяет Django (training.apps.configure_sqlite), чтобы бот и админка
+# не блокировали друг друга
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA foreign_keys=ON',
+)
+
+
+async def connect(database, **kwargs) -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(database=database, **kwargs)
+    conn.row_factory = aiosqlite.Row
+    for pragma in SQLITE_PRAGMAS:
+        await conn.execute(pragma)
+    return conn
+
+
+class Database:
+    """
+    Пул соединений только для чтения и одно соединение для записи.
+
+    У каждого соединения aiosqlite свой поток, поэтому чтения не ждут в очереди за коммитами,
+    а WAL позволяет им идти параллельно с записью. Запись сериализуется замком, чтобы
+    транзакции разных обработчиков не перемешивались на одном соединении.
+
+    Свободное соединение передается первому ждущему читателю, а новый читатель при ждущих встает
+    в конец очереди. С asyncio.Queue разбуженный читатель мог снова и снова уступать соединение
+    тем, кто пришел позже, и под нагрузкой отдельные чтения ждали сотни миллисекунд.
+    """
+
+    def __init__(self, path=DB_PATH, readers: int = DB_READERS):
+        self.path = str(path)
+        self.readers_count = readers
+        self.writer = None
+        self._readers = []
+        self._idle = []
+        self._waiters = collections.deque()
+        self._write_lock = asyncio.Lock()
+
+    async def open(self):
+        self.writer = await connect(self.path)
+        for _ in range(self.readers_count):
+            self._readers.append(await connect(f'file:{self.path}?mode=ro', uri=True))
+        self._idle = list(self._readers)
+        return self
+
+    async def close(self):
+        for conn in self._readers:
+            await conn.close()
+        self._readers, self._idle = [], []
+        if self.writer is not None:
+            await self.writer.close()
+            self.writer = None
+
+    async def _acquire_reader(self):
+        if self._idle and not self._waiters:
+            return self._idle.pop()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_reader(waiter.result())
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def _release_reader(self, conn):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(conn)
+                return
+        self._idle.append(conn)
+
+    @asynccontextmanager
+    async def read(self):
+        conn = await self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            self._release_reader(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        async with self._write_lock:
+            try:
+                yield self.writer
+            except BaseException:
+                await self.writer.rollback()
+                raise
+
+
+def database_settings() -> dict:
+    """DATABASES['default'] из настроек Django: бот и админка работают с одной базой."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trainingmanager.settings')
+    from django.conf import settings
+    return settings.DATABASES['default']
+
+
+def create_database(config: dict = None):
+    """
+    Репозиторий бота для базы из настроек Django: PostgresDatabase (пул asyncpg), если Django
+    настроен на PostgreSQL, иначе Database поверх файла SQLite. У обоих одинаковые open(),
+    close(), read(), write() и writer, а соединения понимают запросы bot.sql_queries.
+    """
+    config = config if config is not None else database_settings()
+    if config['ENGINE'].endswith('postgresql'):
+        from bot.pg import PostgresDatabase
+        return PostgresDatabase(config)
+    return Database(config['NAME'])
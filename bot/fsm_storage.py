@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from bot.db import connect
+
+
+FSM_DB_PATH = os.getenv('FSM_DB_PATH', Path(__file__).resolve().parent.parent / 'fsm.sqlite3')
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в отдельном файле SQLite (WAL) с кэшем в памяти.
+
+    Запись идет сквозь кэш сразу в базу, поэтому незавершенный ввод посещаемости переживает
+    перезапуск. Каждая запись продлевает жизнь ключа на ttl секунд; просроченные ключи
+    считаются пустыми и периодически удаляются. В памяти держится не больше cache_size ключей,
+    в базе — не больше max_rows (самые давние удаляются при очистке).
+    """
+
+    def __init__(self, path=FSM_DB_PATH, *, ttl: float = 24 * 60 * 60, cache_size: int = 10000,
+                 max_rows: int = 100000, sweep_interval: float = 600, key_builder: Optional[KeyBuilder] = None):
+        self.path = str(path)
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.max_rows = max_rows
+        self.sweep_interval = sweep_interval
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._cache = OrderedDict()
+        self._conn = None
+        self._open_lock = asyncio.Lock()
+        self._sweeper = None
+
+    async def _connection(self):
+        if self._conn is None:
+            async with self._open_lock:
+                if self._conn is None:
+                    conn = await connect(self.path)
+                    await conn.execute(
+                        '''
+                        CREATE TABLE IF NOT EXISTS fsm_record (
+                            key TEXT PRIMARY KEY,
+                            state TEXT,
+                            data TEXT NOT NULL,
+                            expires_at REAL NOT NULL
+                        )
+                        '''
+                    )
+                    await conn.execute('CREATE INDEX IF NOT EXISTS fsm_record_expires_at ON fsm_record (expires_at)')
+                    await conn.commit()
+                    self._conn = conn
+                    self._sweeper = asyncio.create_task(self._sweep_periodically())
+        return self._conn
+
+    def _remember(self, key: str, record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str):
+        record = self._cache.get(key)
+        if record is None:
+            conn = await self._connection()
+            async with conn.execute('SELECT state, data, expires_at FROM fsm_record WHERE key = ?', (key,)) as cursor:
+                row = await cursor.fetchone()
+            record = (row['state'], json.loads(row['data']), row['expires_at']) if row else (None, {}, float('inf'))
+            self._remember(key, record)
+
+        state, data, expires_at = record
+        if expires_at < time.time():
+            self._cache.pop(key, None)
+            return None, {}
+        return state, data
+
+    async def _save(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        conn = await self._connection()
+        if state is None and not data:
+            self._remember(key, (None, {}, float('inf')))
+            await conn.execute('DELETE FROM fsm_record WHERE key = ?', (key,))
+        else:
+            expires_at = time.time() + self.ttl
+            self._remember(key, (state, data, expires_at))
+            await conn.execute(
+                '''
+                INSERT INTO fsm_record (key, state, data, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, expires_at = excluded.expires_at
+                ''',
+                (key, state, json.dumps(data, ensure_ascii=False), expires_at)
+            )
+        await conn.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key = self.key_builder.build(key)
+        current_state, data = await self._load(key)
+        await self._save(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, data = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key = self.key_builder.build(key)
+        state, current_data = await self._load(key)
+        await self._save(key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        state, data = await self._load(self.key_builder.build(key))
+        return dict(data)
+
+    async def sweep(self):
+        """Удаляет просроченные ключи и лишние записи сверх max_rows."""
+        now = time.time()
+        for key, (state, data, expires_at) in list(self._cache.items()):
+            if expires_at < now:
+                del self._cache[key]
+
+        conn = await self._connection()
+        await conn.execute('DELETE FROM fsm_record WHERE expires_at < ?', (now,))
+        await conn.execute(
+            '''
+            DELETE FROM fsm_record WHERE key IN (
+                SELECT key FROM fsm_record ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+            ''',
+            (self.max_rows,)
+        )
+        await conn.commit()
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+        self._cache.clear()
@@ -1,7 +1,12 @@
 import os
 import asyncio
+import logging
+import multiprocessing
+import signal
+from contextlib import asynccontextmanager
 
-import aiosqlite
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
@@ -9,42 +14,86 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.keyboard import InlineKeyboardButton, InlineKeyboardBuilder
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from bot.reply_keyboards import request_contact_btn, cancel_btn, options_btn
 from bot.logger import configure_logging
+from bot.metrics import HandlerMetricsMiddleware, log_summary, monitor_event_loop, run_metrics_server
 from bot.sql_queries import (
     get_trainer_by_phone,
     get_trainer_by_tg_id,
     update_trainer_tg_id,
-    get_yesterday_trainings,
-    get_today_trainings,
-    add_or_update_attendance,
-    get_trainer_salary_for_month,
-    get_training_id_by_schedule_id,
-    get_training_by_id
+    get_trainer_salary_for_months,
+    get_trainer_trainings,
+    get_attendance_history,
+    get_missing_sessions,
+    add_or_update_attendances,
+    data_version_watcher,
 )
+from bot.bulk_entry import parse_counts
+from bot.callbacks import (
+    ATTENDANCE_PREFIX, BULK_PREFIX, HISTORY_PREFIX, pack_attendance, pack_bulk, pack_history, unpack_attendance,
+    unpack_bulk, unpack_history,
+)
+from bot.db import create_database
+from bot.fsm_storage import SQLiteStorage
+from bot.outbox import Outbox, RateLimitMiddleware
+from bot.reminders import ReminderScheduler
+from bot.schedule_index import ScheduleIndex
+from bot.webhook import create_ingress_app, run_webhook
+from bot.workers import UpdateQueue, poll_updates, run_worker
+from bot.write_queue import AttendanceWriteQueue
 
 load_dotenv()
 
-bot = Bot(token=os.getenv('BOT_TOKEN'))
-storage = MemoryStorage()
+logger = logging.getLogger(__name__)
+
+# Локальный Bot API сервер (или заглушка в бенчмарках) вместо api.telegram.org
+BOT_API_URL = os.getenv('BOT_API_URL')
+
+bot = Bot(
+    token=os.getenv('BOT_TOKEN'),
+    session=AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None,
+)
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
+HandlerMetricsMiddleware().setup(dp)
+schedule_index = ScheduleIndex()
+
+# Сколько месяцев, включая текущий, показывать по кнопке "Зарплата за месяц"
+SALARY_MONTHS = int(os.getenv('SALARY_MONTHS', 3))
+
+# Сколько записей посещаемости на одной странице истории
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 10))
 
+# За сколько последних дней искать проведенные занятия без посещаемости и сколько из них показать
+MISSING_ATTENDANCE_DAYS = int(os.getenv('MISSING_ATTENDANCE_DAYS', 14))
+MISSING_ATTENDANCE_LIMIT = 20
 
-async def connect_to_db():
-    db_path = os.path.join(os.path.dirname(__file__), '..', 'db.sqlite3')
-    conn = await aiosqlite.connect(database=db_path)
-    conn.row_factory = aiosqlite.Row
-    return conn
+# polling или webhook; во втором случае обновления приходят через nginx на /tg/
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Больше 1 — обновления принимает ingress, а обрабатывают BOT_WORKERS процессов (bot.workers)
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 1))
+
+# Общий лимит исходящих сообщений в секунду (Telegram допускает около 30), делится между воркерами
+TELEGRAM_RATE = float(os.getenv('TELEGRAM_RATE', 25))
+bot.session.middleware(RateLimitMiddleware(rate=TELEGRAM_RATE / BOT_WORKERS))
+
+# Порт /metrics в формате Prometheus (bot.metrics); у воркеров — METRICS_PORT + номер шарда.
+# Без METRICS_PORT сервер не запускается, но сводка метрик все равно пишется в лог
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Раз в сколько секунд писать сводку метрик в лог; 0 — не писать
+METRICS_LOG_INTERVAL = float(os.getenv('METRICS_LOG_INTERVAL', 300))
 
 
 class AttendanceStates(StatesGroup):
     training_id = State()
     attendance_count = State()
     date = State()
+    bulk = State()
 
 
 @dp.message(Command('start'))
@@ -63,75 +112,79 @@ async def start_command(message: Message, state: FSMContext):
 
 @dp.message(F.contact)
 async def handle_contact(message: Message):
-    conn = dp['dbconn']
+    db = dp['db']
     trainer_phone = message.contact.phone_number
     telegram_id = str(message.from_user.id)
     if trainer_phone[0] == "+":
         trainer_phone = trainer_phone[1:]
 
-    trainer = await get_trainer_by_phone(conn, trainer_phone)
+    async with db.read() as conn:
+        trainer = await get_trainer_by_phone(conn, trainer_phone)
     if trainer:
         if trainer['tg_id']:
             await message.answer("Ваш номер телефона уже зарегистрирован в системе", reply_markup=options_btn)
         else:
-            await update_trainer_tg_id(conn, trainer_phone, telegram_id)
+            async with db.write() as conn:
+                await update_trainer_tg_id(conn, trainer_phone, telegram_id)
             await message.answer("Ваш номер телефона был сохранен", reply_markup=options_btn)
     else:
         await message.answer("Ваш номер телефона не был найден в базе", reply_markup=ReplyKeyboardRemove())
 
 
+def slots_keyboard(slots, day):
+    inline_keyboard = InlineKeyboardBuilder()
+    for slot in slots:
+        inline_keyboard.add(InlineKeyboardButton(
+            text=slot.text, callback_data=pack_attendance(slot.schedule_id, slot.training_id, day)
+        ))
+    if len(slots) > 1:
+        inline_keyboard.add(InlineKeyboardButton(text="Записать все сразу", callback_data=pack_bulk(day)))
+    inline_keyboard.adjust(1)
+    return inline_keyboard.as_markup()
+
+
 @dp.message(StateFilter('*'), F.text.casefold() == "вчерашние занятия")
 async def send_yesterdays_trainings(message: Message, state: FSMContext):
     await state.clear()
 
-    conn = dp['dbconn']
     telegram_id = str(message.from_user.id)
 
-    trainer = await get_trainer_by_tg_id(conn, telegram_id)
+    yesterday = datetime.now().date() - timedelta(days=1)
+    async with dp['db'].read() as conn:
+        trainer = await get_trainer_by_tg_id(conn, telegram_id)
+        if trainer:
+            slots = await schedule_index.get_slots(conn, trainer['id'], yesterday)
+
     if not trainer:
         await message.answer("Ваш номер телефона не найден в базе. Используйте команду /start")
         return
 
-    yesterday = datetime.now().date() - timedelta(days=1)
-    schedules = await get_yesterday_trainings(conn, trainer['id'], yesterday)
-
-    if not schedules:
+    if not slots:
         await message.answer("Вчера у вас не было занятий")
     else:
-        inline_keyboard = InlineKeyboardBuilder()
-        for schedule in schedules:
-            training = await get_training_by_id(conn, schedule['training_id'])
-            button_text = f"{training['name']} с {schedule['start_time'][:-3]} до {schedule['end_time'][:-3]}"
-            inline_keyboard.add(InlineKeyboardButton(text=button_text, callback_data=f"yesattendance_{schedule['id']}"))
-        inline_keyboard.adjust(1)
-        await message.answer("Ваши вчерашние занятия", reply_markup=inline_keyboard.as_markup())
+        await message.answer("Ваши вчерашние занятия", reply_markup=slots_keyboard(slots, yesterday))
 
 
 @dp.message(StateFilter('*'), F.text.casefold() == "занятия на сегодня")
 async def send_today_trainings(message: Message, state: FSMContext):
     await state.clear()
 
-    conn = dp['dbconn']
     telegram_id = str(message.from_user.id)
 
-    trainer = await get_trainer_by_tg_id(conn, telegram_id)
+    today = datetime.now().date()
+    async with dp['db'].read() as conn:
+        trainer = await get_trainer_by_tg_id(conn, telegram_id)
+        if trainer:
+            slots = await schedule_index.get_slots(conn, trainer['id'], today)
+
     if not trainer:
         await message.answer("Ваш номер телефона не найден. Используйте команду /start")
         return
 
-    today = datetime.now().date()
-    schedules = await get_today_trainings(conn, trainer['id'], today)
-
-    if not schedules:
+    if not slots:
         await message.answer("На сегодня у вас нет занятий")
     else:
-        inline_keyboard = InlineKeyboardBuilder()
-        for schedule in schedules:
-            training = await get_training_by_id(conn, schedule['training_id'])
-            button_text = f"{training['name']} с {schedule['start_time'][:-3]} до {schedule['end_time'][:-3]}"
-            inline_keyboard.add(InlineKeyboardButton(text=button_text, callback_data=f"todattendance_{schedule['id']}"))
-        inline_keyboard.adjust(1)
-        await message.answer("Ваши занятия на сегодня", reply_markup=inline_keyboard.as_markup())
+        await message.answer("Ваши занятия на сегодня", reply_markup=slots_keyboard(slots, today))
 
 
 @dp.message(StateFilter("*"), F.text.casefold() == "отмена")
@@ -140,24 +193,37 @@ async def cancel(message: Message, state: FSMContext):
     await message.answer("Действия отменены", reply_markup=options_btn)
 
 
-@dp.callback_query(F.data.startswith("yesattendance_"))
-async def yesterdays_t(callback: CallbackQuery, state: FSMContext):
-    schedule_id = int(callback.data.split('_')[1])
-    yesterday_date = (datetime.now() - timedelta(days=1)).date().strftime('%Y-%m-%d')
-    await callback.message.answer('Введите количество пришедших на вчерашнее занятие', reply_markup=cancel_btn)
-    await state.set_state(AttendanceStates.attendance_count)
-    await state.update_data(training_id=schedule_id, date=yesterday_date)
-    await callback.answer()
+STALE_BUTTON = "Кнопка устарела, откройте список занятий заново"
 
 
-@dp.callback_query(F.data.startswith('todattendance_'))
-async def attendance_recording(callback: CallbackQuery, state: FSMContext):
-    schedule_id = int(callback.data.split('_')[1])
-    await callback.message.answer('Введите количество пришедших на занятие', reply_markup=cancel_btn)
-    await state.set_state(AttendanceStates.attendance_count)
-    await state.update_data(training_id=schedule_id)
+@dp.callback_query(F.data.startswith(ATTENDANCE_PREFIX))
+async def attendance_button(callback: CallbackQuery, state: FSMContext):
+    button = unpack_attendance(callback.data)
+    if button is None:
+        await callback.answer(STALE_BUTTON, show_alert=True)
+        return
     await callback.answer()
 
+    await state.set_state(AttendanceStates.attendance_count)
+    await state.set_data({
+        'schedule_id': button.schedule_id,
+        'training_id': button.training_id,
+        'date': button.date.isoformat(),
+    })
+    if button.date == datetime.now().date() - timedelta(days=1):
+        prompt = 'Введите количество пришедших на вчерашнее занятие'
+    elif button.date == datetime.now().date():
+        prompt = 'Введите количество пришедших на занятие'
+    else:
+        prompt = f'Введите количество пришедших на занятие {button.date:%d.%m.%Y}'
+    await callback.message.answer(prompt, reply_markup=cancel_btn)
+
+
+@dp.callback_query(F.data.startswith(("yesattendance_", "todattendance_")))
+async def legacy_attendance_button(callback: CallbackQuery):
+    # кнопки из сообщений, отправленных до перехода на подписанный callback_data
+    await callback.answer(STALE_BUTTON, show_alert=True)
+
 
 @dp.message(AttendanceStates.attendance_count)
 async def handle_attendance_count(message: Message, state: FSMContext):
@@ -166,39 +232,22 @@ async def handle_attendance_count(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    schedule_id = data['training_id']
-    participants = int(message.text)
-    date_str = data.get('date', datetime.now().date().strftime('%Y-%m-%d'))
-
-    date = datetime.strptime(date_str, '%Y-%m-%d').date()
-
-    training_id_result = await get_training_id_by_schedule_id(dp['dbconn'], schedule_id)
-    if not training_id_result:
-        await message.answer("Ошибка: занятие не найдено.")
+    if 'schedule_id' not in data:
+        # состояние, сохраненное до перехода на подписанный callback_data
+        await state.clear()
+        await message.answer(STALE_BUTTON, reply_markup=options_btn)
         return
 
-    training_id = training_id_result['training_id']
-
-    weekday_map = {
-        'mon': 'mon',
-        'tue': 'tue',
-        'wed': 'wed',
-        'thu': 'thu',
-        'fri': 'fri',
-        'sat': 'sat',
-        'sun': 'sun'
-    }
-    recording_day = weekday_map[date.strftime("%a").lower()]
-
+    recording_date = date.fromisoformat(data['date'])
     attendance_data = {
-        'training_id': training_id,
-        'attend_count': participants,
-        'recording_day': recording_day,
-        'recording_date': date,
+        'training_id': data['training_id'],
+        'attend_count': int(message.text),
+        'recording_day': recording_date.strftime("%a").lower(),
+        'recording_date': recording_date,
         'created_date': datetime.now(),
         'update_date': datetime.now()
     }
-    await add_or_update_attendance(dp['dbconn'], attendance_data)
+    await dp['attendance_queue'].submit(attendance_data)
     await message.answer(f'Количество участников успешно записано: {attendance_data["attend_count"]}',
                          reply_markup=options_btn)
     await state.clear()
@@ -208,23 +257,200 @@ async def handle_attendance_count(message: Message, state: FSMContext):
 async def send_monthly_salary(message: Message, state: FSMContext):
     await state.clear()
 
-    conn = dp['dbconn']
     telegram_id = str(message.from_user.id)
 
-    trainer = await get_trainer_by_tg_id(conn, telegram_id)
+    months = [datetime.now().date().replace(day=1)]
+    for _ in range(SALARY_MONTHS - 1):
+        months.append((months[-1] - timedelta(days=1)).replace(day=1))
+
+    async with dp['db'].read() as conn:
+        trainer = await get_trainer_by_tg_id(conn, telegram_id)
+        if trainer:
+            salaries = await get_trainer_salary_for_months(conn, trainer['id'], months)
+
     if not trainer:
         await message.answer("Ваш номер телефона не найден. Используйте команду /start")
         return
 
-    today = datetime.now().date()
-    start_of_month = today.replace(day=1)
-    end_of_month = (today.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    lines = [f"Ваша зарплата за текущий месяц составляет: {salaries[months[0]]} сом"]
+    if len(months) > 1:
+        lines.append("")
+        lines.append("Предыдущие месяцы:")
+        lines.extend(f"{month:%m.%Y}: {salaries[month]} сом" for month in months[1:])
+    await message.answer("\n".join(lines))
+
+
+async def history_page(conn, trainer_id: int, cursor=None, newer=False):
+    """Текст и кнопки страницы истории посещаемости тренера; cursor — (дата, id) строки с нажатой кнопки."""
+    trainings = {row['id']: row['name'] for row in await get_trainer_trainings(conn, trainer_id)}
+    # лишняя строка показывает, есть ли еще записи в сторону листания
+    rows = await get_attendance_history(conn, trainings, HISTORY_PAGE_SIZE + 1, cursor, newer)
+    more = len(rows) > HISTORY_PAGE_SIZE
+    rows = rows[1:] if newer and more else rows[:HISTORY_PAGE_SIZE]
+    if not rows:
+        return "Записей посещаемости пока нет", None
+
+    has_newer, has_older = (more, cursor is not None) if newer else (cursor is not None, more)
+    lines = ["История посещаемости"]
+    lines.extend(
+        f"{date.fromisoformat(row['recording_date']):%d.%m.%Y} — {trainings[row['training_id']]}: {row['attend_count']}"
+        for row in rows
+    )
 
-    salary = await get_trainer_salary_for_month(conn, trainer['id'], start_of_month, end_of_month)
-    if salary is None:
-        salary = 0
+    inline_keyboard = InlineKeyboardBuilder()
+    if has_newer:
+        first = rows[0]
+        inline_keyboard.add(InlineKeyboardButton(
+            text='← Новее', callback_data=pack_history(True, date.fromisoformat(first['recording_date']), first['id'])
+        ))
+    if has_older:
+        last = rows[-1]
+        inline_keyboard.add(InlineKeyboardButton(
+            text='Старее →', callback_data=pack_history(False, date.fromisoformat(last['recording_date']), last['id'])
+        ))
+    return "\n".join(lines), inline_keyboard.as_markup() if has_newer or has_older else None
+
+
+@dp.message(StateFilter('*'), Command('history'))
+@dp.message(StateFilter('*'), F.text.casefold() == "история посещаемости")
+async def send_attendance_history(message: Message, state: FSMContext):
+    await state.clear()
 
-    await message.answer(f"Ваша зарплата за текущий месяц составляет: {salary} сом")
+    async with dp['db'].read() as conn:
+        trainer = await get_trainer_by_tg_id(conn, str(message.from_user.id))
+        if trainer:
+            text, reply_markup = await history_page(conn, trainer['id'])
+
+    if not trainer:
+        await message.answer("Ваш номер телефона не найден. Используйте команду /start")
+        return
+    await message.answer(text, reply_markup=reply_markup)
+
+
+@dp.callback_query(F.data.startswith(HISTORY_PREFIX))
+async def history_button(callback: CallbackQuery):
+    button = unpack_history(callback.data)
+    if button is None:
+        await callback.answer(STALE_BUTTON, show_alert=True)
+        return
+    await callback.answer()
+
+    async with dp['db'].read() as conn:
+        trainer = await get_trainer_by_tg_id(conn, str(callback.from_user.id))
+        if trainer:
+            text, reply_markup = await history_page(conn, trainer['id'], (button.date, button.id), button.newer)
+
+    if not trainer:
+        await callback.message.answer("Ваш номер телефона не найден. Используйте команду /start")
+        return
+    await callback.message.edit_text(text, reply_markup=reply_markup)
+
+
+@dp.message(StateFilter('*'), Command('missing'))
+@dp.message(StateFilter('*'), F.text.casefold() == "незаполненные занятия")
+async def send_missing_attendance(message: Message, state: FSMContext):
+    await state.clear()
+
+    now = datetime.now()
+    async with dp['db'].read() as conn:
+        trainer = await get_trainer_by_tg_id(conn, str(message.from_user.id))
+        if trainer:
+            sessions = await get_missing_sessions(
+                conn, trainer['id'], now.date() - timedelta(days=MISSING_ATTENDANCE_DAYS), now.date(),
+                MISSING_ATTENDANCE_LIMIT,
+            )
+
+    if not trainer:
+        await message.answer("Ваш номер телефона не найден. Используйте команду /start")
+        return
+
+    # сегодняшние занятия, которые еще не закончились, пропущенными не считаются
+    today, current_time = now.date().isoformat(), now.strftime('%H:%M:%S')
+    sessions = [row for row in sessions if row['session_date'] < today or row['end_time'] <= current_time]
+    if not sessions:
+        await message.answer(f"Посещаемость всех занятий за последние {MISSING_ATTENDANCE_DAYS} дней записана")
+        return
+
+    inline_keyboard = InlineKeyboardBuilder()
+    for row in sessions:
+        day = date.fromisoformat(row['session_date'])
+        inline_keyboard.add(InlineKeyboardButton(
+            text=f"{day:%d.%m} {row['name']} с {row['start_time'][:-3]} до {row['end_time'][:-3]}",
+            callback_data=pack_attendance(row['schedule_id'], row['training_id'], day),
+        ))
+    inline_keyboard.adjust(1)
+    await message.answer(
+        "Занятия без записанной посещаемости. Нажмите на занятие, чтобы ввести количество",
+        reply_markup=inline_keyboard.as_markup(),
+    )
+
+
+@dp.callback_query(F.data.startswith(BULK_PREFIX))
+async def bulk_button(callback: CallbackQuery, state: FSMContext):
+    """Ввод всех занятий дня одним сообщением; состояние включается только этой кнопкой."""
+    day = unpack_bulk(callback.data)
+    if day is None:
+        await callback.answer(STALE_BUTTON, show_alert=True)
+        return
+
+    async with dp['db'].read() as conn:
+        trainer = await get_trainer_by_tg_id(conn, str(callback.from_user.id))
+        slots = await schedule_index.get_slots(conn, trainer['id'], day) if trainer else []
+    if not slots:
+        await callback.answer(STALE_BUTTON, show_alert=True)
+        return
+    await callback.answer()
+
+    await state.set_state(AttendanceStates.bulk)
+    await state.set_data({
+        'date': day.isoformat(),
+        'slots': [[slot.schedule_id, slot.training_id, slot.text] for slot in slots],
+    })
+    example = " ".join(str(count) for count in (12, 8, 15, 10, 9, 14)[:len(slots)])
+    lines = [f"{index}. {slot.text}" for index, slot in enumerate(slots, 1)]
+    lines.append("")
+    lines.append(f"Отправьте количество пришедших через пробел в этом порядке, например: {example}")
+    await callback.message.answer("\n".join(lines), reply_markup=cancel_btn)
+
+
+@dp.message(AttendanceStates.bulk, F.text)
+async def handle_bulk_attendance(message: Message, state: FSMContext):
+    data = await state.get_data()
+    slots = data['slots']
+    recording_date = date.fromisoformat(data['date'])
+    counts, errors = parse_counts(message.text, len(slots))
+
+    now = datetime.now()
+    rows = [
+        {
+            'training_id': slots[index][1],
+            'attend_count': count,
+            'recording_day': recording_date.strftime("%a").lower(),
+            'recording_date': recording_date,
+            'created_date': now,
+            'update_date': now,
+        }
+        for index, count in counts.items()
+    ]
+    if rows:
+        async with dp['db'].write() as conn:
+            await add_or_update_attendances(conn, rows)
+
+    lines = [f"Записано занятий: {len(rows)} из {len(slots)}"]
+    lines.extend(f"{slots[index][2]} — {count}" for index, count in counts.items())
+    if errors:
+        lines.append("")
+        lines.append("Не записано:")
+        lines.extend(
+            f"{index + 1}. {slots[index][2]}: {error}" if index < len(slots) else f"{index + 1}. {error}"
+            for index, error in sorted(errors.items())
+        )
+        lines.append("")
+        lines.append("Исправьте и отправьте числа еще раз (уже записанные просто обновятся) или нажмите «Отмена»")
+        await message.answer("\n".join(lines), reply_markup=cancel_btn)
+    else:
+        await state.clear()
+        await message.answer("\n".join(lines), reply_markup=options_btn)
 
 
 @dp.message()
@@ -232,11 +458,120 @@ async def everything_else(message: Message):
     await message.answer("Я тебя не понимаю")
 
 
+def metrics_tasks(shard=0):
+    tasks = [asyncio.create_task(monitor_event_loop())]
+    if METRICS_LOG_INTERVAL:
+        tasks.append(asyncio.create_task(log_summary(METRICS_LOG_INTERVAL)))
+    if METRICS_PORT:
+        tasks.append(asyncio.create_task(run_metrics_server(METRICS_HOST, METRICS_PORT + shard)))
+    return tasks
+
+
+@asynccontextmanager
+async def lifespan(background=True, shard=0):
+    db = dp['db'] = await create_database().open()
+    data_version_watcher.bind(db.writer)
+    async with db.read() as conn:
+        await schedule_index.refresh(conn)
+    attendance_queue = dp['attendance_queue'] = AttendanceWriteQueue(db).start()
+    tasks = metrics_tasks(shard)
+    # в режиме с воркерами напоминания и рассылки отправляет только один процесс
+    if background:
+        tasks += [
+            asyncio.create_task(ReminderScheduler(bot, db).run()),
+            asyncio.create_task(Outbox(bot, db).run()),
+        ]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await attendance_queue.stop()
+        await storage.close()
+        await db.close()
+
+
+async def run_worker_process(shard):
+    configure_logging()
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    queue = await UpdateQueue().open()
+    try:
+        async with lifespan(background=shard == 0, shard=shard):
+            await run_worker(dp, bot, queue, shard, stop=stop)
+    finally:
+        await queue.close()
+        await bot.session.close()
+
+
+def worker_process(shard):
+    asyncio.run(run_worker_process(shard))
+
+
+def start_worker(shard):
+    process = multiprocessing.get_context('spawn').Process(target=worker_process, args=(shard,), daemon=True)
+    process.start()
+    return process
+
+
+async def supervise(workers, interval=5):
+    """Перезапускает упавшие воркеры: иначе обновления их шарда копились бы в очереди."""
+    while True:
+        await asyncio.sleep(interval)
+        for shard, process in enumerate(workers):
+            if not process.is_alive():
+                logger.error('Воркер %s завершился с кодом %s, перезапуск', shard, process.exitcode)
+                workers[shard] = start_worker(shard)
+
+
+async def run_sharded():
+    queue = await UpdateQueue().open()
+    await queue.reshard(BOT_WORKERS)
+    workers = [start_worker(shard) for shard in range(BOT_WORKERS)]
+    supervisor = asyncio.create_task(supervise(workers))
+    try:
+        if BOT_MODE == 'webhook':
+            path = os.getenv('WEBHOOK_PATH', '/tg/')
+            await run_webhook(
+                dp, bot,
+                url=os.getenv('WEBHOOK_URL'),
+                path=path,
+                secret_token=os.getenv('WEBHOOK_SECRET'),
+                port=int(os.getenv('WEBHOOK_PORT', 8080)),
+                app=create_ingress_app(queue, BOT_WORKERS, path, os.getenv('WEBHOOK_SECRET')),
+            )
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await poll_updates(bot, queue, BOT_WORKERS, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        supervisor.cancel()
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
+        await queue.close()
+        await bot.session.close()
+
+
 async def main():
     configure_logging()
-    dp['dbconn'] = await connect_to_db()
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    if BOT_WORKERS > 1:
+        await run_sharded()
+        return
+
+    async with lifespan():
+        if BOT_MODE == 'webhook':
+            await run_webhook(
+                dp, bot,
+                url=os.getenv('WEBHOOK_URL'),
+                path=os.getenv('WEBHOOK_PATH', '/tg/'),
+                secret_token=os.getenv('WEBHOOK_SECRET'),
+                port=int(os.getenv('WEBHOOK_PORT', 8080)),
+            )
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+"""
+Метрики бота без внешних зависимостей: гистограммы времени обработчиков aiogram, запросов
+bot/sql_queries.py и задержки цикла событий.
+
+HandlerMetricsMiddleware подключается к Dispatcher и меряет каждое обновление целиком (фильтры,
+FSM, обработчик) с метками handler и outcome. Запросы выполняются через timed_execute и
+timed_executemany: время меряется вокруг самого conn.execute и записывается под именем запроса,
+а не текстом SQL, поэтому ответы из кэша не попадают в метрику, а вложенные вызовы не
+считаются дважды. Все это отдается в текстовом формате Prometheus на GET /metrics
+(run_metrics_server) и раз в несколько минут сводкой в лог.
+"""
+import asyncio
+import bisect
+import contextlib
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин в секундах: от долей миллисекунды (запросы SQLite) до секунд (медленный Bot API)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами для каждого набора значений меток."""
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # значения меток -> [счетчики по корзинам (последняя — +Inf), сумма]
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def snapshot(self) -> dict:
+        """Копия счетчиков {значения меток: (счетчики по корзинам, сумма)} для сводок по интервалам."""
+        return {labels: (tuple(counts), total) for labels, (counts, total) in self._series.items()}
+
+    def clear(self):
+        self._series.clear()
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for label_values, (counts, total) in sorted(self._series.items()):
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+            suffix = f'{{{labels}}}' if labels else ''
+            yield f'{self.name}_sum{suffix} {total}'
+            yield f'{self.name}_count{suffix} {cumulative}'
+
+    def quantile(self, counts, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q (для +Inf — последняя граница)."""
+        rank = q * sum(counts)
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = []
+
+    def histogram(self, name: str, documentation: str, labels=(), buckets=BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, labels, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        return '\n'.join(line for histogram in self.histograms for line in histogram.render()) + '\n'
+
+    def clear(self):
+        for histogram in self.histograms:
+            histogram.clear()
+
+
+registry = Registry()
+handler_seconds = registry.histogram(
+    'bot_handler_seconds', 'Время обработки обновления Telegram', ('handler', 'outcome'),
+)
+sql_seconds = registry.histogram('bot_sql_seconds', 'Время запроса из bot/sql_queries.py', ('query',))
+event_loop_lag_seconds = registry.histogram(
+    'bot_event_loop_lag_seconds', 'Насколько позже срока просыпается задача в цикле событий',
+)
+
+
+@contextlib.asynccontextmanager
+async def timed_execute(conn, name: str, sql: str, parameters=()):
+    """
+    Курсор conn.execute(sql, parameters); время от отправки запроса до закрытия курсора, то есть
+    вместе с выборкой строк, записывается в bot_sql_seconds с меткой query=name.
+    """
+    started = time.perf_counter()
+    try:
+        async with conn.execute(sql, parameters) as cursor:
+            yield cursor
+    finally:
+        sql_seconds.observe(time.perf_counter() - started, name)
+
+
+async def timed_executemany(conn, name: str, sql: str, parameters):
+    """conn.executemany(sql, parameters) с записью времени в bot_sql_seconds с меткой query=name."""
+    started = time.perf_counter()
+    try:
+        return await conn.executemany(sql, parameters)
+    finally:
+        sql_seconds.observe(time.perf_counter() - started, name)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Внешний middleware обновлений: время от начала обработки обновления до возврата из
+    обработчика по меткам handler (имя функции) и outcome: ok, error или unhandled, если ни
+    один обработчик не подошел. Обработчик выбирается глубже, в наблюдателе события, поэтому
+    его имя записывает в переданную через data метку внутренний middleware (_record_handler).
+    """
+    DATA_KEY = 'metrics_handler'
+
+    def __init__(self, histogram: Histogram = handler_seconds):
+        self.histogram = histogram
+
+    def setup(self, dispatcher: Dispatcher):
+        dispatcher.update.outer_middleware(self)
+        for name, observer in dispatcher.observers.items():
+            if name not in ('update', 'error'):
+                observer.middleware(self._record_handler)
+
+    async def _record_handler(self, handler, event, data):
+        label = data.get(self.DATA_KEY)
+        if label is not None:
+            callback = data['handler'].callback
+            label[0] = getattr(callback, '__name__', type(callback).__name__)
+        return await handler(event, data)
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        label = data[self.DATA_KEY] = ['unhandled']
+        outcome = 'error'
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+            outcome = 'unhandled' if result is UNHANDLED else 'ok'
+            return result
+        finally:
+            self.histogram.observe(time.perf_counter() - started, label[0], outcome)
+
+
+async def monitor_event_loop(interval: float = 0.5, histogram: Histogram = event_loop_lag_seconds):
+    """
+    Засыпает на interval и записывает, на сколько позже проснулся: столько же ждали все
+    обработчики, пока цикл был занят синхронным кодом.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        histogram.observe(max(loop.time() - started - interval, 0.0))
+
+
+def create_metrics_app(metrics: Registry = registry) -> web.Application:
+    async def handle(request):
+        return web.Response(body=metrics.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    return app
+
+
+async def run_metrics_server(host: str, port: int, metrics: Registry = registry):
+    runner = web.AppRunner(create_metrics_app(metrics))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Метрики доступны на http://%s:%s/metrics', host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def summarize(histogram: Histogram, previous: dict, limit: int = 5):
+    """
+    Строки сводки за интервал с момента снимка previous: до limit наборов меток с наибольшим
+    суммарным временем, с числом вызовов, средним и оценкой p95 по корзинам.
+    """
+    rows = []
+    for label_values, (counts, total) in histogram.snapshot().items():
+        before_counts, before_total = previous.get(label_values, ((0,) * len(counts), 0.0))
+        delta = [now - before for now, before in zip(counts, before_counts)]
+        calls = sum(delta)
+        if calls:
+            rows.append((total - before_total, calls, delta, label_values))
+    rows.sort(reverse=True)
+    return [
+        f"{histogram.name}{{{','.join(map(str, label_values))}}}: {calls} шт., "
+        f"среднее {seconds / calls * 1000:.1f} мс, p95 <= {histogram.quantile(delta, 0.95) * 1000:g} мс"
+        for seconds, calls, delta, label_values in rows[:limit]
+    ]
+
+
+async def log_summary(interval: float = 300, metrics: Registry = registry):
+    """Раз в interval секунд пишет в лог самые затратные обработчики, запросы и задержку цикла событий."""
+    previous = {histogram.name: histogram.snapshot() for histogram in metrics.histograms}
+    while True:
+        await asyncio.sleep(interval)
+        for histogram in metrics.histograms:
+            lines = summarize(histogram, previous[histogram.name])
+            previous[histogram.name] = histogram.snapshot()
+            if lines:
+                logger.info('За %d с:\n%s', interval, '\n'.join(lines))
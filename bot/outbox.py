@@ -0,0 +1,142 @@
+"""
+Исходящие сообщения с учетом лимитов Telegram.
+
+RateLimitMiddleware подключается к сессии бота и пропускает через общий token bucket все методы,
+адресованные чату (ответы обработчиков, напоминания, рассылки); на 429 ждет retry_after и
+повторяет запрос. Outbox отправляет сообщения из таблицы training_outboundmessage (рассылки из
+админки) не чаще раза в chat_interval в один чат и записывает результат обратно, поэтому
+неотправленное переживает перезапуск бота. Сообщение, отправленное прямо перед падением,
+может уйти повторно. Ответы обработчиков лимит на чат не задерживает: на несколько быстрых
+нажатий кнопок подряд бот отвечает сразу.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from bot.sql_queries import get_pending_messages, update_outbound_messages
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Не больше rate событий в секунду в среднем и capacity подряд; reserve() возвращает, сколько ждать."""
+
+    def __init__(self, rate: float, capacity: float = None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+
+    def reserve(self) -> float:
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        return max(wait, self._paused_until - now)
+
+    def pause(self, seconds: float):
+        """После 429 новые резервы ждут, пока не истечет retry_after."""
+        self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+
+class ChatLimiter:
+    """Не чаще одного сообщения в interval секунд в один чат."""
+
+    def __init__(self, interval: float, clock=time.monotonic, max_chats: int = 10000):
+        self.interval = interval
+        self.clock = clock
+        self.max_chats = max_chats
+        self._next_at = {}
+
+    def reserve(self, chat_id) -> float:
+        now = self.clock()
+        if len(self._next_at) > self.max_chats:
+            self._next_at = {chat: at for chat, at in self._next_at.items() if at > now}
+        send_at = max(now, self._next_at.get(chat_id, now))
+        self._next_at[chat_id] = send_at + self.interval
+        return send_at - now
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    def __init__(self, rate: float = 25, burst: float = 5, max_retries: int = 5):
+        # за любую секунду уходит не больше rate + burst сообщений
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.retries = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        for attempt in range(self.max_retries + 1):
+            wait = self.bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning('429 от Telegram для чата %s, пауза %s с', chat_id, e.retry_after)
+                self.bucket.pause(e.retry_after)
+
+
+class Outbox:
+    def __init__(self, bot: Bot, db, *, batch_size: int = 100, poll_interval: float = 2, max_attempts: int = 5,
+                 chat_interval: float = 1):
+        self.bot = bot
+        self.db = db
+        self.chats = ChatLimiter(chat_interval)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+    async def deliver(self, row):
+        """Возвращает (status, attempts, error, sent_date, id) для update_outbound_messages."""
+        attempts = row['attempts'] + 1
+        reply_markup = InlineKeyboardMarkup.model_validate_json(row['reply_markup']) if row['reply_markup'] else None
+        wait = self.chats.reserve(row['chat_id'])
+        if wait:
+            await asyncio.sleep(wait)
+        try:
+            await self.bot.send_message(row['chat_id'], row['text'], reply_markup=reply_markup)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # тренер заблокировал бота или чат не существует — повтор не поможет
+            return 'failed', attempts, str(e)[:255], None, row['id']
+        except TelegramAPIError as e:
+            status = 'failed' if attempts >= self.max_attempts else 'pending'
+            return status, attempts, str(e)[:255], None, row['id']
+        return 'sent', attempts, '', datetime.now(timezone.utc).replace(tzinfo=None), row['id']
+
+    async def process(self):
+        """Отправляет одну пачку; возвращает результаты или [] если очередь пуста."""
+        async with self.db.read() as conn:
+            rows = await get_pending_messages(conn, self.batch_size)
+        if not rows:
+            return []
+        results = await asyncio.gather(*(self.deliver(row) for row in rows))
+        async with self.db.write() as conn:
+            await update_outbound_messages(conn, results)
+        return results
+
+    async def run(self):
+        while True:
+            try:
+                results = await self.process()
+            except Exception:
+                logger.exception('Ошибка отправки исходящих сообщений')
+                results = None
+            if not results or any(status == 'pending' for status, *rest in results):
+                await asyncio.sleep(self.poll_interval)
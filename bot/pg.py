@@ -0,0 +1,211 @@
+"""
+PostgreSQL для бота: пул соединений asyncpg по тем же настройкам DATABASES, что у Django.
+
+Запросы bot/sql_queries.py написаны под aiosqlite: плейсхолдеры ?, execute() как async-контекст
+с курсором, commit() в конце записи. PostgresConnection дает то же подмножество API поверх
+соединения asyncpg: переводит ? в $1..$n (знаков ? внутри строковых литералов в запросах нет),
+а даты и время в результатах отдает строками ISO, как Django хранит их в SQLite. Поэтому
+запросы и обработчики одинаково работают с обеими базами.
+"""
+import asyncio
+import itertools
+import os
+import re
+import secrets
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time, timezone
+from functools import lru_cache
+
+import asyncpg
+
+
+DIALECT = 'postgresql'
+# Свой у каждого процесса бота: по нему триггеры bot_data_version (миграция training 0013) ведут
+# отдельный счетчик записей процесса, а data_version() не учитывает собственные коммиты
+APPLICATION_NAME = f'trainings-bot-{os.getpid()}-{secrets.token_hex(4)}'
+
+
+@lru_cache(maxsize=512)
+def translate(sql: str) -> str:
+    numbers = itertools.count(1)
+    return re.sub(r'\?', lambda match: f'${next(numbers)}', sql)
+
+
+def _sqlite_value(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat(' ')
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+class Row:
+    """Строка результата с доступом по имени и по номеру колонки, как aiosqlite.Row."""
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]] if isinstance(key, str) else self._values[key]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def keys(self):
+        return list(self._index)
+
+
+class Cursor:
+    def __init__(self, records):
+        index = {name: i for i, name in enumerate(records[0].keys())} if records else {}
+        self._rows = [Row(index, tuple(_sqlite_value(value) for value in record.values())) for record in records]
+        self._position = 0
+
+    async def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+    async def fetchall(self):
+        rows, self._position = self._rows[self._position:], len(self._rows)
+        return rows
+
+
+class _Execution:
+    """Результат execute(): его можно и дождаться, и открыть через async with, как в aiosqlite."""
+
+    def __init__(self, coroutine):
+        self._coroutine = coroutine
+
+    def __await__(self):
+        return self._coroutine.__await__()
+
+    async def __aenter__(self):
+        return await self._coroutine
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class PostgresConnection:
+    """
+    Обертка соединения asyncpg. В режиме transactional первая команда открывает транзакцию, а
+    commit() ее завершает — так же, как неявные транзакции sqlite3. Команды на одном соединении
+    идут по очереди: asyncpg не допускает параллельных запросов в одном соединении.
+    """
+    dialect = DIALECT
+
+    def __init__(self, conn: asyncpg.Connection, *, transactional: bool):
+        self._conn = conn
+        self._transactional = transactional
+        self._transaction = None
+        self._lock = asyncio.Lock()
+
+    async def _begin(self):
+        if self._transactional and self._transaction is None:
+            self._transaction = self._conn.transaction()
+            await self._transaction.start()
+
+    async def _execute(self, sql, parameters):
+        async with self._lock:
+            await self._begin()
+            return Cursor(await self._conn.fetch(translate(sql), *parameters))
+
+    def execute(self, sql: str, parameters=()):
+        return _Execution(self._execute(sql, parameters))
+
+    async def executemany(self, sql: str, parameters):
+        async with self._lock:
+            await self._begin()
+            await self._conn.executemany(translate(sql), list(parameters))
+
+    async def commit(self):
+        async with self._lock:
+            if self._transaction is not None:
+                await self._transaction.commit()
+                self._transaction = None
+
+    async def rollback(self):
+        async with self._lock:
+            if self._transaction is not None:
+                await self._transaction.rollback()
+                self._transaction = None
+
+    async def data_version(self):
+        """
+        Аналог PRAGMA data_version для DataVersionWatcher: сумма счетчиков bot_data_version всех
+        писателей, кроме этого процесса. Как и в SQLite, кэши сбрасывают чужие коммиты — правки
+        в админке, команды manage.py и записи других воркеров бота, — но не собственные.
+        """
+        async with self.execute(
+                "SELECT COALESCE(SUM(version), 0)::bigint FROM bot_data_version "
+                "WHERE writer <> current_setting('application_name')"
+        ) as cursor:
+            return (await cursor.fetchone())[0]
+
+    async def close(self):
+        await self._conn.close()
+
+
+def connect_kwargs(config: dict) -> dict:
+    """Параметры asyncpg из DATABASES['default'] Django."""
+    return {
+        'database': config['NAME'],
+        'user': config.get('USER') or None,
+        'password': config.get('PASSWORD') or None,
+        'host': config.get('HOST') or None,
+        'port': int(config['PORT']) if config.get('PORT') else None,
+        'server_settings': {'application_name': APPLICATION_NAME},
+    }
+
+
+class PostgresDatabase:
+    """
+    Тот же интерфейс, что у bot.db.Database: read() и write() выдают соединения из общего пула.
+    В отличие от SQLite, записи не сериализуются замком — параллельные транзакции разводит
+    сам PostgreSQL. writer — отдельное соединение вне пула для служебных запросов
+    (DataVersionWatcher), чтобы проверки кэшей не занимали пул.
+    """
+
+    def __init__(self, config: dict, *, min_size: int = 1, max_size: int = int(os.getenv('DB_POOL_SIZE', 10))):
+        self.connect_kwargs = connect_kwargs(config)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.writer = None
+        self._pool = None
+
+    async def open(self):
+        self._pool = await asyncpg.create_pool(min_size=self.min_size, max_size=self.max_size, **self.connect_kwargs)
+        self.writer = PostgresConnection(await asyncpg.connect(**self.connect_kwargs), transactional=False)
+        return self
+
+    async def close(self):
+        if self.writer is not None:
+            await self.writer.close()
+            self.writer = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    @asynccontextmanager
+    async def read(self):
+        async with self._pool.acquire() as conn:
+            yield PostgresConnection(conn, transactional=False)
+
+    @asynccontextmanager
+    async def write(self):
+        async with self._pool.acquire() as conn:
+            connection = PostgresConnection(conn, transactional=True)
+            try:
+                yield connection
+            finally:
+                # незакоммиченное (в том числе после исключения) откатывается до возврата в пул
+                await connection.rollback()
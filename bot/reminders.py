@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, time, timedelta
+from typing import NamedTuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.utils.keyboard import InlineKeyboardButton, InlineKeyboardBuilder
+
+from bot.callbacks import pack_attendance
+from bot.sql_queries import data_version_watcher, get_day_reminders, get_recorded_training_ids
+
+
+logger = logging.getLogger(__name__)
+
+
+class Reminder(NamedTuple):
+    fire_at: datetime
+    schedule_id: int
+    training_id: int
+    chat_id: str
+    text: str
+
+
+class ReminderScheduler:
+    """
+    Напоминает тренеру ввести посещаемость, когда занятие закончилось.
+
+    События дня (TrainingSchedule.end_time) строятся один раз и лежат в куче по времени
+    срабатывания, так что проверка без наступивших событий — это просмотр вершины кучи. Когда
+    data_version_watcher замечает правки в админке, расписание дня перечитывается одним
+    запросом, а в куче меняются только записи, у которых что-то поменялось; старые записи
+    удаляются лениво при извлечении.
+    """
+
+    def __init__(self, bot: Bot, db, *, clock=datetime.now, check_interval: float = 30):
+        self.bot = bot
+        self.db = db
+        self.clock = clock
+        self.check_interval = check_interval
+        self._heap = []
+        self._entries = {}
+        self._fired = set()
+        self._day = None
+        self._dirty = False
+        # сколько записей кучи просмотрено и сколько записей изменено при перечитывании — для тестов
+        self.examined = 0
+        self.changed = 0
+        data_version_watcher.subscribe(self.invalidate)
+
+    def invalidate(self):
+        self._dirty = True
+
+    async def load(self, conn, now: datetime):
+        """Сверяет события дня с базой; в новый день строит их заново."""
+        day = now.date()
+        if day != self._day:
+            self._day = day
+            self._heap, self._entries, self._fired = [], {}, set()
+        self._dirty = False
+
+        fresh = {}
+        for row in await get_day_reminders(conn, day):
+            end_time = time.fromisoformat(row['end_time'])
+            fresh[row['id']] = Reminder(
+                fire_at=datetime.combine(day, end_time),
+                schedule_id=row['id'],
+                training_id=row['training_id'],
+                chat_id=row['tg_id'],
+                text=f"{row['name']} с {row['start_time'][:-3]} до {row['end_time'][:-3]}",
+            )
+
+        for schedule_id in self._entries.keys() - fresh.keys():
+            del self._entries[schedule_id]
+            self.changed += 1
+        for schedule_id, reminder in fresh.items():
+            if schedule_id in self._fired or self._entries.get(schedule_id) == reminder:
+                continue
+            if reminder.fire_at <= now:
+                # занятие закончилось до запуска бота или время перенесли в прошлое
+                self._entries.pop(schedule_id, None)
+                continue
+            if schedule_id in self._entries:
+                self.changed += 1
+            self._entries[schedule_id] = reminder
+            heapq.heappush(self._heap, (reminder.fire_at, schedule_id))
+
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(reminder.fire_at, schedule_id) for schedule_id, reminder in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def pop_due(self, now: datetime):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, schedule_id = heapq.heappop(self._heap)
+            self.examined += 1
+            reminder = self._entries.get(schedule_id)
+            if reminder is None or reminder.fire_at != fire_at:
+                continue
+            del self._entries[schedule_id]
+            self._fired.add(schedule_id)
+            due.append(reminder)
+        return due
+
+    async def tick(self, now: datetime = None):
+        now = now or self.clock()
+        await data_version_watcher.check(self.db.writer)
+        if not (now.date() != self._day or self._dirty or (self._heap and self._heap[0][0] <= now)):
+            return []
+
+        async with self.db.read() as conn:
+            if now.date() != self._day or self._dirty:
+                await self.load(conn, now)
+            due = self.pop_due(now)
+            recorded = await get_recorded_training_ids(conn, {r.training_id for r in due}, now.date()) if due else set()
+
+        for reminder in due:
+            if reminder.training_id not in recorded:
+                await self.send(reminder)
+        return due
+
+    async def send(self, reminder: Reminder):
+        keyboard = InlineKeyboardBuilder()
+        keyboard.add(InlineKeyboardButton(
+            text='Ввести количество',
+            callback_data=pack_attendance(reminder.schedule_id, reminder.training_id, reminder.fire_at.date()),
+        ))
+        try:
+            await self.bot.send_message(
+                reminder.chat_id,
+                f'Занятие закончилось: {reminder.text}\nСколько человек пришло?',
+                reply_markup=keyboard.as_markup(),
+            )
+        except TelegramAPIError:
+            logger.warning('Не удалось отправить напоминание тренеру %s', reminder.chat_id, exc_info=True)
+
+    def next_wakeup(self, now: datetime) -> float:
+        wake_at = min(now + timedelta(seconds=self.check_interval),
+                      datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        return max((wake_at - now).total_seconds(), 0)
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception('Ошибка планировщика напоминаний')
+            await asyncio.sleep(self.next_wakeup(self.clock()))
@@ -26,6 +26,10 @@ options_btn = ReplyKeyboardMarkup(
         ],
         [
             KeyboardButton(text='Зарплата за месяц'),
+            KeyboardButton(text='История посещаемости'),
+        ],
+        [
+            KeyboardButton(text='Незаполненные занятия'),
         ]
     ],
     resize_keyboard=True,
@@ -0,0 +1,54 @@
+from typing import NamedTuple
+
+import aiosqlite
+
+from bot.cache import DataVersionWatcher
+from bot.sql_queries import data_version_watcher, get_weekly_schedule
+
+
+class Slot(NamedTuple):
+    schedule_id: int
+    training_id: int
+    start_date: str
+    end_date: str
+    text: str
+
+
+class ScheduleIndex:
+    """
+    Недельное расписание в памяти: (trainer_id, день недели) -> отсортированные по времени слоты
+    с готовым текстом кнопки. Перечитывается, только когда data_version_watcher замечает, что
+    базу меняло другое соединение (админка).
+    """
+
+    def __init__(self, watcher: DataVersionWatcher = data_version_watcher):
+        self.watcher = watcher
+        self._slots = None
+        watcher.subscribe(self.invalidate)
+
+    def invalidate(self):
+        self._slots = None
+
+    async def refresh(self, conn: aiosqlite.Connection):
+        slots = {}
+        for row in await get_weekly_schedule(conn):
+            slots.setdefault((row['trainer_id'], row['day_of_week']), []).append(Slot(
+                schedule_id=row['id'],
+                training_id=row['training_id'],
+                start_date=row['start_date'],
+                end_date=row['end_date'],
+                text=f"{row['name']} с {row['start_time'][:-3]} до {row['end_time'][:-3]}",
+            ))
+        self._slots = slots
+
+    async def get_slots(self, conn: aiosqlite.Connection, trainer_id: int, day):
+        await self.watcher.check(conn)
+        if self._slots is None:
+            await self.refresh(conn)
+
+        day_str = day.isoformat()
+        return [
+            slot
+            for slot in self._slots.get((trainer_id, day.strftime('%a').lower()), ())
+            if slot.start_date <= day_str <= slot.end_date
+        ]
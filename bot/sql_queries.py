@@ -1,116 +1,329 @@
+from datetime import timedelta
+
 import aiosqlite
 
+from bot.cache import DataVersionWatcher, TTLCache
+from bot.metrics import timed_execute, timed_executemany
+
+# (trainer_id, первое число месяца) -> сумма
+salary_cache = TTLCache(maxsize=4096, ttl=300)
+# tg_id -> строка training_trainer или None для неизвестных пользователей
+trainer_cache = TTLCache(maxsize=4096, ttl=600)
+
+# Правки в админке идут через другое соединение, поэтому кэши сбрасываются по PRAGMA data_version
+data_version_watcher = DataVersionWatcher()
+data_version_watcher.subscribe(salary_cache.clear)
+data_version_watcher.subscribe(trainer_cache.clear)
+
+_MISSING = object()
+
+
+def _date_param(conn) -> str:
+    """
+    Плейсхолдер даты в списке SELECT: PostgreSQL не выводит тип такого параметра из столбца
+    INSERT, а в SQLite CAST(.. AS DATE) превратил бы строку даты в число.
+    """
+    return '?::date' if getattr(conn, 'dialect', 'sqlite') == 'postgresql' else '?'
+
 
 async def get_trainer_by_phone(conn: aiosqlite.Connection, phone_number: str):
-    async with conn.execute('SELECT * FROM training_trainer WHERE phone_number = ?', (phone_number,)) as cursor:
-        return await cursor.fetchone()
+    async with timed_execute(
+            conn, 'get_trainer_by_phone', 'SELECT * FROM training_trainer WHERE phone_number = ?', (phone_number,)
+    ) as cursor:
+        trainer = await cursor.fetchone()
+    if trainer and trainer['tg_id']:
+        trainer_cache.set(trainer['tg_id'], trainer)
+    return trainer
 
 
 async def get_trainer_by_tg_id(conn: aiosqlite.Connection, tg_id: str):
-    async with conn.execute('SELECT * FROM training_trainer WHERE tg_id = ?', (tg_id,)) as cursor:
-        return await cursor.fetchone()
+    await data_version_watcher.check(conn)
+    trainer = trainer_cache.get(tg_id, _MISSING)
+    if trainer is not _MISSING:
+        return trainer
+
+    async with timed_execute(
+            conn, 'get_trainer_by_tg_id', 'SELECT * FROM training_trainer WHERE tg_id = ?', (tg_id,)
+    ) as cursor:
+        trainer = await cursor.fetchone()
+    trainer_cache.set(tg_id, trainer)
+    return trainer
 
 
 async def update_trainer_tg_id(conn: aiosqlite.Connection, phone_number: str, tg_id: str):
-    await conn.execute('UPDATE training_trainer SET tg_id = ? WHERE phone_number = ?', (tg_id, phone_number))
+    # прежний tg_id нужно убрать из trainer_cache, иначе старый аккаунт Telegram до истечения TTL
+    # продолжит считаться этим тренером
+    async with timed_execute(
+            conn, 'get_trainer_tg_id', 'SELECT tg_id FROM training_trainer WHERE phone_number = ?', (phone_number,)
+    ) as cursor:
+        previous = await cursor.fetchone()
+    async with timed_execute(
+            conn, 'update_trainer_tg_id',
+            'UPDATE training_trainer SET tg_id = ? WHERE phone_number = ? RETURNING *',
+            (tg_id, phone_number)
+    ) as cursor:
+        trainer = await cursor.fetchone()
     await conn.commit()
+    if previous and previous['tg_id'] and previous['tg_id'] != tg_id:
+        trainer_cache.pop(previous['tg_id'])
+    if trainer:
+        trainer_cache.set(tg_id, trainer)
 
 
-async def get_yesterday_trainings(conn: aiosqlite.Connection, trainer_id: int, yesterday_date):
-    yesterday_weekday = yesterday_date.strftime('%a').lower()
-    async with conn.execute(
+async def get_weekly_schedule(conn: aiosqlite.Connection):
+    async with timed_execute(
+            conn, 'get_weekly_schedule',
             '''
-        SELECT ts.* FROM training_trainingschedule ts
+        SELECT ts.id, ts.training_id, ts.day_of_week, ts.start_time, ts.end_time,
+               t.name, t.trainer_id, t.start_date, t.end_date
+        FROM training_trainingschedule ts
         JOIN training_training t ON ts.training_id = t.id
-        WHERE t.trainer_id = ? AND ts.day_of_week = ?
-        ORDER BY ts.start_time
-        ''',
-            (trainer_id, yesterday_weekday)
+        WHERE t.trainer_id IS NOT NULL
+        ORDER BY ts.start_time, ts.id
+        '''
     ) as cursor:
         return await cursor.fetchall()
 
 
-async def get_today_trainings(conn: aiosqlite.Connection, trainer_id: int, today_date):
-    today_weekday = today_date.strftime('%a').lower()
-    async with conn.execute(
+async def add_or_update_attendance(conn: aiosqlite.Connection, data: dict):
+    await add_or_update_attendances(conn, [data])
+
+
+async def add_or_update_attendances(conn: aiosqlite.Connection, rows: list):
+    """
+    Записывает посещаемость одним UPSERT на строку по уникальному (training_id, recording_date),
+    пересчитывает затронутые строки сводки зарплат и коммитит все одной транзакцией.
+    """
+    await timed_executemany(
+        conn, 'add_or_update_attendances',
+        '''
+        INSERT INTO training_attendance (training_id, attend_count, recording_day, recording_date, created_date, update_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (training_id, recording_date) DO UPDATE SET
+            attend_count = excluded.attend_count,
+            recording_day = excluded.recording_day,
+            update_date = excluded.update_date
+        ''',
+        [
+            (data['training_id'], data['attend_count'], data['recording_day'], data['recording_date'],
+             data['created_date'], data['update_date'])
+            for data in rows
+        ]
+    )
+
+    if getattr(conn, 'dialect', 'sqlite') == 'postgresql':
+        # В PostgreSQL записи идут параллельными транзакциями, и пересчет сводки в одной из них не
+        # видит незакоммиченную посещаемость другой: блокировка тренеров до конца транзакции
+        # выстраивает пересчеты одного тренера по очереди. В SQLite записи сериализует Database.write().
+        training_ids = sorted({data['training_id'] for data in rows})
+        async with timed_execute(
+            conn, 'lock_payroll_trainers',
+            f'''
+            SELECT pg_advisory_xact_lock(trainer_id) FROM (
+                SELECT DISTINCT trainer_id FROM training_training
+                WHERE id IN ({", ".join("?" * len(training_ids))}) AND trainer_id IS NOT NULL
+                ORDER BY trainer_id
+            ) trainers
+            ''',
+            training_ids
+        ):
+            pass
+
+    cache_keys = set()
+    for training_id, month in {(data['training_id'], data['recording_date'].replace(day=1)) for data in rows}:
+        trainer_id = await refresh_trainer_monthly_payroll(conn, training_id, month)
+        if trainer_id:
+            cache_keys.add((trainer_id, month))
+    await conn.commit()
+
+    for key in cache_keys:
+        salary_cache.pop(key)
+
+
+async def refresh_trainer_monthly_payroll(conn: aiosqlite.Connection, training_id: int, recording_date):
+    """
+    Пересчитывает строку сводки training_trainermonthlypayroll за месяц recording_date для тренера
+    занятия training_id одним агрегирующим запросом (тарифы применяются в SQL, берется первая цена
+    занятия, поэтому строки не размножаются) и возвращает id тренера. Коммит остается за вызывающим,
+    чтобы сводка менялась в одной транзакции с посещаемостью.
+    """
+    month = recording_date.replace(day=1)
+    next_month = (month + timedelta(days=32)).replace(day=1)
+    async with timed_execute(
+        conn, 'refresh_trainer_monthly_payroll',
+        f'''
+        WITH owner AS (
+            SELECT trainer_id FROM training_training WHERE id = ? AND trainer_id IS NOT NULL
+        )
+        INSERT INTO training_trainermonthlypayroll (trainer_id, month, classes, participants, amount)
+        SELECT owner.trainer_id, {_date_param(conn)}, COUNT(a.id), COALESCE(SUM(a.attend_count), 0),
+               COALESCE(SUM(a.attend_count * CASE WHEN a.attend_count <= p.quantity_to
+                                                  THEN p.price_to ELSE p.price_from END), 0)
+        FROM owner
+        JOIN training_training t ON t.trainer_id = owner.trainer_id
+        JOIN training_price p ON p.id = (SELECT MIN(id) FROM training_price WHERE training_id = t.id)
+        LEFT JOIN training_attendance a
+               ON a.training_id = t.id AND a.recording_date >= ? AND a.recording_date < ?
+        GROUP BY owner.trainer_id
+        ON CONFLICT (trainer_id, month) DO UPDATE SET
+            classes = excluded.classes,
+            participants = excluded.participants,
+            amount = excluded.amount
+        RETURNING trainer_id
+        ''',
+        (training_id, month, month, next_month)
+    ) as cursor:
+        payroll = await cursor.fetchone()
+
+    return payroll['trainer_id'] if payroll else None
+
+
+async def get_trainer_salary_for_month(conn: aiosqlite.Connection, trainer_id: int, month):
+    salaries = await get_trainer_salary_for_months(conn, trainer_id, [month])
+    return salaries[month.replace(day=1)]
+
+
+async def get_trainer_salary_for_months(conn: aiosqlite.Connection, trainer_id: int, months):
+    """Зарплата за несколько месяцев: {первое число месяца: сумма}, не больше одного запроса."""
+    months = sorted({month.replace(day=1) for month in months})
+    salaries = {month: salary_cache.get((trainer_id, month)) for month in months}
+
+    missing = [month for month, salary in salaries.items() if salary is None]
+    if missing:
+        async with timed_execute(
+                conn, 'get_trainer_salary_for_months',
+                '''
+            SELECT month, amount FROM training_trainermonthlypayroll
+            WHERE trainer_id = ? AND month BETWEEN ? AND ?
+            ''',
+                (trainer_id, missing[0], missing[-1])
+        ) as cursor:
+            amounts = {row['month']: row['amount'] for row in await cursor.fetchall()}
+
+        for month in missing:
+            salaries[month] = amounts.get(month.isoformat(), 0)
+            salary_cache.set((trainer_id, month), salaries[month])
+
+    return salaries
+
+
+async def get_day_reminders(conn: aiosqlite.Connection, day):
+    """Занятия дня по расписанию у тренеров, подключивших бота (для напоминаний о посещаемости)."""
+    async with timed_execute(
+            conn, 'get_day_reminders',
             '''
-        SELECT ts.* FROM training_trainingschedule ts
+        SELECT ts.id, ts.training_id, ts.start_time, ts.end_time, t.name, tr.tg_id
+        FROM training_trainingschedule ts
         JOIN training_training t ON ts.training_id = t.id
-        WHERE t.trainer_id = ? AND ts.day_of_week = ?
-        ORDER BY ts.start_time
+        JOIN training_trainer tr ON t.trainer_id = tr.id
+        WHERE ts.day_of_week = ? AND t.start_date <= ? AND t.end_date >= ?
+          AND tr.tg_id IS NOT NULL AND tr.tg_id != ''
         ''',
-            (trainer_id, today_weekday)
+            (day.strftime('%a').lower(), day, day)
     ) as cursor:
         return await cursor.fetchall()
 
 
-async def add_or_update_attendance(conn: aiosqlite.Connection, data: dict):
-    async with conn.execute(
-            '''
-        SELECT * FROM training_attendance 
-        WHERE training_id = ? AND recording_date = ?
+async def get_recorded_training_ids(conn: aiosqlite.Connection, training_ids, recording_date):
+    training_ids = list(training_ids)
+    async with timed_execute(
+            conn, 'get_recorded_training_ids',
+            f'''
+        SELECT training_id FROM training_attendance
+        WHERE recording_date = ? AND training_id IN ({", ".join("?" * len(training_ids))})
         ''',
-            (data['training_id'], data['recording_date'])
+            (recording_date, *training_ids)
     ) as cursor:
-        attendance = await cursor.fetchone()
+        return {row['training_id'] for row in await cursor.fetchall()}
 
-    if attendance:
-        await conn.execute(
-            '''
-            UPDATE training_attendance 
-            SET attend_count = ?, recording_day = ?, update_date = ? 
-            WHERE training_id = ? AND recording_date = ?
-            ''',
-            (data['attend_count'], data['recording_day'], data['update_date'], data['training_id'],
-             data['recording_date'])
-        )
-    else:
-        await conn.execute(
-            '''
-            INSERT INTO training_attendance (training_id, attend_count, recording_day, recording_date, created_date, update_date)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''',
-            (data['training_id'], data['attend_count'], data['recording_day'], data['recording_date'],
-             data['created_date'], data['update_date'])
+
+async def get_trainer_trainings(conn: aiosqlite.Connection, trainer_id: int):
+    async with timed_execute(
+            conn, 'get_trainer_trainings',
+            'SELECT id, name FROM training_training WHERE trainer_id = ? ORDER BY id', (trainer_id,)
+    ) as cursor:
+        return await cursor.fetchall()
+
+
+async def get_attendance_history(conn: aiosqlite.Connection, training_ids, limit: int, cursor=None, newer=False):
+    """
+    Страница посещаемости занятий training_ids в порядке (recording_date, id) от новых к старым.
+
+    cursor — (recording_date, id) строки, от которой листать: без него берутся самые новые
+    записи, иначе limit записей старше cursor, а с newer=True — ближайшие новее него. У занятия
+    не больше одной записи в день, поэтому для каждого занятия читается не больше limit строк
+    индекса (training_id, recording_date), и страница стоит одинаково на любой глубине истории.
+    """
+    training_ids = list(training_ids)
+    if not training_ids:
+        return []
+    direction = 'ASC' if newer else 'DESC'
+    condition, cursor_params = '', ()
+    if cursor is not None:
+        day, pk = cursor
+        condition = (
+            'AND recording_date >= ? AND NOT (recording_date = ? AND id <= ?)' if newer
+            else 'AND recording_date <= ? AND NOT (recording_date = ? AND id >= ?)'
         )
+        cursor_params = (day, day, pk)
 
-    await conn.commit()
+    parts, params = [], []
+    for i, training_id in enumerate(training_ids):
+        parts.append(
+            f'SELECT * FROM (SELECT id, training_id, recording_date, attend_count FROM training_attendance '
+            f'WHERE training_id = ? {condition} ORDER BY recording_date {direction} LIMIT ?) t{i}'
+        )
+        params.extend((training_id, *cursor_params, limit))
+    async with timed_execute(
+            conn, 'get_attendance_history',
+            f'{" UNION ALL ".join(parts)} ORDER BY recording_date {direction}, id {direction} LIMIT ?',
+            (*params, limit)
+    ) as cursor:
+        rows = await cursor.fetchall()
+    return rows[::-1] if newer else rows
 
 
-async def get_trainer_salary_for_month(conn: aiosqlite.Connection, trainer_id: int, start_date, end_date):
-    async with conn.execute(
+async def get_missing_sessions(conn: aiosqlite.Connection, trainer_id: int, start_date, end_date, limit: int):
+    """
+    Занятия тренера из training_trainingsession за период без записи посещаемости за тот день,
+    от новых к старым. NOT EXISTS проверяется по уникальному индексу посещаемости.
+    """
+    async with timed_execute(
+            conn, 'get_missing_sessions',
             '''
-        SELECT a.attend_count, p.price_to, p.quantity_to, p.price_from, p.quantity_from 
-        FROM training_attendance a 
-        JOIN training_training t ON a.training_id = t.id 
-        JOIN training_price p ON t.id = p.training_id 
-        WHERE t.trainer_id = ? AND a.recording_date BETWEEN ? AND ?
+        SELECT s.schedule_id, s.training_id, s.session_date, s.start_time, s.end_time, t.name
+        FROM training_training t
+        JOIN training_trainingsession s ON s.training_id = t.id AND s.session_date BETWEEN ? AND ?
+        WHERE t.trainer_id = ?
+          AND NOT EXISTS (
+              SELECT 1 FROM training_attendance a
+              WHERE a.training_id = s.training_id AND a.recording_date = s.session_date
+          )
+        ORDER BY s.session_date DESC, s.start_time DESC
+        LIMIT ?
         ''',
-            (trainer_id, start_date, end_date)
+            (start_date, end_date, trainer_id, limit)
     ) as cursor:
-        attendances = await cursor.fetchall()
-
-    salary = 0
-    for attendance in attendances:
-        if attendance['attend_count'] <= attendance['quantity_to']:
-            salary += attendance['attend_count'] * attendance['price_to']
-        else:
-            salary += attendance['attend_count'] * attendance['price_from']
-
-    return salary
+        return await cursor.fetchall()
 
 
-async def get_training_id_by_schedule_id(conn: aiosqlite.Connection, schedule_id: int):
-    async with conn.execute(
-            'SELECT training_id FROM training_trainingschedule WHERE id = ?',
-            (schedule_id,)
+async def get_pending_messages(conn: aiosqlite.Connection, limit: int = 100):
+    async with timed_execute(
+            conn, 'get_pending_messages',
+            '''
+        SELECT id, chat_id, text, reply_markup, attempts FROM training_outboundmessage
+        WHERE status = 'pending' ORDER BY id LIMIT ?
+        ''',
+            (limit,)
     ) as cursor:
-        return await cursor.fetchone()
+        return await cursor.fetchall()
 
 
-async def get_training_by_id(conn: aiosqlite.Connection, training_id: int):
-    async with conn.execute(
-        'SELECT name FROM training_training WHERE id = ?',
-        (training_id,)
-    ) as cursor:
-        return await cursor.fetchone()
+async def update_outbound_messages(conn: aiosqlite.Connection, rows: list):
+    """rows — (status, attempts, error, sent_date, id); все обновления одной транзакцией."""
+    await timed_executemany(
+        conn, 'update_outbound_messages',
+        'UPDATE training_outboundmessage SET status = ?, attempts = ?, error = ?, sent_date = ? WHERE id = ?',
+        rows
+    )
+    await conn.commit()
@@ -0,0 +1,1605 @@
+import asyncio
+import inspect
+import json
+import os
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+
+from bot import sql_queries
+from bot.bulk_entry import parse_counts
+from bot.cache import DataVersionWatcher, TTLCache
+from bot.callbacks import pack_attendance, pack_bulk, pack_history, unpack_attendance, unpack_bulk, unpack_history
+from bot.db import Database, connect, create_database
+from bot.fsm_storage import SQLiteStorage
+from bot.metrics import (
+    HandlerMetricsMiddleware, Histogram, Registry, create_metrics_app, monitor_event_loop, sql_seconds, summarize,
+)
+from bot.outbox import ChatLimiter, Outbox, RateLimitMiddleware, TokenBucket
+from bot.reminders import ReminderScheduler
+from bot.schedule_index import ScheduleIndex
+from bot.testing import (
+    POSTGRES_DSN, FakeSession, FakeTelegramServer, copy_database, create_postgres_database, drop_postgres_database,
+    migrate_database, seed_attendance, seed_repository, seed_schedules, seed_synthetic, seed_trainings,
+    truncate_postgres,
+)
+from bot.webhook import create_app, create_ingress_app
+from bot.workers import UpdateQueue, run_worker
+from bot.write_queue import AttendanceWriteQueue
+
+
+class DatabaseTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = await Database(os.path.join(self.tmpdir.name, 'db.sqlite3'), readers=3).open()
+        await self.db.writer.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, payload TEXT)')
+        await self.db.writer.executemany('INSERT INTO item (payload) VALUES (?)', [('x' * 100,)] * 1000)
+        await self.db.writer.commit()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+    async def test_pragmas(self):
+        async with self.db.read() as conn:
+            async with conn.execute('PRAGMA journal_mode') as cursor:
+                self.assertEqual((await cursor.fetchone())[0], 'wal')
+            async with conn.execute('PRAGMA busy_timeout') as cursor:
+                self.assertEqual((await cursor.fetchone())[0], 5000)
+
+    async def test_readers_are_read_only(self):
+        async with self.db.read() as conn:
+            with self.assertRaises(Exception):
+                await conn.execute('DELETE FROM item')
+
+    async def test_write_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            async with self.db.write() as conn:
+                await conn.execute('DELETE FROM item')
+                raise RuntimeError
+
+        async with self.db.read() as conn:
+            async with conn.execute('SELECT COUNT(*) FROM item') as cursor:
+                self.assertEqual((await cursor.fetchone())[0], 1000)
+
+    async def read_latencies(self, count=200):
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            async with self.db.read() as conn:
+                async with conn.execute('SELECT payload FROM item WHERE id = ?', (500,)) as cursor:
+                    await cursor.fetchone()
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    async def write_continuously(self, stop):
+        while not stop.is_set():
+            async with self.db.write() as conn:
+                await conn.executemany('INSERT INTO item (payload) VALUES (?)', [('y' * 100,)] * 500)
+                await conn.commit()
+
+    async def test_read_latency_is_flat_while_writing(self):
+        idle = statistics.median(await self.read_latencies())
+
+        stop = asyncio.Event()
+        writers = [asyncio.create_task(self.write_continuously(stop)) for _ in range(2)]
+        try:
+            busy = statistics.median(await self.read_latencies())
+            # 50 параллельных клиентов, как в бенчмарке repository: клиентов больше, чем соединений
+            # в пуле, но очередь к пулу честная, и ни одно чтение не ждет намного дольше остальных
+            concurrent = sorted(
+                latency
+                for client in await asyncio.gather(*(self.read_latencies(20) for _ in range(50)))
+                for latency in client
+            )
+        finally:
+            stop.set()
+            await asyncio.gather(*writers)
+
+        # Чтения не стоят в очереди за коммитами: медиана растет не больше чем на пару миллисекунд
+        self.assertLess(busy, idle * 3 + 0.002)
+        p50, p99 = concurrent[len(concurrent) // 2], concurrent[int(len(concurrent) * 0.99)]
+        self.assertLess(p99, p50 * 3 + 0.01, f'p50 {p50 * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс')
+
+
+class RepositoryContract:
+    """
+    Одни и те же проверки запросов bot.sql_queries для каждого бэкенда репозитория.
+    Наследник открывает self.db на пустой базе со схемой Django.
+    """
+
+    async def asyncSetUp(self):
+        sql_queries.trainer_cache.clear()
+        sql_queries.salary_cache.clear()
+        self.trainings = await seed_repository(self.db, trainers=2, trainings_per_trainer=2, days=('mon', 'tue'))
+
+    async def fetch(self, sql, params=()):
+        async with self.db.read() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    def attendance(self, training_id, recording_date, attend_count):
+        return {
+            'training_id': training_id,
+            'attend_count': attend_count,
+            'recording_day': recording_date.strftime('%a').lower(),
+            'recording_date': recording_date,
+            'created_date': datetime.now(),
+            'update_date': datetime.now(),
+        }
+
+    async def test_trainer_lookup_and_binding(self):
+        trainer_id, training_id = self.trainings[0]
+        async with self.db.read() as conn:
+            trainer = await sql_queries.get_trainer_by_phone(conn, '996000000000')
+            self.assertEqual(trainer['id'], trainer_id)
+            self.assertIsNone(await sql_queries.get_trainer_by_phone(conn, '000'))
+
+        async with self.db.write() as conn:
+            await sql_queries.update_trainer_tg_id(conn, '996000000000', '555')
+        sql_queries.trainer_cache.clear()
+        async with self.db.read() as conn:
+            self.assertEqual((await sql_queries.get_trainer_by_tg_id(conn, '555'))['id'], trainer_id)
+            self.assertIsNone(await sql_queries.get_trainer_by_tg_id(conn, '777'))
+
+    async def test_rebinding_drops_previous_tg_id(self):
+        trainer_id, training_id = self.trainings[0]
+        async with self.db.read() as conn:
+            self.assertEqual((await sql_queries.get_trainer_by_tg_id(conn, '100000'))['id'], trainer_id)
+
+        async with self.db.write() as conn:
+            await sql_queries.update_trainer_tg_id(conn, '996000000000', '555')
+        missing = object()
+        self.assertIs(sql_queries.trainer_cache.get('100000', missing), missing)
+        self.assertEqual(sql_queries.trainer_cache.get('555')['id'], trainer_id)
+
+    async def test_schedule_and_reminders(self):
+        async with self.db.read() as conn:
+            schedule = await sql_queries.get_weekly_schedule(conn)
+            reminders = await sql_queries.get_day_reminders(conn, date(2024, 3, 4))
+            self.assertEqual(await sql_queries.get_day_reminders(conn, date(2024, 3, 6)), [])
+
+        self.assertEqual(len(schedule), 8)
+        row = schedule[0]
+        # даты и время приходят строками, как их хранит Django в SQLite
+        self.assertEqual((row['start_time'], row['end_time'], row['start_date']), ('08:00:00', '09:00:00', '2024-01-01'))
+        self.assertEqual(row[0], row['id'])
+        self.assertEqual(sorted(row['training_id'] for row in reminders), [training_id for _, training_id in self.trainings])
+        self.assertEqual({row['tg_id'] for row in reminders}, {'100000', '100001'})
+
+    async def test_attendance_upsert_and_salary(self):
+        trainer_id, training_id = self.trainings[0]
+        other_training_id = self.trainings[1][1]
+        async with self.db.write() as conn:
+            await sql_queries.add_or_update_attendances(conn, [
+                self.attendance(training_id, date(2024, 3, 4), 5),
+                self.attendance(other_training_id, date(2024, 3, 4), 12),
+                self.attendance(training_id, date(2024, 4, 1), 3),
+            ])
+        async with self.db.write() as conn:
+            await sql_queries.add_or_update_attendance(conn, self.attendance(training_id, date(2024, 3, 4), 8))
+
+        rows = await self.fetch('SELECT attend_count FROM training_attendance WHERE training_id = ? ORDER BY recording_date',
+                                (training_id,))
+        self.assertEqual([row['attend_count'] for row in rows], [8, 3])
+        async with self.db.read() as conn:
+            salaries = await sql_queries.get_trainer_salary_for_months(
+                conn, trainer_id, [date(2024, 3, 15), date(2024, 4, 1), date(2024, 5, 1)],
+            )
+            recorded = await sql_queries.get_recorded_training_ids(
+                conn, [training_id, other_training_id, self.trainings[2][1]], date(2024, 3, 4),
+            )
+        self.assertEqual(salaries, {date(2024, 3, 1): 8 * 100 + 12 * 150, date(2024, 4, 1): 300, date(2024, 5, 1): 0})
+        self.assertEqual(recorded, {training_id, other_training_id})
+
+    async def test_concurrent_writes_are_not_lost(self):
+        trainer_id, training_id = self.trainings[0]
+
+        async def write(day):
+            async with self.db.write() as conn:
+                await sql_queries.add_or_update_attendance(conn, self.attendance(training_id, date(2024, 3, day), 2))
+
+        await asyncio.gather(*(write(day) for day in range(1, 21)))
+        async with self.db.read() as conn:
+            salary = await sql_queries.get_trainer_salary_for_month(conn, trainer_id, date(2024, 3, 1))
+        self.assertEqual(salary, 20 * 2 * 100)
+
+    async def test_outbox_queries(self):
+        async with self.db.write() as conn:
+            for chat_id in ('1', '2', '3'):
+                await conn.execute(
+                    "INSERT INTO training_outboundmessage (chat_id, text, reply_markup, status, attempts, error, created_date) "
+                    "VALUES (?, 'Привет', '', 'pending', 0, '', ?)",
+                    (chat_id, datetime(2024, 3, 4, 10))
+                )
+            await conn.commit()
+
+        async with self.db.read() as conn:
+            pending = await sql_queries.get_pending_messages(conn, limit=2)
+        self.assertEqual([row['chat_id'] for row in pending], ['1', '2'])
+        async with self.db.write() as conn:
+            await sql_queries.update_outbound_messages(conn, [
+                ('sent', 1, '', datetime(2024, 3, 4, 10, 0, 5), pending[0]['id']),
+                ('failed', 1, 'Forbidden', None, pending[1]['id']),
+            ])
+        rows = await self.fetch('SELECT status, sent_date FROM training_outboundmessage ORDER BY id')
+        self.assertEqual([row['status'] for row in rows], ['sent', 'failed', 'pending'])
+        self.assertTrue(rows[0]['sent_date'].startswith('2024-03-04 10:00:05'))
+
+    async def test_write_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            async with self.db.write() as conn:
+                await conn.execute('DELETE FROM training_price')
+                raise RuntimeError
+        self.assertEqual(len(await self.fetch('SELECT id FROM training_price')), 4)
+
+
+class SQLiteRepositoryTests(RepositoryContract, unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.template_dir = tempfile.TemporaryDirectory()
+        cls.template = os.path.join(cls.template_dir.name, 'template.sqlite3')
+        migrate_database(cls.template)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.template_dir.cleanup()
+
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = copy_database(self.template, os.path.join(self.tmpdir.name, 'db.sqlite3'))
+        self.db = await create_database({'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}).open()
+        await super().asyncSetUp()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+
+def _asyncpg_installed():
+    try:
+        import asyncpg  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@unittest.skipUnless(POSTGRES_DSN and _asyncpg_installed(), 'нужны BOT_TEST_POSTGRES_DSN и asyncpg')
+class PostgresRepositoryTests(RepositoryContract, unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.database_name = f'bot_tests_{os.getpid()}'
+        cls.config = asyncio.run(create_postgres_database(POSTGRES_DSN, cls.database_name))
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run(drop_postgres_database(POSTGRES_DSN, cls.database_name))
+
+    async def asyncSetUp(self):
+        self.db = await create_database(self.config).open()
+        await truncate_postgres(self.db)
+        await super().asyncSetUp()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def test_data_version_counts_writes_of_other_processes(self):
+        import asyncpg
+
+        version = await self.db.writer.data_version()
+        trainer_id, training_id = self.trainings[0]
+        async with self.db.write() as conn:
+            await sql_queries.add_or_update_attendance(conn, self.attendance(training_id, date(2024, 3, 4), 5))
+            await conn.commit()
+        self.assertEqual(await self.db.writer.data_version(), version)
+
+        # другой воркер бота (свой application_name) и админка (без application_name бота)
+        for application_name in ('trainings-bot-other', ''):
+            with self.subTest(application_name=application_name):
+                other = await asyncpg.connect(
+                    **{**self.db.connect_kwargs, 'server_settings': {'application_name': application_name}},
+                )
+                try:
+                    await other.execute("UPDATE training_training SET name = 'Новое' WHERE id = $1", training_id)
+                finally:
+                    await other.close()
+                self.assertGreater(await self.db.writer.data_version(), version)
+                version = await self.db.writer.data_version()
+
+
+class AttendanceWriteQueueTests(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.template_dir = tempfile.TemporaryDirectory()
+        cls.template = os.path.join(cls.template_dir.name, 'template.sqlite3')
+        migrate_database(cls.template)
+        cls.trainings = seed_trainings(cls.template, trainers=2, trainings_per_trainer=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.template_dir.cleanup()
+
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = copy_database(self.template, os.path.join(self.tmpdir.name, 'db.sqlite3'))
+        self.db = await Database(path, readers=1).open()
+        self.queue = AttendanceWriteQueue(self.db, max_delay=0.01).start()
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+    def attendance(self, training_id, day, attend_count):
+        recording_date = date(2024, 3, day)
+        return {
+            'training_id': training_id,
+            'attend_count': attend_count,
+            'recording_day': recording_date.strftime('%a').lower(),
+            'recording_date': recording_date,
+            'created_date': datetime.now(),
+            'update_date': datetime.now(),
+        }
+
+    async def fetch(self, sql, params=()):
+        async with self.db.read() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def test_burst_is_coalesced(self):
+        await asyncio.gather(*(
+            self.queue.submit(self.attendance(training_id, day, 5))
+            for trainer_id, training_id in self.trainings
+            for day in range(1, 11)
+        ))
+
+        self.assertLess(self.queue.batches, 5)
+        rows = await self.fetch('SELECT COUNT(*) FROM training_attendance')
+        self.assertEqual(rows[0][0], 60)
+        payroll = await self.fetch('SELECT classes, amount FROM training_trainermonthlypayroll ORDER BY trainer_id')
+        self.assertEqual([tuple(row) for row in payroll], [(30, 15000), (30, 15000)])
+
+    async def test_upsert_keeps_one_row_per_day(self):
+        training_id = self.trainings[0][1]
+        await asyncio.gather(*(self.queue.submit(self.attendance(training_id, 1, count)) for count in (3, 12)))
+        await self.queue.submit(self.attendance(training_id, 1, 7))
+
+        rows = await self.fetch('SELECT attend_count FROM training_attendance WHERE training_id = ?', (training_id,))
+        self.assertEqual([row[0] for row in rows], [7])
+
+    async def test_bad_row_does_not_reject_the_batch(self):
+        with self.assertLogs('bot.write_queue', level='ERROR'):
+            results = await asyncio.gather(
+                self.queue.submit(self.attendance(self.trainings[0][1], 1, 5)),
+                self.queue.submit(self.attendance(999999, 1, 5)),
+                self.queue.submit({}),
+                return_exceptions=True,
+            )
+
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], sqlite3.IntegrityError)
+        self.assertIsInstance(results[2], KeyError)
+        rows = await self.fetch('SELECT COUNT(*) FROM training_attendance')
+        self.assertEqual(rows[0][0], 1)
+
+
+class SqlQueryPlanTests(unittest.IsolatedAsyncioTestCase):
+    """
+    Каждый запрос из bot/sql_queries.py на большой базе должен идти по индексу. Полная загрузка
+    недельного расписания в ScheduleIndex — единственное осознанное исключение.
+    """
+
+    allowed_scans = {
+        'get_weekly_schedule': {'ts'},
+        # t0..tN — чтение результатов подзапросов по занятиям, каждый ограничен LIMIT
+        'get_attendance_history': {'t0', 't1', 't2'},
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmpdir.name, 'db.sqlite3')
+        migrate_database(cls.path)
+        seed_trainings(cls.path, trainers=50, trainings_per_trainer=4)
+        seed_schedules(cls.path)
+        seed_attendance(cls.path, days=365)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def calls(self):
+        attendance = {
+            'training_id': 3,
+            'attend_count': 12,
+            'recording_day': 'mon',
+            'recording_date': date(2024, 3, 4),
+            'created_date': datetime.now(),
+            'update_date': datetime.now(),
+        }
+        return {
+            'get_trainer_by_phone': (sql_queries.get_trainer_by_phone, '996000000001'),
+            'get_trainer_by_tg_id': (sql_queries.get_trainer_by_tg_id, '100001'),
+            'update_trainer_tg_id': (sql_queries.update_trainer_tg_id, '996000000002', '200002'),
+            'get_weekly_schedule': (sql_queries.get_weekly_schedule,),
+            'add_or_update_attendance': (sql_queries.add_or_update_attendance, attendance),
+            'add_or_update_attendances': (sql_queries.add_or_update_attendances, [attendance]),
+            'refresh_trainer_monthly_payroll': (sql_queries.refresh_trainer_monthly_payroll, 3, date(2024, 3, 1)),
+            'get_trainer_salary_for_month': (sql_queries.get_trainer_salary_for_month, 1, date(2024, 3, 1)),
+            'get_trainer_salary_for_months': (
+                sql_queries.get_trainer_salary_for_months, 1, [date(2024, 1, 1), date(2024, 3, 1)]
+            ),
+            'get_day_reminders': (sql_queries.get_day_reminders, date(2024, 3, 4)),
+            'get_recorded_training_ids': (sql_queries.get_recorded_training_ids, [3, 5, 7], date(2024, 3, 4)),
+            'get_trainer_trainings': (sql_queries.get_trainer_trainings, 1),
+            'get_attendance_history': (
+                sql_queries.get_attendance_history, [3, 5, 7], 11, (date(2024, 6, 1), 5000)
+            ),
+            'get_missing_sessions': (sql_queries.get_missing_sessions, 1, date(2024, 3, 1), date(2024, 3, 14), 20),
+            'get_pending_messages': (sql_queries.get_pending_messages, 100),
+            'update_outbound_messages': (sql_queries.update_outbound_messages, [('sent', 1, '', datetime.now(), 1)]),
+        }
+
+    def scans(self, plan_conn, statement):
+        return {
+            match.group(1)
+            for row in plan_conn.execute(f'EXPLAIN QUERY PLAN {statement}')
+            for match in [re.match(r'SCAN (\S+)', row[3])]
+            if match and match.group(1) != 'CONSTANT'
+        }
+
+    async def test_every_query_uses_an_index(self):
+        queries = {
+            name for name, function in inspect.getmembers(sql_queries, inspect.iscoroutinefunction)
+            if function.__module__ == sql_queries.__name__
+        }
+        calls = self.calls()
+        self.assertEqual(queries, set(calls), 'Добавьте новый запрос в SqlQueryPlanTests.calls')
+
+        conn = await connect(self.path)
+        plan_conn = sqlite3.connect(self.path)
+        statements = []
+        await conn.set_trace_callback(statements.append)
+        try:
+            for name, (function, *args) in calls.items():
+                sql_queries.trainer_cache.clear()
+                sql_queries.salary_cache.clear()
+                statements.clear()
+                await function(conn, *args)
+
+                executed = [s for s in statements if s.split()[0].upper() not in ('PRAGMA', 'BEGIN', 'COMMIT')]
+                self.assertTrue(executed, name)
+                for statement in executed:
+                    with self.subTest(query=name):
+                        self.assertLessEqual(self.scans(plan_conn, statement), self.allowed_scans.get(name, set()))
+        finally:
+            await conn.close()
+            plan_conn.close()
+
+
+class SalaryCacheTests(unittest.IsolatedAsyncioTestCase):
+    """salary_cache в get_trainer_salary_for_months: повтор без SQL, сброс записанного месяца."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.template_dir = tempfile.TemporaryDirectory()
+        cls.template = os.path.join(cls.template_dir.name, 'template.sqlite3')
+        migrate_database(cls.template)
+        (cls.trainer_id, cls.training_id), = seed_trainings(cls.template)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.template_dir.cleanup()
+
+    async def asyncSetUp(self):
+        sql_queries.salary_cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.conn = await connect(copy_database(self.template, os.path.join(self.tmpdir.name, 'db.sqlite3')))
+        self.statements = []
+        await self.conn.set_trace_callback(self.statements.append)
+
+    async def asyncTearDown(self):
+        await self.conn.close()
+        self.tmpdir.cleanup()
+
+    def selects(self):
+        return [s for s in self.statements if s.split()[0].upper() == 'SELECT']
+
+    async def write(self, recording_date, attend_count):
+        await sql_queries.add_or_update_attendances(self.conn, [{
+            'training_id': self.training_id,
+            'attend_count': attend_count,
+            'recording_day': recording_date.strftime('%a').lower(),
+            'recording_date': recording_date,
+            'created_date': datetime.now(),
+            'update_date': datetime.now(),
+        }])
+
+    async def salaries(self, *months):
+        self.statements.clear()
+        return await sql_queries.get_trainer_salary_for_months(self.conn, self.trainer_id, months)
+
+    async def test_several_months_in_one_query_then_from_cache(self):
+        await self.write(date(2024, 3, 4), 5)
+        months = (date(2024, 1, 1), date(2024, 2, 10), date(2024, 3, 31))
+        expected = {date(2024, 1, 1): 0, date(2024, 2, 1): 0, date(2024, 3, 1): 500}
+
+        self.assertEqual(await self.salaries(*months), expected)
+        self.assertEqual(len(self.selects()), 1)
+
+        self.assertEqual(await self.salaries(*months), expected)
+        self.assertEqual(self.statements, [])
+
+    async def test_write_pops_only_affected_month(self):
+        await self.write(date(2024, 3, 4), 5)
+        await self.write(date(2024, 4, 1), 2)
+        await self.salaries(date(2024, 3, 1), date(2024, 4, 1))
+
+        await self.write(date(2024, 3, 11), 3)
+        cache = sql_queries.salary_cache
+        self.assertIsNone(cache.get((self.trainer_id, date(2024, 3, 1))))
+        self.assertEqual(cache.get((self.trainer_id, date(2024, 4, 1))), 200)
+
+        self.assertEqual(
+            await self.salaries(date(2024, 3, 1), date(2024, 4, 1)), {date(2024, 3, 1): 800, date(2024, 4, 1): 200}
+        )
+        self.assertEqual(len(self.selects()), 1)
+
+
+class ScheduleIndexTests(unittest.IsolatedAsyncioTestCase):
+    """Расписание в памяти: повторные запросы без SQL, перечитывание после коммита другого соединения."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.template_dir = tempfile.TemporaryDirectory()
+        cls.template = os.path.join(cls.template_dir.name, 'template.sqlite3')
+        migrate_database(cls.template)
+        cls.trainings = seed_trainings(cls.template, trainers=2, trainings_per_trainer=2)
+        seed_schedules(cls.template, days=('mon', 'wed'))
+        conn = sqlite3.connect(cls.template)
+        with conn:
+            conn.execute(
+                "UPDATE training_training SET start_date = '2024-03-01', end_date = '2024-03-10' WHERE id = ?",
+                (cls.trainings[1][1],)
+            )
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.template_dir.cleanup()
+
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = copy_database(self.template, os.path.join(self.tmpdir.name, 'db.sqlite3'))
+        self.conn = await connect(self.path)
+        self.statements = []
+        await self.conn.set_trace_callback(self.statements.append)
+        self.trainer_id = self.trainings[0][0]
+
+    async def asyncTearDown(self):
+        await self.conn.close()
+        self.tmpdir.cleanup()
+
+    async def slots(self, index, day, trainer_id=None):
+        self.statements.clear()
+        return [slot.text for slot in await index.get_slots(self.conn, trainer_id or self.trainer_id, day)]
+
+    async def test_repeated_calls_run_no_sql(self):
+        index = ScheduleIndex(DataVersionWatcher(check_interval=60))
+        await self.slots(index, date(2024, 3, 4))
+        self.assertEqual([s.split()[0] for s in self.statements], ['PRAGMA', 'SELECT'])
+
+        for day in (date(2024, 3, 4), date(2024, 3, 5), date(2024, 3, 6)):
+            for trainer_id, training_id in self.trainings:
+                await self.slots(index, day, trainer_id)
+                self.assertEqual(self.statements, [])
+
+    async def test_reloads_only_after_external_commit(self):
+        index = ScheduleIndex(DataVersionWatcher(check_interval=0))
+        self.assertEqual(await self.slots(index, date(2024, 3, 5)), [])
+        self.assertEqual(await self.slots(index, date(2024, 3, 5)), [])
+        # без внешних изменений проверяется только PRAGMA data_version
+        self.assertEqual([s.split()[0] for s in self.statements], ['PRAGMA'])
+
+        admin = sqlite3.connect(self.path)
+        with admin:
+            admin.execute(
+                "INSERT INTO training_trainingschedule (training_id, day_of_week, start_time, end_time) "
+                "VALUES (?, 'tue', '18:00:00', '19:00:00')",
+                (self.trainings[0][1],)
+            )
+        admin.close()
+
+        self.assertEqual(await self.slots(index, date(2024, 3, 5)), ['Занятие 0-0 с 18:00 до 19:00'])
+        self.assertTrue(any('training_trainingschedule' in s for s in self.statements))
+
+    async def test_filters_by_training_dates(self):
+        index = ScheduleIndex(DataVersionWatcher(check_interval=60))
+        self.assertEqual(
+            await self.slots(index, date(2024, 3, 4)), ['Занятие 0-0 с 08:00 до 09:00', 'Занятие 0-1 с 09:00 до 10:00']
+        )
+        # 2024-03-10 — последний день второго занятия, 2024-03-11 уже после него
+        self.assertEqual(
+            await self.slots(index, date(2024, 3, 6)), ['Занятие 0-0 с 08:00 до 09:00', 'Занятие 0-1 с 09:00 до 10:00']
+        )
+        self.assertEqual(await self.slots(index, date(2024, 3, 11)), ['Занятие 0-0 с 08:00 до 09:00'])
+        self.assertEqual(await self.slots(index, date(2024, 2, 26)), ['Занятие 0-0 с 08:00 до 09:00'])
+        self.assertEqual(await self.slots(index, date(2023, 12, 25)), [])
+
+
+class WebhookTests(unittest.IsolatedAsyncioTestCase):
+    secret = 'test-secret'
+
+    async def asyncSetUp(self):
+        from bot.main import dp
+
+        # отдельное FSM-хранилище на каждый тест: соединение aiosqlite привязано к своему event loop
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage, dp.fsm.storage = dp.fsm.storage, SQLiteStorage(os.path.join(self.tmpdir.name, 'fsm.sqlite3'))
+        self.dp = dp
+        self.telegram = await FakeTelegramServer().start()
+        self.bot = self.telegram.bot()
+        self.client = TestClient(TestServer(create_app(dp, self.bot, '/tg/', self.secret)))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.bot.session.close()
+        await self.telegram.stop()
+        await self.dp.fsm.storage.close()
+        self.dp.fsm.storage = self.storage
+        self.tmpdir.cleanup()
+
+    async def post_update(self, update, secret=secret):
+        return await self.client.post(
+            '/tg/', json=update, headers={'X-Telegram-Bot-Api-Secret-Token': secret}
+        )
+
+    async def test_rejects_wrong_secret(self):
+        response = await self.post_update(self.telegram.message_update(1, '/start'), secret='wrong')
+
+        self.assertEqual(response.status, 401)
+        self.assertTrue(self.telegram.sent.empty())
+
+    async def test_acknowledges_and_replies(self):
+        response = await self.post_update(self.telegram.message_update(42, '/start'))
+        self.assertEqual(response.status, 200)
+
+        sent_at, params = await asyncio.wait_for(self.telegram.sent.get(), 5)
+        self.assertEqual(params['chat_id'], '42')
+
+    async def test_updates_are_processed_concurrently(self):
+        responses = await asyncio.gather(*(
+            self.post_update(self.telegram.message_update(user_id, '/start')) for user_id in range(1, 21)
+        ))
+        self.assertEqual({response.status for response in responses}, {200})
+
+        chats = set()
+        for _ in range(20):
+            sent_at, params = await asyncio.wait_for(self.telegram.sent.get(), 5)
+            chats.add(params['chat_id'])
+        self.assertEqual(len(chats), 20)
+
+
+class SQLiteStorageTests(unittest.IsolatedAsyncioTestCase):
+    key = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'fsm.sqlite3')
+        self.storage = SQLiteStorage(self.path, cache_size=2)
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+        self.tmpdir.cleanup()
+
+    async def test_survives_restart(self):
+        await self.storage.set_state(self.key, 'AttendanceStates:attendance_count')
+        await self.storage.update_data(self.key, {'training_id': 5, 'date': '2024-03-01'})
+        await self.storage.close()
+
+        storage = SQLiteStorage(self.path)
+        try:
+            self.assertEqual(await storage.get_state(self.key), 'AttendanceStates:attendance_count')
+            self.assertEqual(await storage.get_data(self.key), {'training_id': 5, 'date': '2024-03-01'})
+        finally:
+            await storage.close()
+
+    async def test_clear_removes_record(self):
+        await self.storage.set_state(self.key, 'AttendanceStates:attendance_count')
+        await self.storage.set_state(self.key, None)
+        await self.storage.set_data(self.key, {})
+
+        conn = await self.storage._connection()
+        async with conn.execute('SELECT COUNT(*) FROM fsm_record') as cursor:
+            self.assertEqual((await cursor.fetchone())[0], 0)
+
+    async def test_expired_keys_are_empty_and_swept(self):
+        self.storage.ttl = -1
+        await self.storage.set_state(self.key, 'AttendanceStates:attendance_count')
+
+        self.assertIsNone(await self.storage.get_state(self.key))
+        await self.storage.sweep()
+        conn = await self.storage._connection()
+        async with conn.execute('SELECT COUNT(*) FROM fsm_record') as cursor:
+            self.assertEqual((await cursor.fetchone())[0], 0)
+
+    async def test_cache_and_table_are_bounded(self):
+        self.storage.max_rows = 3
+        for user_id in range(5):
+            await self.storage.set_data(StorageKey(bot_id=1, chat_id=user_id, user_id=user_id), {'n': user_id})
+
+        self.assertEqual(len(self.storage._cache), 2)
+        self.assertEqual(await self.storage.get_data(StorageKey(bot_id=1, chat_id=0, user_id=0)), {'n': 0})
+
+        await self.storage.sweep()
+        conn = await self.storage._connection()
+        async with conn.execute('SELECT COUNT(*) FROM fsm_record') as cursor:
+            self.assertEqual((await cursor.fetchone())[0], 3)
+
+
+class UpdateQueueTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue = await UpdateQueue(os.path.join(self.tmpdir.name, 'updates.sqlite3')).open()
+        self.telegram = FakeTelegramServer()
+
+    async def asyncTearDown(self):
+        await self.queue.close()
+        self.tmpdir.cleanup()
+
+    async def shards(self):
+        return [
+            (row['user_id'], row['shard'])
+            for row in await self.queue._conn.execute_fetchall('SELECT user_id, shard FROM update_queue ORDER BY id')
+        ]
+
+    async def test_shards_by_sender(self):
+        callback = {
+            'update_id': 100,
+            'callback_query': {'id': '1', 'from': {'id': 7, 'is_bot': False, 'first_name': 'Тренер'},
+                               'chat_instance': '1', 'data': 'x'},
+        }
+        await self.queue.put([self.telegram.message_update(5, '/start'), callback], workers=3)
+        self.assertEqual(await self.shards(), [(5, 2), (7, 1)])
+
+        await self.queue.reshard(2)
+        self.assertEqual(await self.shards(), [(5, 1), (7, 1)])
+
+    async def test_worker_keeps_per_user_order(self):
+        dp = Dispatcher()
+        handled = []
+
+        @dp.message()
+        async def record(message: Message):
+            # первое сообщение каждого пользователя обрабатывается дольше остальных
+            await asyncio.sleep(0.02 if message.text == '0' else 0)
+            handled.append((message.from_user.id, int(message.text)))
+
+        await self.queue.put(
+            [self.telegram.message_update(user_id, str(i)) for i in range(5) for user_id in (2, 4, 6)], workers=2
+        )
+        await self.queue.put([self.telegram.message_update(3, '0')], workers=2)
+
+        stop = asyncio.Event()
+        bot = Bot(token='123456:TEST')
+        worker = asyncio.create_task(run_worker(dp, bot, self.queue, shard=0, batch_size=4, poll_interval=0.01, stop=stop))
+        while await self.queue._conn.execute_fetchall('SELECT 1 FROM update_queue WHERE shard = 0'):
+            await asyncio.sleep(0.01)
+        stop.set()
+        await worker
+        await bot.session.close()
+
+        for user_id in (2, 4, 6):
+            self.assertEqual([i for user, i in handled if user == user_id], list(range(5)))
+        self.assertEqual(await self.queue.pending(), 1)
+
+    async def test_ingress_webhook(self):
+        client = TestClient(TestServer(create_ingress_app(self.queue, 2, '/tg/', 'secret')))
+        await client.start_server()
+        try:
+            response = await client.post('/tg/', json=self.telegram.message_update(9, '/start'),
+                                         headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+            self.assertEqual(response.status, 401)
+            response = await client.post('/tg/', json=self.telegram.message_update(9, '/start'),
+                                         headers={'X-Telegram-Bot-Api-Secret-Token': 'secret'})
+            self.assertEqual(response.status, 200)
+        finally:
+            await client.close()
+        self.assertEqual(await self.shards(), [(9, 1)])
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.sent.append((chat_id, reply_markup.inline_keyboard[0][0].callback_data))
+
+
+class ReminderSchedulerTests(unittest.IsolatedAsyncioTestCase):
+    """Планировщик на симулированных часах: понедельник 2024-03-04 поминутно, 3000 занятий в этот день."""
+
+    day = datetime(2024, 3, 4)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.template = os.path.join(cls.tmpdir.name, 'template.sqlite3')
+        migrate_database(cls.template)
+        seed_trainings(cls.template, trainers=1000, trainings_per_trainer=3)
+        seed_schedules(cls.template)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    async def asyncSetUp(self):
+        self.path = copy_database(self.template, os.path.join(self.tmpdir.name, f'{self._testMethodName}.sqlite3'))
+        self.db = await Database(self.path).open()
+        sql_queries.data_version_watcher.bind(self.db.writer)
+        self.bot = RecordingBot()
+        self.scheduler = ReminderScheduler(self.bot, self.db)
+        self.reads = 0
+
+        read = self.db.read
+
+        @asynccontextmanager
+        async def counting_read():
+            self.reads += 1
+            async with read() as conn:
+                yield conn
+
+        self.db.read = counting_read
+
+    async def asyncTearDown(self):
+        sql_queries.data_version_watcher.bind(None)
+        await self.db.close()
+
+    async def run_day(self, start=0, end=24 * 60):
+        """Тикает раз в минуту; возвращает {минута: [сработавшие напоминания]}."""
+        fired = {}
+        for minute in range(start, end):
+            examined = self.scheduler.examined
+            due = await self.scheduler.tick(self.day + timedelta(minutes=minute))
+            # просматриваются только наступившие события (и устаревшие после правок записи),
+            # сколько бы событий ни было в куче
+            self.assertLessEqual(self.scheduler.examined - examined, len(due) + self.scheduler.changed)
+            if due:
+                fired[minute] = due
+        return fired
+
+    async def test_each_class_fires_once_at_its_end(self):
+        fired = await self.run_day()
+
+        self.assertEqual(self.scheduler.examined, 3000)
+        reminders = [reminder for due in fired.values() for reminder in due]
+        self.assertEqual(len(reminders), 3000)
+        self.assertEqual(len({reminder.schedule_id for reminder in reminders}), 3000)
+        for minute, due in fired.items():
+            for reminder in due:
+                self.assertEqual(reminder.fire_at, self.day + timedelta(minutes=minute))
+        # 12 разных времен окончания: база читается при построении дня и по разу на каждое время
+        self.assertEqual(self.reads, 1 + 12)
+        self.assertEqual(len(self.bot.sent), 3000)
+        self.assertEqual(
+            self.bot.sent[0][1], pack_attendance(reminders[0].schedule_id, reminders[0].training_id, self.day.date())
+        )
+
+    async def test_schedule_changes_rebuild_only_affected_entries(self):
+        await self.run_day(0, 8 * 60)
+        conn = sqlite3.connect(self.path)
+        with conn:
+            moved, removed = [row[0] for row in conn.execute(
+                "SELECT id FROM training_trainingschedule WHERE day_of_week = 'mon' AND end_time = '20:00:00' LIMIT 2"
+            )]
+            conn.execute("UPDATE training_trainingschedule SET end_time = '21:30:00' WHERE id = ?", (moved,))
+            conn.execute('DELETE FROM training_trainingschedule WHERE id = ?', (removed,))
+        conn.close()
+        self.scheduler.invalidate()
+
+        fired = await self.run_day(8 * 60)
+
+        self.assertEqual(self.scheduler.changed, 2)
+        self.assertEqual([reminder.schedule_id for reminder in fired[21 * 60 + 30]], [moved])
+        self.assertEqual(sum(len(due) for due in fired.values()), 3000 - 1)
+
+    async def test_skips_classes_with_recorded_attendance(self):
+        async with self.db.write() as conn:
+            async with conn.execute(
+                "SELECT training_id FROM training_trainingschedule WHERE day_of_week = 'mon' ORDER BY id LIMIT 1"
+            ) as cursor:
+                training_id = (await cursor.fetchone())[0]
+            await sql_queries.add_or_update_attendance(conn, {
+                'training_id': training_id,
+                'attend_count': 5,
+                'recording_day': 'mon',
+                'recording_date': self.day.date(),
+                'created_date': self.day,
+                'update_date': self.day,
+            })
+
+        await self.run_day()
+        self.assertEqual(len(self.bot.sent), 3000 - 1)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTests(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        # вытесняется давно не читанный 'b', а не первый записанный 'a'
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = TTLCache(ttl=10, clock=clock)
+        cache.set('a', 1)
+        clock.now = 10
+        self.assertEqual(cache.get('a'), 1)
+
+        clock.now = 10.5
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+        cache.set('a', 2)
+        clock.now = 20
+        self.assertEqual(cache.get('a'), 2)
+
+    def test_negative_entries(self):
+        cache = TTLCache()
+        missing = object()
+        cache.set('unknown', None)
+
+        self.assertIsNone(cache.get('unknown', missing))
+        self.assertIs(cache.get('other', missing), missing)
+        self.assertIsNone(cache.pop('unknown', missing))
+        self.assertIs(cache.get('unknown', missing), missing)
+
+    def test_stats(self):
+        clock = FakeClock()
+        cache = TTLCache(ttl=1, clock=clock)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        clock.now = 2
+        cache.get('a')
+
+        self.assertEqual(cache.stats(), {'size': 0, 'hits': 2, 'misses': 2})
+        cache.set('b', 2)
+        cache.clear()
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class RateLimitTests(unittest.TestCase):
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, capacity=2, clock=clock)
+
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0, 0, 0.1, 0.2])
+        clock.now = 1
+        self.assertEqual(bucket.reserve(), 0)
+
+        bucket.pause(3)
+        self.assertEqual(bucket.reserve(), 3)
+
+    def test_chat_limiter(self):
+        clock = FakeClock()
+        chats = ChatLimiter(interval=1, clock=clock)
+
+        self.assertEqual([chats.reserve(1), chats.reserve(2), chats.reserve(1), chats.reserve(1)], [0, 0, 1, 2])
+        clock.now = 5
+        self.assertEqual(chats.reserve(1), 0)
+
+
+class OutboxTests(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.template = os.path.join(cls.tmpdir.name, 'template.sqlite3')
+        migrate_database(cls.template)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    async def asyncSetUp(self):
+        self.path = copy_database(self.template, os.path.join(self.tmpdir.name, f'{self._testMethodName}.sqlite3'))
+        self.db = await Database(self.path).open()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    def enqueue(self, chat_ids, text='Занятия переносятся'):
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.executemany(
+                "INSERT INTO training_outboundmessage (chat_id, text, reply_markup, status, attempts, error, created_date) "
+                "VALUES (?, ?, '', 'pending', 0, '', ?)",
+                [(str(chat_id), text, datetime.now()) for chat_id in chat_ids]
+            )
+        conn.close()
+
+    def statuses(self):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute('SELECT chat_id, status, attempts FROM training_outboundmessage ORDER BY id').fetchall()
+        conn.close()
+        return rows
+
+    async def drain(self, outbox):
+        while await outbox.process():
+            pass
+
+    async def test_flood_control_is_respected_and_retried(self):
+        # два сообщения в каждый чат: второе упирается в лимит на чат
+        self.enqueue([1000 + i % 15 for i in range(30)])
+        telegram = await FakeTelegramServer(flood_limit=20).start()
+        bot = telegram.bot()
+        limiter = RateLimitMiddleware(rate=40)
+        bot.session.middleware(limiter)
+        try:
+            with self.assertLogs('bot.outbox', 'WARNING'):
+                await self.drain(Outbox(bot, self.db, chat_interval=0.5))
+        finally:
+            await bot.session.close()
+            await telegram.stop()
+
+        self.assertEqual({status for chat_id, status, attempts in self.statuses()}, {'sent'})
+        self.assertGreater(telegram.flood_errors, 0)
+        self.assertEqual(limiter.retries, telegram.flood_errors)
+        self.assertEqual(telegram.sent.qsize(), 30)
+
+    async def test_replies_in_one_chat_are_not_spaced(self):
+        # лимит на чат — только у рассылок: ответы на быстрые нажатия кнопок уходят сразу
+        telegram = await FakeTelegramServer().start()
+        bot = telegram.bot()
+        bot.session.middleware(RateLimitMiddleware(rate=100))
+        try:
+            started = time.perf_counter()
+            for i in range(5):
+                await bot.send_message(42, f'Ответ {i}')
+            elapsed = time.perf_counter() - started
+        finally:
+            await bot.session.close()
+            await telegram.stop()
+        self.assertLess(elapsed, 0.5)
+
+    async def test_blocked_chat_fails_without_retry(self):
+        self.enqueue([1, 2])
+        telegram = await FakeTelegramServer(blocked={'2'}).start()
+        bot = telegram.bot()
+        try:
+            await self.drain(Outbox(bot, self.db))
+        finally:
+            await bot.session.close()
+            await telegram.stop()
+
+        self.assertEqual(self.statuses(), [('1', 'sent', 1), ('2', 'failed', 1)])
+
+    async def test_unsent_messages_survive_restart(self):
+        self.enqueue([1, 2, 3])
+        telegram = await FakeTelegramServer().start()
+        bot = telegram.bot()
+        await telegram.stop()
+        try:
+            # Bot API недоступен: сообщения остаются в очереди
+            await Outbox(bot, self.db).process()
+            self.assertEqual([status for chat_id, status, attempts in self.statuses()], ['pending'] * 3)
+
+            telegram = await FakeTelegramServer().start()
+            await bot.session.close()
+            bot = telegram.bot()
+            await self.drain(Outbox(bot, self.db))
+        finally:
+            await bot.session.close()
+            await telegram.stop()
+
+        self.assertEqual(self.statuses(), [('1', 'sent', 2), ('2', 'sent', 2), ('3', 'sent', 2)])
+
+
+class CallbackDataTests(unittest.TestCase):
+    secret = b'secret'
+
+    def test_round_trip_within_telegram_limit(self):
+        data = pack_attendance(2 ** 32 - 1, 2 ** 32 - 1, date(2100, 1, 1), self.secret)
+
+        self.assertLessEqual(len(data.encode()), 64)
+        button = unpack_attendance(data, self.secret)
+        self.assertEqual(tuple(button), (2 ** 32 - 1, 2 ** 32 - 1, date(2100, 1, 1)))
+
+    def test_rejects_forged_and_foreign_data(self):
+        data = pack_attendance(5, 7, date(2024, 3, 4), self.secret)
+        forged = data[:5] + ('A' if data[5] != 'A' else 'B') + data[6:]
+
+        self.assertIsNone(unpack_attendance(forged, self.secret))
+        self.assertIsNone(unpack_attendance(data, b'other secret'))
+        self.assertIsNone(unpack_attendance('a2' + data[2:], self.secret))
+        self.assertIsNone(unpack_attendance('a1.%%%', self.secret))
+        self.assertIsNone(unpack_attendance('todattendance_5', self.secret))
+
+    def test_empty_secret_is_refused(self):
+        with self.assertRaises(ValueError):
+            pack_attendance(5, 7, date(2024, 3, 4), b'')
+
+        env = {key: value for key, value in os.environ.items() if key not in ('CALLBACK_SECRET', 'BOT_TOKEN')}
+        result = subprocess.run(
+            [sys.executable, '-c', 'import bot.callbacks'], capture_output=True, text=True, env=env,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('CALLBACK_SECRET', result.stderr)
+
+    def test_history_round_trip(self):
+        data = pack_history(True, date(2100, 1, 1), 2 ** 32 - 1)
+
+        self.assertLessEqual(len(data.encode()), 16)
+        self.assertEqual(tuple(unpack_history(data)), (True, date(2100, 1, 1), 2 ** 32 - 1))
+        self.assertIsNone(unpack_history(data[:-2]))
+        self.assertIsNone(unpack_history(pack_attendance(1, 2, date(2024, 3, 4), self.secret)))
+
+    def test_bulk_round_trip(self):
+        data = pack_bulk(date(2100, 1, 1))
+
+        self.assertEqual(unpack_bulk(data), date(2100, 1, 1))
+        self.assertIsNone(unpack_bulk(data[:-1]))
+        self.assertIsNone(unpack_bulk(pack_history(True, date(2100, 1, 1), 1)))
+
+
+class BulkEntryParseTests(unittest.TestCase):
+    def test_counts_and_errors_per_slot(self):
+        self.assertEqual(parse_counts('12 8 15', 3), ({0: 12, 1: 8, 2: 15}, {}))
+        self.assertEqual(parse_counts(' 12,8;  - ', 3), ({0: 12, 1: 8}, {}))
+        self.assertEqual(
+            parse_counts('12 x 99999', 4),
+            ({0: 12}, {1: '«x» — не число', 2: '«99999» — слишком большое число', 3: 'количество не указано'})
+        )
+        self.assertEqual(parse_counts('1 2 3', 2), ({0: 1, 1: 2}, {2: '«3» — лишнее число, занятий в списке 2'}))
+
+
+class AttendanceFlowTests(unittest.IsolatedAsyncioTestCase):
+    """Кнопка занятия и ввод числа через Dispatcher: в основной базе только запись, без чтений."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.template_dir = tempfile.TemporaryDirectory()
+        cls.template = os.path.join(cls.template_dir.name, 'template.sqlite3')
+        migrate_database(cls.template)
+        cls.training_ids = [training_id for trainer_id, training_id in seed_trainings(cls.template, trainings_per_trainer=3)]
+        cls.training_id = cls.training_ids[0]
+        seed_schedules(cls.template, days=('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.template_dir.cleanup()
+
+    async def asyncSetUp(self):
+        from bot.main import dp, schedule_index
+
+        schedule_index.invalidate()
+        sql_queries.trainer_cache.clear()
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = copy_database(self.template, os.path.join(self.tmpdir.name, 'db.sqlite3'))
+
+        self.dp = dp
+        self.saved = {key: dp.workflow_data.get(key) for key in ('db', 'attendance_queue')}
+        self.storage, dp.fsm.storage = dp.fsm.storage, SQLiteStorage(os.path.join(self.tmpdir.name, 'fsm.sqlite3'))
+        self.db = dp['db'] = await Database(path).open()
+        self.queue = dp['attendance_queue'] = AttendanceWriteQueue(self.db).start()
+        self.telegram = await FakeTelegramServer().start()
+        self.bot = self.telegram.bot()
+
+        self.statements = []
+        for conn in [self.db.writer, *self.db._readers]:
+            await conn.set_trace_callback(self.statements.append)
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+        await self.db.close()
+        await self.dp.fsm.storage.close()
+        self.dp.fsm.storage = self.storage
+        self.dp.workflow_data.update(self.saved)
+        await self.bot.session.close()
+        await self.telegram.stop()
+        self.tmpdir.cleanup()
+
+    async def test_button_then_count_writes_once(self):
+        data = pack_attendance(1, self.training_id, date(2024, 3, 4))
+
+        await self.dp.feed_raw_update(self.bot, self.telegram.callback_update(42, data))
+        # спиннер на кнопке гасится до всех остальных запросов
+        self.assertEqual([method for method, params in self.telegram.calls], ['answerCallbackQuery', 'sendMessage'])
+
+        await self.dp.feed_raw_update(self.bot, self.telegram.message_update(42, '12'))
+
+        statements = [s.split()[0].upper() for s in self.statements if not s.startswith('PRAGMA')]
+        self.assertNotIn('SELECT', statements)
+        self.assertEqual(statements.count('INSERT'), 1)
+        self.assertEqual(statements.count('COMMIT'), 1)
+
+        conn = sqlite3.connect(self.db.path)
+        self.assertEqual(
+            conn.execute('SELECT training_id, attend_count, recording_date FROM training_attendance').fetchall(),
+            [(self.training_id, 12, '2024-03-04')]
+        )
+        conn.close()
+
+    def attendance(self):
+        conn = sqlite3.connect(self.db.path)
+        rows = conn.execute('SELECT training_id, attend_count FROM training_attendance ORDER BY training_id').fetchall()
+        conn.close()
+        return rows
+
+    async def test_bulk_entry_for_all_slots(self):
+        trainer = 100000
+        await self.dp.feed_raw_update(self.bot, self.telegram.message_update(trainer, 'Занятия на сегодня'))
+        method, params = self.telegram.calls[-1]
+        buttons = [row[0] for row in json.loads(params['reply_markup'])['inline_keyboard']]
+        self.assertEqual(buttons[-1]['text'], 'Записать все сразу')
+
+        # пока кнопку не нажали, текст не считается количеством
+        await self.dp.feed_raw_update(self.bot, self.telegram.message_update(trainer, '12 8 15'))
+        self.assertEqual(self.attendance(), [])
+        self.assertEqual(self.telegram.calls[-1][1]['text'], 'Я тебя не понимаю')
+
+        await self.dp.feed_raw_update(self.bot, self.telegram.callback_update(trainer, buttons[-1]['callback_data']))
+        method, params = self.telegram.calls[-1]
+        self.assertIn('1. Занятие 0-0 с 08:00 до 09:00', params['text'])
+        self.assertIn('например: 12 8 15', params['text'])
+
+        self.statements.clear()
+        await self.dp.feed_raw_update(self.bot, self.telegram.message_update(trainer, '12 abc 15'))
+
+        # seed_schedules ставит занятия на 08:00, 09:00, 10:00 в порядке id
+        self.assertEqual(self.attendance(), [(self.training_ids[0], 12), (self.training_ids[2], 15)])
+        self.assertEqual([s.split()[0].upper() for s in self.statements].count('COMMIT'), 1)
+        method, params = self.telegram.calls[-1]
+        self.assertIn('Записано занятий: 2 из 3', params['text'])
+        self.assertIn('2. Занятие 0-1 с 09:00 до 10:00: «abc» — не число', params['text'])
+
+        await self.dp.feed_raw_update(self.bot, self.telegram.message_update(trainer, '12 9 15'))
+        self.assertEqual(
+            self.attendance(), [(self.training_ids[0], 12), (self.training_ids[1], 9), (self.training_ids[2], 15)]
+        )
+        self.assertIsNone(await self.dp.fsm.storage.get_state(StorageKey(bot_id=123456, chat_id=trainer, user_id=trainer)))
+
+    async def test_missing_attendance_prompt(self):
+        conn = sqlite3.connect(self.db.path)
+        with conn:
+            schedule_id = conn.execute(
+                'SELECT id FROM training_trainingschedule WHERE training_id = ? AND day_of_week = ?',
+                (self.training_ids[1], 'mon')
+            ).fetchone()[0]
+            today = date.today()
+            conn.executemany(
+                'INSERT INTO training_trainingsession (training_id, schedule_id, session_date, start_time, end_time) '
+                "VALUES (?, ?, ?, '09:00:00', '10:00:00')",
+                [(self.training_ids[1], schedule_id, today - timedelta(days=days)) for days in (1, 8, 30)]
+            )
+            conn.execute(
+                'INSERT INTO training_attendance (training_id, attend_count, recording_day, recording_date, created_date, update_date) '
+                "VALUES (?, 5, 'mon', ?, ?, ?)",
+                (self.training_ids[1], today - timedelta(days=8), today, today)
+            )
+        conn.close()
+
+        await self.dp.feed_raw_update(self.bot, self.telegram.message_update(100000, 'Незаполненные занятия'))
+        method, params = self.telegram.calls[-1]
+        # за 8 дней назад посещаемость записана, а 30 дней назад — за пределами периода
+        buttons = [row[0] for row in json.loads(params['reply_markup'])['inline_keyboard']]
+        yesterday = today - timedelta(days=1)
+        self.assertEqual([button['text'] for button in buttons], [f'{yesterday:%d.%m} Занятие 0-1 с 09:00 до 10:00'])
+
+        await self.dp.feed_raw_update(self.bot, self.telegram.callback_update(100000, buttons[0]['callback_data']))
+        method, params = self.telegram.calls[-1]
+        self.assertEqual(params['text'], 'Введите количество пришедших на вчерашнее занятие')
+
+    async def test_forged_button_is_rejected(self):
+        data = pack_attendance(1, self.training_id, date(2024, 3, 4), secret=b'attacker')
+
+        await self.dp.feed_raw_update(self.bot, self.telegram.callback_update(42, data))
+
+        method, params = self.telegram.calls[-1]
+        self.assertEqual(method, 'answerCallbackQuery')
+        self.assertEqual(params['show_alert'], 'true')
+        self.assertIsNone(await self.dp.fsm.storage.get_state(StorageKey(bot_id=123456, chat_id=42, user_id=42)))
+
+
+class AttendanceHistoryTests(unittest.IsolatedAsyncioTestCase):
+    """История посещаемости: страницы по ключу (recording_date, id) и кнопки листания."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.template_dir = tempfile.TemporaryDirectory()
+        cls.small = os.path.join(cls.template_dir.name, 'small.sqlite3')
+        cls.large = os.path.join(cls.template_dir.name, 'large.sqlite3')
+        # у тренера 4 занятия: 1000 записей в маленькой базе и 100 000 в большой
+        for path, days in ((cls.small, 250), (cls.large, 25000)):
+            migrate_database(path)
+            seed_trainings(path, trainings_per_trainer=4)
+            seed_attendance(path, days=days, start_date=date(1990, 1, 1))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.template_dir.cleanup()
+
+    async def asyncSetUp(self):
+        from bot.main import HISTORY_PAGE_SIZE, dp, history_page
+
+        sql_queries.trainer_cache.clear()
+        self.dp = dp
+        self.page_size = HISTORY_PAGE_SIZE
+        self.history_page = history_page
+        self.databases = []
+
+    async def asyncTearDown(self):
+        for db in self.databases:
+            await db.close()
+
+    async def open(self, path):
+        db = await Database(path, readers=1).open()
+        self.databases.append(db)
+        return db
+
+    async def page(self, db, cursor=None, newer=False):
+        async with db.read() as conn:
+            trainings = [row['id'] for row in await sql_queries.get_trainer_trainings(conn, 1)]
+            return await sql_queries.get_attendance_history(conn, trainings, self.page_size, cursor, newer)
+
+    async def test_pages_cover_history_in_order(self):
+        db = await self.open(self.small)
+        expected = [
+            tuple(row) for row in sqlite3.connect(self.small).execute(
+                'SELECT id, training_id, recording_date, attend_count FROM training_attendance '
+                'ORDER BY recording_date DESC, id DESC'
+            )
+        ]
+
+        pages, cursor = [], None
+        while True:
+            rows = await self.page(db, cursor)
+            if not rows:
+                break
+            pages.append([tuple(row) for row in rows])
+            cursor = (date.fromisoformat(rows[-1]['recording_date']), rows[-1]['id'])
+        self.assertEqual([row for page in pages for row in page], expected)
+
+        # назад от последней страницы — те же страницы в обратном порядке
+        cursor = (date.fromisoformat(pages[-1][0][2]), pages[-1][0][0])
+        for page in reversed(pages[:-1]):
+            rows = await self.page(db, cursor, newer=True)
+            self.assertEqual([tuple(row) for row in rows], page)
+            cursor = (date.fromisoformat(rows[0]['recording_date']), rows[0]['id'])
+
+    async def page_latency(self, db, cursor, repeat=30):
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await self.page(db, cursor)
+            latencies.append(time.perf_counter() - started)
+        return statistics.median(latencies)
+
+    async def test_page_latency_is_flat_at_100k_rows(self):
+        small, large = await self.open(self.small), await self.open(self.large)
+        self.assertEqual(sqlite3.connect(self.large).execute('SELECT COUNT(*) FROM training_attendance').fetchone()[0], 100000)
+
+        baseline = await self.page_latency(small, None)
+        for cursor in (None, (date(2024, 3, 4), 50000), (date(1990, 1, 20), 100)):
+            with self.subTest(cursor=cursor):
+                # страница в глубине истории из 100 000 строк стоит как первая страница из 1000
+                self.assertLess(await self.page_latency(large, cursor), baseline * 3 + 0.002)
+
+    async def test_history_command_and_buttons(self):
+        self.saved = self.dp.workflow_data.get('db')
+        self.dp['db'] = await self.open(self.small)
+        storage, self.dp.fsm.storage = self.dp.fsm.storage, MemoryStorage()
+        telegram = await FakeTelegramServer().start()
+        bot = telegram.bot()
+        try:
+            await self.dp.feed_raw_update(bot, telegram.message_update(100000, '/history'))
+            method, params = telegram.calls[-1]
+            self.assertEqual(method, 'sendMessage')
+            lines = params['text'].split('\n')
+            self.assertEqual(lines[:2], ['История посещаемости', '07.09.1990 — Занятие 0-3: 13'])
+            self.assertEqual(len(lines), self.page_size + 1)
+            buttons = json.loads(params['reply_markup'])['inline_keyboard'][0]
+            self.assertEqual([button['text'] for button in buttons], ['Старее →'])
+
+            await self.dp.feed_raw_update(bot, telegram.callback_update(100000, buttons[0]['callback_data']))
+            method, params = telegram.calls[-1]
+            self.assertEqual(method, 'editMessageText')
+            self.assertEqual(params['text'].split('\n')[1], '05.09.1990 — Занятие 0-1: 9')
+            buttons = json.loads(params['reply_markup'])['inline_keyboard'][0]
+            self.assertEqual([button['text'] for button in buttons], ['← Новее', 'Старее →'])
+
+            await self.dp.feed_raw_update(bot, telegram.callback_update(100000, buttons[0]['callback_data']))
+            method, params = telegram.calls[-1]
+            self.assertEqual(params['text'].split('\n')[1], '07.09.1990 — Занятие 0-3: 13')
+            self.assertEqual(
+                [button['text'] for button in json.loads(params['reply_markup'])['inline_keyboard'][0]], ['Старее →']
+            )
+        finally:
+            self.dp['db'] = self.saved
+            self.dp.fsm.storage = storage
+            await bot.session.close()
+            await telegram.stop()
+
+
+class BenchmarkTests(unittest.IsolatedAsyncioTestCase):
+    def test_compare(self):
+        from bot.benchmarks import compare
+
+        baseline = {
+            'meta': {'end_date': '2024-06-30'},
+            'handlers': {'small': {'today': {'p50_ms': 2.0, 'p95_ms': 10.0}}},
+            'outbox': {'token_bucket': {'per_second': 25.0, 'http_429': 0, 'seconds': 12.0}},
+            'sql_queries': {'small': {'get_trainer_trainings': {'p50_ms': 0.2}}},
+        }
+        current = {
+            'meta': {'end_date': '2024-07-01'},
+            'handlers': {'small': {'today': {'p50_ms': 2.1, 'p95_ms': 15.0}}},
+            'outbox': {'token_bucket': {'per_second': 15.0, 'http_429': 40, 'seconds': 11.0}},
+            # втрое медленнее, но на доли миллисекунды — шум
+            'sql_queries': {'small': {'get_trainer_trainings': {'p50_ms': 0.6}}},
+        }
+        self.assertEqual(compare(baseline, current), [
+            ('handlers.small.today.p95_ms', 10.0, 15.0),
+            ('outbox.token_bucket.per_second', 25.0, 15.0),
+        ])
+        self.assertEqual(compare(baseline, current, threshold=0.6), [])
+        self.assertEqual(compare(baseline, baseline), [])
+
+    async def test_handlers_on_synthetic_data(self):
+        from bot.benchmarks import bench_handlers
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'db.sqlite3')
+            migrate_database(path)
+            await asyncio.to_thread(seed_synthetic, path, 3, 2, 1, date.today())
+            results = await bench_handlers(tmpdir, path, rounds=6)
+
+        # attendance_entry есть, только если в последние дни осталось незаполненное занятие
+        self.assertLessEqual({'today', 'salary', 'history', 'history_older', 'missing'}, set(results))
+        self.assertTrue(all(set(values) == {'p50_ms', 'p95_ms', 'p99_ms'} for values in results.values()))
+
+
+class MetricsTests(unittest.IsolatedAsyncioTestCase):
+    def test_histogram_text_and_summary(self):
+        histogram = Histogram('test_seconds', 'Тест', ('name',), buckets=(0.01, 0.1))
+        previous = histogram.snapshot()
+        for value in (0.005, 0.01, 0.05, 3):
+            histogram.observe(value, 'a"b')
+        histogram.observe(0.02, 'c')
+
+        self.assertEqual(list(histogram.render()), [
+            '# HELP test_seconds Тест',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{name="a\\"b",le="0.01"} 2',
+            'test_seconds_bucket{name="a\\"b",le="0.1"} 3',
+            'test_seconds_bucket{name="a\\"b",le="+Inf"} 4',
+            'test_seconds_sum{name="a\\"b"} 3.065',
+            'test_seconds_count{name="a\\"b"} 4',
+            'test_seconds_bucket{name="c",le="0.01"} 0',
+            'test_seconds_bucket{name="c",le="0.1"} 1',
+            'test_seconds_bucket{name="c",le="+Inf"} 1',
+            'test_seconds_sum{name="c"} 0.02',
+            'test_seconds_count{name="c"} 1',
+        ])
+        self.assertEqual(summarize(histogram, previous), [
+            'test_seconds{a"b}: 4 шт., среднее 766.2 мс, p95 <= inf мс',
+            'test_seconds{c}: 1 шт., среднее 20.0 мс, p95 <= 100 мс',
+        ])
+        self.assertEqual(summarize(histogram, histogram.snapshot()), [])
+
+    async def test_handler_outcomes(self):
+        histogram = Histogram('handler_seconds', 'Тест', ('handler', 'outcome'))
+        dispatcher = Dispatcher()
+        HandlerMetricsMiddleware(histogram).setup(dispatcher)
+
+        @dispatcher.message(F.text == 'ok')
+        async def answer(message: Message):
+            await message.answer('ok')
+
+        @dispatcher.message(F.text == 'fail')
+        async def fail(message: Message):
+            raise ValueError
+
+        updates = FakeTelegramServer()
+        bot = Bot(token='123456:TEST', session=FakeSession())
+        for text in ('ok', 'ok', 'другое'):
+            await dispatcher.feed_raw_update(bot, updates.message_update(42, text))
+        with self.assertRaises(ValueError), self.assertLogs('aiogram.event', 'ERROR'):
+            await dispatcher.feed_raw_update(bot, updates.message_update(42, 'fail'))
+
+        counts = {labels: sum(counts) for labels, (counts, total) in histogram.snapshot().items()}
+        self.assertEqual(counts, {('answer', 'ok'): 2, ('unhandled', 'unhandled'): 1, ('fail', 'error'): 1})
+
+    async def test_queries_are_timed_by_name(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'db.sqlite3')
+            migrate_database(path)
+            seed_trainings(path)
+            conn = await connect(path)
+            try:
+                sql_seconds.clear()
+                sql_queries.trainer_cache.clear()
+                sql_queries.salary_cache.clear()
+                await sql_queries.get_trainer_by_tg_id(conn, '100000')
+                await sql_queries.get_trainer_trainings(conn, 1)
+                self.assertEqual(self.calls(), {('get_trainer_by_tg_id',): 1, ('get_trainer_trainings',): 1})
+
+                # ответы из кэша не считаются запросами
+                sql_seconds.clear()
+                await sql_queries.get_trainer_by_tg_id(conn, '100000')
+                await sql_queries.get_trainer_salary_for_month(conn, 1, date(2024, 3, 1))
+                await sql_queries.get_trainer_salary_for_month(conn, 1, date(2024, 3, 1))
+                self.assertEqual(self.calls(), {('get_trainer_salary_for_months',): 1})
+
+                # запись одной строки — один UPSERT и один пересчет сводки, без вложенных оберток
+                sql_seconds.clear()
+                await sql_queries.add_or_update_attendance(conn, {
+                    'training_id': 1, 'attend_count': 12, 'recording_day': 'mon',
+                    'recording_date': date(2024, 3, 4), 'created_date': datetime.now(), 'update_date': datetime.now(),
+                })
+                self.assertEqual(
+                    self.calls(), {('add_or_update_attendances',): 1, ('refresh_trainer_monthly_payroll',): 1}
+                )
+            finally:
+                await conn.close()
+
+    @staticmethod
+    def calls():
+        return {labels: sum(counts) for labels, (counts, total) in sql_seconds.snapshot().items()}
+
+    async def test_event_loop_lag(self):
+        histogram = Histogram('lag_seconds', 'Тест')
+        probe = asyncio.create_task(monitor_event_loop(0.01, histogram))
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)
+        await asyncio.sleep(0.05)
+        probe.cancel()
+
+        (counts, total), = histogram.snapshot().values()
+        self.assertGreater(sum(counts), 3)
+        self.assertGreater(total, 0.15)
+
+    async def test_metrics_endpoint(self):
+        registry = Registry()
+        registry.histogram('test_seconds', 'Тест', ('name',)).observe(0.003, 'x')
+        client = TestClient(TestServer(create_metrics_app(registry)))
+        await client.start_server()
+        try:
+            response = await client.get('/metrics')
+            self.assertEqual(response.status, 200)
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+            self.assertIn('test_seconds_bucket{name="x",le="0.005"} 1', await response.text())
+        finally:
+            await client.close()
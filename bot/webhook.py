@@ -0,0 +1,61 @@
+import asyncio
+import hmac
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_app(dispatcher: Dispatcher, bot: Bot, path: str, secret_token: str) -> web.Application:
+    """
+    aiohttp-приложение, которое принимает обновления от Telegram. Ответ 200 уходит сразу после
+    проверки X-Telegram-Bot-Api-Secret-Token, а сами обновления обрабатываются фоновыми задачами
+    параллельно, без ожидания long polling.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=secret_token,
+        handle_in_background=True,
+    ).register(app, path=path)
+    return app
+
+
+def create_ingress_app(queue, workers: int, path: str, secret_token: str) -> web.Application:
+    """Webhook для режима с воркерами: обновление только сохраняется в очередь (bot.workers)."""
+    async def handle(request):
+        if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret_token):
+            return web.Response(status=401)
+        await queue.put([await request.json()], workers)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, *, url: str, path: str, secret_token: str,
+                      host: str = '0.0.0.0', port: int = 8080, app: web.Application = None):
+    if not secret_token:
+        raise RuntimeError('WEBHOOK_SECRET обязателен в режиме webhook')
+
+    runner = web.AppRunner(app or create_app(dispatcher, bot, path, secret_token))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        await bot.set_webhook(
+            url=url.rstrip('/') + path,
+            secret_token=secret_token,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            drop_pending_updates=True,
+        )
+        logger.info('Webhook слушает %s:%s%s', host, port, path)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
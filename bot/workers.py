@@ -0,0 +1,140 @@
+"""
+Режим нескольких процессов: ingress принимает обновления от Telegram и складывает их в локальную
+очередь SQLite, а воркеры (каждый со своим Dispatcher и event loop) разбирают свои шарды.
+
+Шард обновления — from_user.id % workers, поэтому все обновления одного пользователя попадают
+в один процесс и обрабатываются по порядку; на этом держится кэш FSM в памяти процесса.
+Обновление удаляется из очереди только после обработки: если воркер упадет, его обновления
+будут обработаны повторно (at-least-once).
+"""
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates
+
+from bot.db import connect
+
+
+UPDATES_DB_PATH = os.getenv('UPDATES_DB_PATH', Path(__file__).resolve().parent.parent / 'updates.sqlite3')
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(update: dict) -> int:
+    """id отправителя для любого типа обновления; если отправителя нет — id чата или 0."""
+    for event in update.values():
+        if isinstance(event, dict):
+            sender = event.get('from') or event.get('user') or event.get('chat')
+            if sender:
+                return sender['id']
+    return 0
+
+
+class UpdateQueue:
+    def __init__(self, path=UPDATES_DB_PATH):
+        self.path = str(path)
+        self._conn = None
+
+    async def open(self):
+        self._conn = await connect(self.path)
+        await self._conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS update_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                shard INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                payload TEXT NOT NULL
+            )
+            '''
+        )
+        await self._conn.execute('CREATE INDEX IF NOT EXISTS update_queue_shard_id ON update_queue (shard, id)')
+        await self._conn.commit()
+        return self
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def put(self, updates, workers: int):
+        """Сохраняет пачку обновлений одной транзакцией."""
+        rows = []
+        for update in updates:
+            user_id = update_user_id(update)
+            rows.append((user_id % workers, user_id, json.dumps(update, ensure_ascii=False)))
+        await self._conn.executemany('INSERT INTO update_queue (shard, user_id, payload) VALUES (?, ?, ?)', rows)
+        await self._conn.commit()
+
+    async def reshard(self, workers: int):
+        """Перераспределяет необработанные обновления, если число воркеров изменилось."""
+        await self._conn.execute('UPDATE update_queue SET shard = user_id % ? WHERE shard != user_id % ?',
+                                 (workers, workers))
+        await self._conn.commit()
+
+    async def take(self, shard: int, limit: int = 100):
+        async with self._conn.execute(
+            'SELECT id, user_id, payload FROM update_queue WHERE shard = ? ORDER BY id LIMIT ?', (shard, limit)
+        ) as cursor:
+            return await cursor.fetchall()
+
+    async def ack(self, ids):
+        await self._conn.executemany('DELETE FROM update_queue WHERE id = ?', [(id_,) for id_ in ids])
+        await self._conn.commit()
+
+    async def pending(self) -> int:
+        async with self._conn.execute('SELECT COUNT(*) FROM update_queue') as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def poll_updates(bot: Bot, queue: UpdateQueue, workers: int, *, allowed_updates=None, timeout: int = 30):
+    """
+    Ingress для long polling. offset сдвигается только после коммита пачки в очередь,
+    так что при перезапуске Telegram отдаст несохраненные обновления повторно.
+    """
+    offset = None
+    while True:
+        try:
+            updates = await bot(GetUpdates(offset=offset, timeout=timeout, allowed_updates=allowed_updates))
+        except Exception:
+            logger.exception('Не удалось получить обновления')
+            await asyncio.sleep(1)
+            continue
+        if updates:
+            await queue.put([update.model_dump(mode='json', by_alias=True, exclude_unset=True) for update in updates],
+                            workers)
+            offset = updates[-1].update_id + 1
+
+
+async def _feed(dispatcher: Dispatcher, bot: Bot, updates):
+    for update in updates:
+        try:
+            await dispatcher.feed_raw_update(bot, update)
+        except Exception:
+            logger.exception('Ошибка при обработке обновления %s', update.get('update_id'))
+
+
+async def run_worker(dispatcher: Dispatcher, bot: Bot, queue: UpdateQueue, shard: int, *,
+                     batch_size: int = 100, poll_interval: float = 0.05, stop: asyncio.Event = None):
+    """
+    Разбирает шард пачками: обновления разных пользователей обрабатываются параллельно,
+    одного пользователя — строго по порядку поступления.
+    """
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        rows = await queue.take(shard, batch_size)
+        if not rows:
+            try:
+                await asyncio.wait_for(stop.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        by_user = {}
+        for row in rows:
+            by_user.setdefault(row['user_id'], []).append(json.loads(row['payload']))
+        await asyncio.gather(*(_feed(dispatcher, bot, updates) for updates in by_user.values()))
+        await queue.ack([row['id'] for row in rows])
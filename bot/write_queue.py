@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+from bot.db import Database
+from bot.sql_queries import add_or_update_attendances
+
+
+logger = logging.getLogger(__name__)
+
+
+class AttendanceWriteQueue:
+    """
+    Собирает записи посещаемости, пришедшие в пределах max_delay секунд, и пишет их одной
+    транзакцией (один коммит и один fsync на пачку). submit() возвращается только после коммита,
+    поэтому обработчик отвечает тренеру, когда запись уже сохранена.
+    """
+
+    def __init__(self, db: Database, max_delay: float = 0.005, max_batch: int = 200):
+        self.db = db
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.batches = 0
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._worker is not None:
+            await self._queue.join()
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def submit(self, data: dict):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((data, future))
+        await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, rows):
+        async with self.db.write() as conn:
+            await add_or_update_attendances(conn, rows)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._write([data for data, future in batch])
+                self.batches += 1
+                results = [None] * len(batch)
+            except Exception:
+                # Одна ошибочная строка не должна отклонять чужие записи: повторяем по одной
+                logger.exception('Не удалось записать пачку посещаемости из %s строк', len(batch))
+                results = []
+                for data, future in batch:
+                    try:
+                        await self._write([data])
+                        self.batches += 1
+                        results.append(None)
+                    except Exception as exc:
+                        results.append(exc)
+
+            for (data, future), result in zip(batch, results):
+                if future.done():
+                    pass
+                elif result is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(result)
+                self._queue.task_done()
@@ -1,10 +1,21 @@
-from django.contrib import admin
-from django.http import HttpResponse
-import pandas as pd
-from datetime import datetime, timedelta
-from io import BytesIO
-from django.db.models import Sum, F, Case, When, IntegerField
-from .models import Trainer, Training, Attendance, Price, TrainingSchedule, DAYS_OF_WEEK
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
+from datetime import datetime
+from .forms import BroadcastActionForm, PriceScenarioFormSet, PriceSimulationForm, TrainerActionForm
+from .models import (
+    Trainer, Training, Attendance, Price, TrainingSchedule, TrainerMonthlyPayroll, Broadcast, OutboundMessage, ReportJob,
+    TrainingSession,
+)
+from .pagination import CURSOR_VAR, IndexedDatesQuerySet, KeysetChangeList, KeysetPaginator
+from .report_jobs import request_salary_report
+from .reports import current_month_period
+from .sessions import held_sessions, missing_attendance
 from rangefilter.filters import (
     DateRangeFilterBuilder,
     DateTimeRangeFilterBuilder,
@@ -13,149 +24,53 @@ from rangefilter.filters import (
 )
 
 
+def get_report_options(modeladmin, request):
+    form = modeladmin.action_form(request.POST)
+    form.fields['action'].choices = modeladmin.get_action_choices(request)
+
+    start_date, end_date = current_month_period()
+    report_format = 'xlsx'
+    if form.is_valid():
+        start_date = form.cleaned_data.get('start_date') or start_date
+        end_date = form.cleaned_data.get('end_date') or end_date
+        report_format = form.cleaned_data.get('report_format') or report_format
+    return start_date, end_date, report_format
+
+
 def download_salary_report(modeladmin, request, queryset):
-    now = datetime.now()
-    start_of_month = now.replace(day=1)
-    end_of_month = (start_of_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-
-    attendances = Attendance.objects.filter(
-        recording_date__range=(start_of_month, end_of_month)
-    ).select_related(
-        'training',
-        'training__trainer'
-    ).prefetch_related(
-        'training__price_set'
-    )
+    start_date, end_date, report_format = get_report_options(modeladmin, request)
+    job = request_salary_report(list(queryset.values_list('pk', flat=True)), start_date, end_date, report_format)
+    if job.status == 'done':
+        return HttpResponseRedirect(job.file.url)
 
-    data = []
-    total_by_trainer = {}
-
-    for attendance in attendances:
-        training = attendance.training
-        trainer = training.trainer
-        price = Price.objects.filter(training=training).first()
-
-        if not price:
-            continue
-
-        # Новая формула расчета
-        if attendance.attend_count <= price.quantity_to:
-            payment = attendance.attend_count * price.price_to
-            per_class_price = price.price_to  # Цена за занятие
-        else:
-            payment = attendance.attend_count * price.price_from
-            per_class_price = price.price_from  # Цена за занятие
-
-        if trainer.id not in total_by_trainer:
-            total_by_trainer[trainer.id] = {
-                'name': trainer.full_name,
-                'total': 0,
-                'classes': 0
-            }
-        total_by_trainer[trainer.id]['total'] += payment
-        total_by_trainer[trainer.id]['classes'] += 1
-
-        training_schedule = TrainingSchedule.objects.filter(training=attendance.training).first()
-        combined_datetime = attendance.recording_datetime(training_schedule)
-
-        data.append({
-            'Тренер': trainer.full_name,
-            'Занятие': training.name,
-            'Дата и время': combined_datetime,
-            'День недели': dict(DAYS_OF_WEEK)[attendance.recording_day],
-            'Количество участников': attendance.attend_count,
-            'Цена': per_class_price,
-            'Сумма за занятие': payment
-        })
+    modeladmin.message_user(request, "Отчет формируется в фоне, ссылка на файл появится на этой странице")
+    return HttpResponseRedirect(reverse('admin:training_reportjob_change', args=[job.pk]))
 
-    for trainer_id, trainer_data in total_by_trainer.items():
-        data.append({
-            'Тренер': f"ИТОГО {trainer_data['name']}",
-            'Занятие': f"Всего занятий: {trainer_data['classes']}",
-            'Дата и время': None,
-            'День недели': None,
-            'Количество участников': None,
-            'Цена': None,
-            'Сумма за занятие': trainer_data['total']
-        })
+download_salary_report.short_description = "Скачать отчет по зарплате"
 
-    df = pd.DataFrame(data)
-
-    summary_data = [
-        {
-            'Тренер': trainer_data['name'],
-            'Количество занятий': trainer_data['classes'],
-            'Общая сумма': trainer_data['total']
-        }
-        for trainer_data in total_by_trainer.values()
-    ]
-
-    total_classes = sum(trainer_data['classes'] for trainer_data in total_by_trainer.values())
-    total_salary = sum(trainer_data['total'] for trainer_data in total_by_trainer.values())
-    summary_data.append({
-        'Тренер': 'ОБЩИЙ ИТОГ',
-        'Количество занятий': total_classes,
-        'Общая сумма': total_salary
-    })
-
-    summary_df = pd.DataFrame(summary_data)
-
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name='Детализация', index=False)
-        summary_df.to_excel(writer, sheet_name='Итоги', index=False)
-
-        workbook = writer.book
-        worksheet = writer.sheets['Детализация']
-        summary_worksheet = writer.sheets['Итоги']
-
-        header_format = workbook.add_format({
-            'bold': True,
-            'bg_color': '#C0C0C0'
-        })
 
-        total_format = workbook.add_format({
-            'bold': True,
-            'bg_color': '#E0E0E0'
-        })
+def send_broadcast(modeladmin, request, queryset):
+    form = modeladmin.action_form(request.POST)
+    form.fields['action'].choices = modeladmin.get_action_choices(request)
+    text = form.cleaned_data['message'].strip() if form.is_valid() else ''
+    if not text:
+        modeladmin.message_user(request, "Введите текст рассылки", level=messages.ERROR)
+        return None
 
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-
-        for col_num, value in enumerate(summary_df.columns.values):
-            summary_worksheet.write(0, col_num, value, header_format)
-
-        for i, col in enumerate(df.columns):
-            column_len = max(df[col].astype(str).apply(len).max(), len(col) + 2)
-            worksheet.set_column(i, i, column_len)
-
-        for i, col in enumerate(summary_df.columns):
-            column_len = max(summary_df[col].astype(str).apply(len).max(), len(col) + 2)
-            summary_worksheet.set_column(i, i, column_len)
-
-        for row_num, row in enumerate(df.values):
-            if str(row[0]).startswith('ИТОГО'):
-                for col_num in range(len(row)):
-                    value = row[col_num]
-                    if pd.isna(value) or value == float('inf') or value == float('-inf'):
-                        value = 0
-                    worksheet.write(row_num + 1, col_num, value, total_format)
-
-        last_row = len(summary_data)
-        for col_num in range(len(summary_df.columns)):
-            summary_worksheet.write(last_row, col_num, summary_df.iloc[-1][col_num], total_format)
-
-    output.seek(0)
-    filename = f'trainer_salary_report_{now.strftime("%Y%m%d_%H%M%S")}.xlsx'
-    response = HttpResponse(
-        output,
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    chat_ids = list(queryset.exclude(tg_id__isnull=True).exclude(tg_id='').values_list('tg_id', flat=True))
+    if not chat_ids:
+        modeladmin.message_user(request, "Ни один из выбранных тренеров не подключил бота", level=messages.WARNING)
+        return None
 
-    return response
+    with transaction.atomic():
+        broadcast = Broadcast.objects.create(text=text)
+        OutboundMessage.objects.bulk_create([
+            OutboundMessage(broadcast=broadcast, chat_id=chat_id, text=text) for chat_id in chat_ids
+        ])
+    modeladmin.message_user(request, f"Рассылка поставлена в очередь: {len(chat_ids)} получателей")
+    return HttpResponseRedirect(reverse('admin:training_broadcast_change', args=[broadcast.pk]))
 
-download_salary_report.short_description = "Скачать отчет по зарплате"
+send_broadcast.short_description = "Отправить сообщение в Telegram"
 
 
 class PriceInline(admin.TabularInline):
@@ -177,11 +92,15 @@ class TrainingScheduleInline(admin.TabularInline):
 class TrainerAdmin(admin.ModelAdmin):
     list_display = ('first_name', 'last_name', 'phone_number')
     search_fields = ('first_name', 'last_name', 'phone_number')
+    actions = [send_broadcast]
+    action_form = BroadcastActionForm
 
 @admin.register(Training)
 class TrainingAdmin(admin.ModelAdmin):
     list_display = ('name', 'trainer', 'start_date', 'end_date')
+    list_select_related = ('trainer',)
     search_fields = ('name', 'trainer__first_name', 'trainer__last_name')
+    autocomplete_fields = ('trainer',)
     list_filter = (
             ("start_date", DateRangeFilterBuilder()),
             (
@@ -198,12 +117,218 @@ class TrainingAdmin(admin.ModelAdmin):
     ordering = ('start_date',)
     inlines = [TrainingScheduleInline, PriceInline]
     actions = [download_salary_report]
+    action_form = TrainerActionForm
+
+    def get_urls(self):
+        return [
+            path(
+                'simulate-prices/',
+                self.admin_site.admin_view(self.simulate_prices_view),
+                name='training_training_simulate_prices',
+            ),
+        ] + super().get_urls()
+
+    def simulate_prices_view(self, request):
+        # numpy нужен только здесь, поэтому не загружается при каждом запуске админки
+        from .simulation import TIER_FIELDS, Scenario, previous_year_period, simulate_prices
+
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        start_date, end_date = previous_year_period()
+        data = request.POST if request.method == 'POST' else None
+        form = PriceSimulationForm(data, initial={'start_date': start_date, 'end_date': end_date})
+        formset = PriceScenarioFormSet(data, prefix='scenario')
+
+        result = None
+        if data is not None and form.is_valid() and formset.is_valid():
+            scenarios = []
+            for i, scenario in enumerate(formset.cleaned_data):
+                if not scenario:
+                    continue
+                changes = {field: scenario[field] for field in TIER_FIELDS}
+                trainings = [training.pk for training in scenario['trainings']] or [None]
+                scenarios.append(Scenario(
+                    name=scenario['name'] or f'Сценарий {i + 1}',
+                    prices={training_id: changes for training_id in trainings},
+                ))
+            if scenarios:
+                result = simulate_prices(form.cleaned_data['start_date'], form.cleaned_data['end_date'], scenarios)
+
+        return TemplateResponse(request, 'admin/training/training/simulate_prices.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Моделирование цен',
+            'opts': self.model._meta,
+            'form': form,
+            'formset': formset,
+            'result': result,
+        })
 
 
 
 @admin.register(Attendance)
 class AttendanceAdmin(admin.ModelAdmin):
     list_display = ('training', 'attend_count', 'recording_day', 'recording_date')
+    list_select_related = ('training',)
     search_fields = ('training__name', 'recording_day')
-    list_filter = ('recording_date', 'recording_day')
-    ordering = ('recording_date',)
+    list_filter = ('recording_day',)
+    date_hierarchy = 'recording_date'
+    autocomplete_fields = ('training',)
+    # новые записи сверху; порядок совпадает с индексом attendance_date_id_idx
+    ordering = ('-recording_date', '-id')
+    # без второго COUNT(*) по всей таблице рядом с количеством по фильтру
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return IndexedDatesQuerySet(queryset.model, queryset.query, queryset.db)
+
+    def delete_queryset(self, request, queryset):
+        # IndexedDatesQuerySet — не PayrollQuerySet: удаление со сводкой зарплат идет через менеджер модели
+        Attendance.objects.filter(pk__in=queryset.values('pk')).delete()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return KeysetPaginator(
+            queryset, per_page, 'recording_date', cursor=request.GET.get(CURSOR_VAR),
+            orphans=orphans, allow_empty_first_page=allow_empty_first_page,
+        )
+
+
+class AttendanceStatusFilter(admin.SimpleListFilter):
+    title = 'Посещаемость'
+    parameter_name = 'attendance'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('missing', 'Не записана'),
+            ('recorded', 'Записана'),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() == 'missing':
+            return missing_attendance(queryset & held_sessions())
+        if self.value() == 'recorded':
+            return queryset.filter(Exists(Attendance.objects.filter(
+                training_id=OuterRef('training_id'), recording_date=OuterRef('session_date'),
+            )))
+        return queryset
+
+
+@admin.register(TrainingSession)
+class TrainingSessionAdmin(admin.ModelAdmin):
+    """Занятия по расписанию (manage.py sync_sessions); фильтр «Не записана» — отчет о пропущенной посещаемости."""
+    list_display = ('session_date', 'start_time', 'end_time', 'training', 'trainer')
+    list_select_related = ('training__trainer',)
+    list_filter = (AttendanceStatusFilter, ('session_date', DateRangeFilterBuilder()))
+    search_fields = ('training__name', 'training__trainer__first_name', 'training__trainer__last_name')
+    ordering = ('-session_date', 'start_time')
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # строки строит sync_sessions; удаленные вручную не восстановились бы до правки расписания
+        return False
+
+    @admin.display(description='Тренер', ordering='training__trainer__last_name')
+    def trainer(self, obj):
+        return obj.training.trainer or '—'
+
+
+@admin.register(TrainerMonthlyPayroll)
+class TrainerMonthlyPayrollAdmin(admin.ModelAdmin):
+    list_display = ('trainer', 'month', 'classes', 'participants', 'amount')
+    list_select_related = ('trainer',)
+    list_filter = ('month',)
+    search_fields = ('trainer__first_name', 'trainer__last_name')
+    ordering = ('-month', 'trainer__last_name')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class OutboundMessageInline(admin.TabularInline):
+    model = OutboundMessage
+    fields = ('chat_id', 'status', 'attempts', 'error', 'sent_date')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ('created_date', 'text', 'total', 'sent', 'failed', 'progress')
+    fields = ('text', 'created_date', 'total', 'sent', 'failed', 'progress')
+    readonly_fields = fields
+    inlines = [OutboundMessageInline]
+    ordering = ('-created_date',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            total_count=Count('messages'),
+            sent_count=Count('messages', filter=Q(messages__status='sent')),
+            failed_count=Count('messages', filter=Q(messages__status='failed')),
+        )
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description='Получателей', ordering='total_count')
+    def total(self, obj):
+        return obj.total_count
+
+    @admin.display(description='Доставлено', ordering='sent_count')
+    def sent(self, obj):
+        return obj.sent_count
+
+    @admin.display(description='Ошибок', ordering='failed_count')
+    def failed(self, obj):
+        return obj.failed_count
+
+    @admin.display(description='Прогресс')
+    def progress(self, obj):
+        if not obj.total_count:
+            return '—'
+        return f'{(obj.sent_count + obj.failed_count) * 100 // obj.total_count}%'
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('created_date', 'start_date', 'end_date', 'report_format', 'status', 'download', 'duration')
+    list_filter = ('status', 'report_format')
+    fields = (
+        'start_date', 'end_date', 'report_format', 'training_ids', 'status', 'download', 'error',
+        'created_date', 'started_date', 'finished_date', 'duration',
+    )
+    readonly_fields = fields
+    ordering = ('-pk',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Файл')
+    def download(self, obj):
+        if obj.status != 'done' or not obj.file:
+            return '—'
+        return format_html('<a href="{}">{}</a>', obj.file.url, obj.file.name.rsplit('/', 1)[-1])
+
+    @admin.display(description='Длительность')
+    def duration(self, obj):
+        if not (obj.started_date and obj.finished_date):
+            return '—'
+        return f'{(obj.finished_date - obj.started_date).total_seconds():.1f} с'
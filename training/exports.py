@@ -0,0 +1,134 @@
+import csv
+import zlib
+
+import xlsxwriter
+
+from .models import REPORT_FORMATS
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Ширина колонок задается заранее: в режиме constant_memory строки сразу уходят
+# во временный файл, и пересчитать ширину по содержимому уже нельзя.
+DETAIL_COLUMNS = [
+    ('Тренер', 'trainer', 32),
+    ('Занятие', 'training', 32),
+    ('Дата и время', 'recorded_at', 18),
+    ('День недели', 'day', 14),
+    ('Количество участников', 'attend_count', 23),
+    ('Цена', 'price', 10),
+    ('Сумма за занятие', 'payment', 18),
+]
+
+SUMMARY_COLUMNS = [
+    ('Тренер', 'name', 32),
+    ('Количество занятий', 'classes', 20),
+    ('Общая сумма', 'total', 14),
+]
+
+def _trainer_total_row(trainer):
+    return {
+        'trainer': f"ИТОГО {trainer['name']}",
+        'training': f"Всего занятий: {trainer['classes']}",
+        'payment': trainer['total'],
+    }
+
+
+def _summary_rows(report):
+    yield from report['trainers']
+    yield {'name': 'ОБЩИЙ ИТОГ', **report['total']}
+
+
+def write_xlsx(report, output):
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'in_memory': False})
+    header_format = workbook.add_format({'bold': True, 'bg_color': '#C0C0C0'})
+    total_format = workbook.add_format({'bold': True, 'bg_color': '#E0E0E0'})
+
+    worksheet = workbook.add_worksheet('Детализация')
+    for col_num, (title, key, width) in enumerate(DETAIL_COLUMNS):
+        worksheet.set_column(col_num, col_num, width)
+        worksheet.write(0, col_num, title, header_format)
+
+    row_num = 0
+    for row_num, row in enumerate(report['rows'], start=1):
+        worksheet.write_row(row_num, 0, [row[key] for title, key, width in DETAIL_COLUMNS])
+
+    for trainer in report['trainers']:
+        row_num += 1
+        total_row = _trainer_total_row(trainer)
+        for col_num, (title, key, width) in enumerate(DETAIL_COLUMNS):
+            worksheet.write(row_num, col_num, total_row.get(key), total_format)
+
+    summary_worksheet = workbook.add_worksheet('Итоги')
+    for col_num, (title, key, width) in enumerate(SUMMARY_COLUMNS):
+        summary_worksheet.set_column(col_num, col_num, width)
+        summary_worksheet.write(0, col_num, title, header_format)
+
+    summary = list(_summary_rows(report))
+    for row_num, row in enumerate(summary, start=1):
+        cell_format = total_format if row_num == len(summary) else None
+        summary_worksheet.write_row(row_num, 0, [row[key] for title, key, width in SUMMARY_COLUMNS], cell_format)
+
+    workbook.close()
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def iter_csv(report):
+    writer = csv.writer(_Echo(), delimiter=';')
+    # BOM, чтобы Excel открывал кириллицу без выбора кодировки
+    yield '\ufeff' + writer.writerow([title for title, key, width in DETAIL_COLUMNS])
+    for row in report['rows']:
+        yield writer.writerow([row[key] for title, key, width in DETAIL_COLUMNS])
+    for trainer in report['trainers']:
+        total_row = _trainer_total_row(trainer)
+        yield writer.writerow([total_row.get(key, '') for title, key, width in DETAIL_COLUMNS])
+
+    yield writer.writerow([])
+    yield writer.writerow([title for title, key, width in SUMMARY_COLUMNS])
+    for row in _summary_rows(report):
+        yield writer.writerow([row[key] for title, key, width in SUMMARY_COLUMNS])
+
+
+def _iter_encoded(lines):
+    buffer = []
+    size = 0
+    for line in lines:
+        encoded = line.encode('utf-8')
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _iter_gzip(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def write_report(report, output, report_format='xlsx'):
+    """
+    Пишет отчет в открытый двоичный файл: строки читаются из курсора порциями и сразу уходят
+    в файл (CSV) или во временный файл xlsxwriter, так что отчет не собирается в памяти целиком.
+    """
+    if report_format not in dict(REPORT_FORMATS):
+        raise ValueError(f'Неизвестный формат отчета: {report_format}')
+    if report_format == 'xlsx':
+        write_xlsx(report, output)
+        return
+
+    chunks = _iter_encoded(iter_csv(report))
+    if report_format == 'csv.gz':
+        chunks = _iter_gzip(chunks)
+    for chunk in chunks:
+        output.write(chunk)
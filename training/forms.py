@@ -1,7 +1,7 @@
 from django import forms
 from django.contrib.admin.helpers import ActionForm
 
-from training.models import Price, Trainer
+from training.models import REPORT_FORMATS, Price, Trainer, Training
 
 
 class PriceToForm(forms.ModelForm):
@@ -38,3 +38,36 @@ class TrainerActionForm(ActionForm):
     action = forms.ChoiceField(choices=[], required=True,)
     start_date = forms.DateField(required=False, label="Начальная дата", widget=forms.TextInput(attrs={'type': 'date'}))
     end_date = forms.DateField(required=False, label="Конечная дата", widget=forms.TextInput(attrs={'type': 'date'}))
+    report_format = forms.ChoiceField(choices=REPORT_FORMATS, required=False, initial='xlsx', label="Формат")
+
+
+class BroadcastActionForm(ActionForm):
+    message = forms.CharField(
+        required=False, label="Текст рассылки", widget=forms.Textarea(attrs={'rows': 2, 'cols': 60})
+    )
+
+
+class PriceSimulationForm(forms.Form):
+    start_date = forms.DateField(label="Начальная дата", widget=forms.TextInput(attrs={'type': 'date'}))
+    end_date = forms.DateField(label="Конечная дата", widget=forms.TextInput(attrs={'type': 'date'}))
+
+
+class PriceScenarioForm(forms.Form):
+    name = forms.CharField(required=False, max_length=100, label="Сценарий")
+    trainings = forms.ModelMultipleChoiceField(
+        queryset=Training.objects.filter(trainer__isnull=False).order_by('name'), required=False,
+        label="Занятия", help_text="Пусто — все занятия с ценой",
+    )
+    quantity_to = forms.IntegerField(required=False, min_value=0, label="Количество до")
+    price_to = forms.IntegerField(required=False, min_value=0, label="Цена до")
+    price_from = forms.IntegerField(required=False, min_value=0, label="Цена от")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        tier = (cleaned_data.get('quantity_to'), cleaned_data.get('price_to'), cleaned_data.get('price_from'))
+        if self.has_changed() and all(value is None for value in tier):
+            raise forms.ValidationError("Укажите хотя бы одно новое значение тарифа.")
+        return cleaned_data
+
+
+PriceScenarioFormSet = forms.formset_factory(PriceScenarioForm, extra=3)
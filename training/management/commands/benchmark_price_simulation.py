@@ -0,0 +1,63 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from training.simulation import PriceSimulator, Tiers
+
+
+class Command(BaseCommand):
+    help = 'Замеряет моделирование тарифов на синтетической истории посещаемости'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--scenarios', type=int, default=100)
+        parser.add_argument('--trainings', type=int, default=500)
+        parser.add_argument('--python-sample', type=int, default=100_000, help='Строк для замера цикла на Python')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        rows, trainings, scenario_count = options['rows'], options['trainings'], options['scenarios']
+        training_idx = rng.integers(0, trainings, rows)
+        attend_count = np.minimum(rng.poisson(12, rows), 60)
+        tiers = Tiers(
+            quantity_to=rng.integers(5, 20, (scenario_count, trainings)),
+            price_to=rng.integers(50, 150, (scenario_count, trainings)),
+            price_from=rng.integers(150, 300, (scenario_count, trainings)),
+        )
+        results = {'rows': rows, 'scenarios': scenario_count, 'trainings': trainings, 'seconds': {}}
+
+        # прежний путь: тариф выбирается для каждой строки в Python; замер на выборке, пересчет на все
+        sample = min(options['python_sample'], rows)
+        sample_rows = list(zip(training_idx[:sample].tolist(), attend_count[:sample].tolist()))
+        quantity_to, price_to, price_from = (values[0].tolist() for values in tiers)
+        started = time.perf_counter()
+        total = 0
+        for training, count in sample_rows:
+            total += count * (price_to[training] if count <= quantity_to[training] else price_from[training])
+        results['seconds']['python_rows_estimated'] = round(
+            (time.perf_counter() - started) * rows / sample * scenario_count, 1
+        )
+
+        started = time.perf_counter()
+        by_rows = np.array([
+            (attend_count * np.where(
+                attend_count <= tiers.quantity_to[row][training_idx],
+                tiers.price_to[row][training_idx],
+                tiers.price_from[row][training_idx],
+            )).sum()
+            for row in range(scenario_count)
+        ])
+        results['seconds']['numpy_rows'] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        simulator = PriceSimulator(training_idx, attend_count, np.ones(rows, dtype=np.int64), trainings)
+        results['seconds']['simulator_build'] = round(time.perf_counter() - started, 3)
+        started = time.perf_counter()
+        by_simulator = simulator.payments(tiers).sum(axis=1)
+        results['seconds']['simulator_scenarios'] = round(time.perf_counter() - started, 4)
+
+        results['totals_match'] = bool(np.array_equal(by_rows, by_simulator))
+        self.stdout.write(json.dumps(results, indent=2, ensure_ascii=False))
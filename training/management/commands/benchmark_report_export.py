@@ -0,0 +1,121 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+from io import BytesIO
+
+import xlsxwriter
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from training.exports import iter_csv, write_xlsx
+from training.models import Training
+from training.reports import build_salary_report
+
+
+# "baseline" — прежний путь выгрузки без pandas, замеряется всегда; "legacy" (сам прежний код
+# с DataFrame) и импорт pandas — только если pandas установлен отдельно
+IMPORT_SNIPPETS = {
+    'training.admin': 'import django; django.setup(); import training.admin',
+    'training.admin+pandas (legacy)': 'import django; django.setup(); import pandas; import training.admin',
+}
+
+
+class Command(BaseCommand):
+    help = 'Замеряет пиковую память выгрузки отчета по зарплате и время импорта модулей воркера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, default=date(2000, 1, 1))
+        parser.add_argument('--end', type=date.fromisoformat, default=date.today())
+        parser.add_argument('--child', choices=['xlsx', 'csv', 'baseline', 'legacy'], help='Внутренний режим: одна выгрузка')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.export(options['child'], options['start'], options['end'])
+            return
+
+        results = {'import_seconds': {}, 'peak_rss_mb': {}}
+        for name, snippet in IMPORT_SNIPPETS.items():
+            seconds = self.measure_import(snippet)
+            if seconds is not None:
+                results['import_seconds'][name] = seconds
+
+        for mode in ('legacy', 'baseline', 'xlsx', 'csv'):
+            rss = self.measure_export(mode, options['start'], options['end'])
+            if rss is not None:
+                results['peak_rss_mb'][mode] = rss
+
+        self.stdout.write(json.dumps(results, indent=2, ensure_ascii=False))
+
+    def measure_import(self, snippet):
+        code = f'import time; t = time.perf_counter(); {snippet}; print(time.perf_counter() - t)'
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'trainingmanager.settings')}
+        timings = []
+        for _ in range(3):
+            process = subprocess.run(
+                [sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+            )
+            if process.returncode != 0:
+                return None
+            timings.append(float(process.stdout.strip().splitlines()[-1]))
+        return round(min(timings), 3)
+
+    def measure_export(self, mode, start, end):
+        process = subprocess.run(
+            [sys.executable, 'manage.py', 'benchmark_report_export', '--child', mode,
+             '--start', start.isoformat(), '--end', end.isoformat()],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            return None
+        return json.loads(process.stdout.strip().splitlines()[-1])['peak_rss_mb']
+
+    def export(self, mode, start, end):
+        report = build_salary_report(Training.objects.all(), start, end)
+        started = time.perf_counter()
+
+        if mode == 'xlsx':
+            with tempfile.TemporaryFile() as output:
+                write_xlsx(report, output)
+        elif mode == 'csv':
+            for _ in iter_csv(report):
+                pass
+        elif mode == 'baseline':
+            self.export_baseline(report)
+        else:
+            self.export_legacy(report)
+
+        self.stdout.write(json.dumps({
+            'seconds': round(time.perf_counter() - started, 3),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }))
+
+    def export_baseline(self, report):
+        # Прежний путь без pandas: все строки списком в памяти, книга целиком в BytesIO и ширина
+        # колонок по самому длинному значению, как у DataFrame.to_excel в export_legacy
+        rows = list(report['rows'])
+        columns = list(rows[0]) if rows else []
+        output = BytesIO()
+        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+        worksheet = workbook.add_worksheet('Детализация')
+        worksheet.write_row(0, 0, columns)
+        for row_num, row in enumerate(rows, start=1):
+            worksheet.write_row(row_num, 0, [row[column] for column in columns])
+        for i, column in enumerate(columns):
+            worksheet.set_column(i, i, max([len(str(row[column])) for row in rows] + [len(column) + 2]))
+        workbook.close()
+
+    def export_legacy(self, report):
+        # Прежний путь: список словарей -> DataFrame -> BytesIO и ширина колонок по содержимому
+        import pandas as pd
+
+        df = pd.DataFrame(list(report['rows']))
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+            df.to_excel(writer, sheet_name='Детализация', index=False)
+            for i, col in enumerate(df.columns):
+                writer.sheets['Детализация'].set_column(i, i, max(df[col].astype(str).apply(len).max(), len(col) + 2))
@@ -0,0 +1,70 @@
+import json
+import tempfile
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+from training.models import ReportJob, Training
+from training.report_jobs import claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет действие "Скачать отчет по зарплате" в админке: постановку задачи, ее выполнение воркером '
+        'и повторный запрос из кэша. Создает пользователя и задачи, поэтому запускайте на копии базы'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, default=date.today() - timedelta(days=365))
+        parser.add_argument('--end', type=date.fromisoformat, default=date.today())
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        user, created = get_user_model().objects.get_or_create(
+            username='benchmark', defaults={'is_staff': True, 'is_superuser': True},
+        )
+        client = Client()
+        client.force_login(user)
+        data = {
+            'action': 'download_salary_report',
+            '_selected_action': list(Training.objects.values_list('pk', flat=True)),
+            'start_date': options['start'].isoformat(),
+            'end_date': options['end'].isoformat(),
+        }
+
+        results = {'trainings': len(data['_selected_action'])}
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            for report_format in ('xlsx', 'csv'):
+                results[report_format] = self.measure(client, {**data, 'report_format': report_format})
+        self.stdout.write(json.dumps(results, ensure_ascii=False))
+
+    def measure(self, client, data):
+        url = reverse('admin:training_training_changelist')
+        ReportJob.objects.all().delete()
+
+        started = time.perf_counter()
+        client.post(url, data)
+        enqueue = time.perf_counter() - started
+
+        started = time.perf_counter()
+        job = run_job(claim_job())
+        build = time.perf_counter() - started
+        if job.status != 'done':
+            raise CommandError(f'Отчет не сформирован: {job.error}')
+
+        started = time.perf_counter()
+        response = client.post(url, data)
+        cached = time.perf_counter() - started
+        if response.url != job.file.url:
+            raise CommandError('Повторный запрос не отдал готовый файл из кэша')
+
+        return {
+            'enqueue_ms': round(enqueue * 1000, 2),
+            'build_seconds': round(build, 3),
+            'cached_ms': round(cached * 1000, 2),
+        }
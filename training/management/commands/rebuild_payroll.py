@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from training.payroll import rebuild_payroll, verify_payroll
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает сводку зарплат по тренерам и месяцам из посещаемости и сверяет ее'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-only', action='store_true', help='Только сверить, ничего не меняя')
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            rows = rebuild_payroll()
+            self.stdout.write(f'Записано строк сводки: {len(rows)}')
+
+        mismatches = verify_payroll()
+        for (trainer_id, month), (stored, expected) in sorted(mismatches.items()):
+            self.stderr.write(f'Тренер {trainer_id}, {month:%Y-%m}: в таблице {stored}, пересчитано {expected}')
+        if mismatches:
+            raise CommandError(f'Расхождений в сводке: {len(mismatches)}')
+
+        self.stdout.write(self.style.SUCCESS('Сводка совпадает с посещаемостью'))
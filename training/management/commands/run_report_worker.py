@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from training.report_jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Формирует отчеты по зарплате из очереди ReportJob и складывает файлы в MEDIA_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить задачи из очереди и выйти')
+        parser.add_argument('--poll-interval', type=float, default=2, help='Пауза между проверками очереди, с')
+        parser.add_argument('--stale-after', type=float, default=600,
+                            help='Через сколько секунд задача "в работе" считается брошенной')
+        parser.add_argument('--keep-days', type=int, default=30, help='Сколько дней хранить готовые отчеты')
+
+    def handle(self, *args, **options):
+        run_worker(
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+            stale_after=options['stale_after'],
+            keep_days=options['keep_days'],
+        )
@@ -0,0 +1,35 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from training.models import Trainer, Training
+from training.synthetic import seed_synthetic_data
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими тренерами, занятиями, расписанием, ценами и посещаемостью'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trainers', type=int, default=10)
+        parser.add_argument('--trainings-per-trainer', type=int, default=3)
+        parser.add_argument('--years', type=int, default=1, help='За сколько лет до --end-date создать посещаемость')
+        parser.add_argument('--end-date', type=date.fromisoformat, default=date.today(),
+                            help='Последний день посещаемости; задайте явно, чтобы база совпадала между запусками')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--flush', action='store_true', help='Сначала удалить всех тренеров и занятия')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            Training.objects.all().delete()
+            Trainer.objects.all().delete()
+        elif Trainer.objects.exists() or Training.objects.exists():
+            raise CommandError('В базе уже есть тренеры или занятия; используйте --flush, чтобы заменить их')
+
+        counts = seed_synthetic_data(
+            options['end_date'],
+            trainers=options['trainers'],
+            trainings_per_trainer=options['trainings_per_trainer'],
+            years=options['years'],
+            seed=options['seed'],
+        )
+        self.stdout.write(', '.join(f'{name}: {count}' for name, count in counts.items()))
@@ -0,0 +1,53 @@
+import json
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from training.simulation import TIER_FIELDS, Scenario, previous_year_period, simulate_prices
+
+
+def load_scenarios(path):
+    """
+    JSON-файл: [{"name": "...", "prices": {"all" | "<training_id>": {"quantity_to": 12, ...}}}].
+    "all" — все занятия, у которых сейчас есть цена.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            items = json.load(f)
+        return [
+            Scenario(
+                name=item['name'],
+                prices={
+                    None if key == 'all' else int(key): {field: changes[field] for field in TIER_FIELDS if field in changes}
+                    for key, changes in item['prices'].items()
+                },
+            )
+            for item in items
+        ]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise CommandError(f'Не удалось прочитать сценарии из {path}: {e}')
+
+
+class Command(BaseCommand):
+    help = 'Считает, какой была бы зарплата тренеров за период при других тарифах'
+
+    def add_arguments(self, parser):
+        start, end = previous_year_period()
+        parser.add_argument('scenarios', help='JSON-файл со сценариями')
+        parser.add_argument('--start', type=date.fromisoformat, default=start)
+        parser.add_argument('--end', type=date.fromisoformat, default=end)
+        parser.add_argument('--json', action='store_true', help='Вывести результат целиком в JSON')
+        parser.add_argument('--top', type=int, default=10, help='Сколько тренеров с наибольшим изменением показать')
+
+    def handle(self, *args, **options):
+        result = simulate_prices(options['start'], options['end'], load_scenarios(options['scenarios']))
+        if options['json']:
+            self.stdout.write(json.dumps(result, cls=DjangoJSONEncoder, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"{result['start_date']} — {result['end_date']}: по текущим ценам {result['baseline']}")
+        for scenario in result['scenarios']:
+            self.stdout.write(f"\n{scenario['name']}: {scenario['total']} ({scenario['delta']:+})")
+            for trainer in scenario['trainers'][:options['top']]:
+                self.stdout.write(f"  {trainer['name']}: {trainer['baseline']} → {trainer['amount']} ({trainer['delta']:+})")
@@ -0,0 +1,28 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from training.sessions import sync_sessions
+
+
+class Command(BaseCommand):
+    help = 'Достраивает таблицу проведенных занятий (TrainingSession) по расписанию'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--until', type=date.fromisoformat, help='До какого дня включительно, по умолчанию сегодня')
+        parser.add_argument('--full', action='store_true', help='Перестроить все занятия заново')
+        parser.add_argument('--every', type=float, help='Повторять каждые N секунд, не завершаясь')
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            stats = sync_sessions(until=options['until'], full=full)
+            self.stdout.write(
+                f"Перестроено занятий: {stats['rebuilt']}, дополнено: {stats['extended']}, "
+                f"добавлено дат: {stats['sessions']}"
+            )
+            if not options['every']:
+                return
+            full = False
+            time.sleep(options['every'])
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.13 on 2026-10-18 02:31
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def fill_payroll(apps, schema_editor):
+    Attendance = apps.get_model('training', 'Attendance')
+    Price = apps.get_model('training', 'Price')
+    TrainerMonthlyPayroll = apps.get_model('training', 'TrainerMonthlyPayroll')
+
+    price = Price.objects.filter(training=OuterRef('training')).order_by('pk')
+    rows = Attendance.objects.filter(training__trainer__isnull=False).annotate(
+        quantity_to=Subquery(price.values('quantity_to')[:1]),
+        price_to=Subquery(price.values('price_to')[:1]),
+        price_from=Subquery(price.values('price_from')[:1]),
+    ).filter(price_to__isnull=False).annotate(
+        month=TruncMonth('recording_date'),
+        payment=F('attend_count') * Case(
+            When(attend_count__lte=F('quantity_to'), then=F('price_to')),
+            default=F('price_from'),
+            output_field=models.IntegerField(),
+        ),
+    ).order_by().values('training__trainer_id', 'month').annotate(
+        classes=Count('pk'),
+        participants=Sum('attend_count'),
+        amount=Sum('payment'),
+    )
+    TrainerMonthlyPayroll.objects.bulk_create([
+        TrainerMonthlyPayroll(
+            trainer_id=row['training__trainer_id'],
+            month=row['month'],
+            classes=row['classes'],
+            participants=row['participants'],
+            amount=row['amount'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0003_alter_trainingschedule_unique_together'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainerMonthlyPayroll',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='Первое число месяца', verbose_name='Месяц')),
+                ('classes', models.PositiveIntegerField(default=0, verbose_name='Количество занятий')),
+                ('participants', models.PositiveIntegerField(default=0, verbose_name='Количество участников')),
+                ('amount', models.PositiveBigIntegerField(default=0, verbose_name='Сумма')),
+                ('trainer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='training.trainer', verbose_name='Тренер')),
+            ],
+            options={
+                'verbose_name': 'Зарплата за месяц',
+                'verbose_name_plural': 'Зарплаты по месяцам',
+                'unique_together': {('trainer', 'month')},
+            },
+        ),
+        migrations.RunPython(fill_payroll, migrations.RunPython.noop),
+    ]
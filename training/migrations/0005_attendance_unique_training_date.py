@@ -0,0 +1,41 @@
+# Generated by Django 4.2.13 on 2026-10-18 02:38
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_attendance(apps, schema_editor):
+    """Из дублей за один день оставляет последнюю запись, как ее видел бот после UPDATE."""
+    Attendance = apps.get_model('training', 'Attendance')
+    TrainerMonthlyPayroll = apps.get_model('training', 'TrainerMonthlyPayroll')
+
+    duplicates = Attendance.objects.values('training_id', 'recording_date').annotate(
+        rows=Count('pk'), keep=Max('pk'),
+    ).filter(rows__gt=1)
+
+    removed = 0
+    for duplicate in list(duplicates):
+        removed += Attendance.objects.filter(
+            training_id=duplicate['training_id'], recording_date=duplicate['recording_date'],
+        ).exclude(pk=duplicate['keep']).delete()[0]
+
+    if removed:
+        TrainerMonthlyPayroll.objects.all().delete()
+        import_module('training.migrations.0004_trainermonthlypayroll').fill_payroll(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0004_trainermonthlypayroll'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_attendance, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('training', 'recording_date'), name='unique_attendance_training_date'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.13 on 2026-10-18 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0005_attendance_unique_training_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['recording_date', 'training'], name='attendance_date_training_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='training',
+            index=models.Index(fields=['trainer', 'start_date', 'end_date'], name='training_trainer_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trainingschedule',
+            index=models.Index(fields=['day_of_week', 'training'], name='schedule_day_training_idx'),
+        ),
+    ]
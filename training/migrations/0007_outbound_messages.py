@@ -0,0 +1,46 @@
+# Generated by Django 4.2.13 on 2026-10-18 03:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0006_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(verbose_name='Текст')),
+                ('created_date', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Рассылка',
+                'verbose_name_plural': 'Рассылки',
+            },
+        ),
+        migrations.CreateModel(
+            name='OutboundMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=16, verbose_name='Telegram ID получателя')),
+                ('text', models.TextField(verbose_name='Текст')),
+                ('reply_markup', models.TextField(blank=True, default='', verbose_name='Клавиатура (JSON)')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('sent', 'Отправлено'), ('failed', 'Ошибка')], default='pending', max_length=7, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('error', models.CharField(blank=True, default='', max_length=255, verbose_name='Ошибка')),
+                ('created_date', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('sent_date', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки')),
+                ('broadcast', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='training.broadcast', verbose_name='Рассылка')),
+            ],
+            options={
+                'verbose_name': 'Исходящее сообщение',
+                'verbose_name_plural': 'Исходящие сообщения',
+                'indexes': [models.Index(fields=['status', 'id'], name='outbound_status_idx'), models.Index(fields=['broadcast', 'status'], name='outbound_broadcast_status_idx')],
+            },
+        ),
+    ]
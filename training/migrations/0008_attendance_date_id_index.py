@@ -0,0 +1,17 @@
+# Generated by Django 4.2.13 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0007_outbound_messages'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['recording_date', 'id'], name='attendance_date_id_idx'),
+        ),
+    ]
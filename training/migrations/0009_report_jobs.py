@@ -0,0 +1,35 @@
+# Generated by Django 4.2.13 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0008_attendance_date_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField(verbose_name='Начальная дата')),
+                ('end_date', models.DateField(verbose_name='Конечная дата')),
+                ('training_ids', models.JSONField(default=list, verbose_name='Занятия')),
+                ('report_format', models.CharField(choices=[('xlsx', 'Excel (.xlsx)'), ('csv', 'CSV'), ('csv.gz', 'CSV (.csv.gz)')], default='xlsx', max_length=10, verbose_name='Формат')),
+                ('cache_key', models.CharField(max_length=64, verbose_name='Ключ кэша')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Формируется'), ('done', 'Готов'), ('failed', 'Ошибка')], default='pending', max_length=7, verbose_name='Статус')),
+                ('file', models.FileField(blank=True, upload_to='reports/', verbose_name='Файл')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_date', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started_date', models.DateTimeField(blank=True, null=True, verbose_name='Начало')),
+                ('finished_date', models.DateTimeField(blank=True, null=True, verbose_name='Окончание')),
+            ],
+            options={
+                'verbose_name': 'Отчет по зарплате',
+                'verbose_name_plural': 'Отчеты по зарплате',
+                'indexes': [models.Index(fields=['status', 'id'], name='report_job_status_idx'), models.Index(fields=['cache_key', 'status'], name='report_job_cache_key_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.13 on 2026-10-18 03:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0009_report_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingSessionState',
+            fields=[
+                ('training', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='session_state', serialize=False, to='training.training')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('generated_until', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrainingSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_date', models.DateField(verbose_name='Дата')),
+                ('start_time', models.TimeField(verbose_name='Время начала')),
+                ('end_time', models.TimeField(verbose_name='Время конца')),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='training.trainingschedule', verbose_name='Расписание')),
+                ('training', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='training.training', verbose_name='Занятие')),
+            ],
+            options={
+                'verbose_name': 'Проведенное занятие',
+                'verbose_name_plural': 'Проведенные занятия',
+                'indexes': [models.Index(fields=['training', 'session_date'], name='session_training_date_idx'), models.Index(fields=['session_date', 'training'], name='session_date_training_idx')],
+                'unique_together': {('schedule', 'session_date')},
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations
+
+
+# application_name соединений бота (bot.pg.APPLICATION_NAME): их записи счетчик не меняют
+BOT_APPLICATION_NAME = 'trainings-bot'
+
+
+def create_data_version(apps, schema_editor):
+    """
+    Счетчик изменений для DataVersionWatcher бота на PostgreSQL: триггеры на таблицах приложения
+    увеличивают bot_data_version.version после каждой команды, кроме команд самого бота. В SQLite
+    то же дает PRAGMA data_version, поэтому там миграция ничего не делает. Новым таблицам, которые
+    читает бот, нужен такой же триггер.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE TABLE bot_data_version (id integer PRIMARY KEY, version bigint NOT NULL)')
+    schema_editor.execute('INSERT INTO bot_data_version (id, version) VALUES (1, 0)')
+    schema_editor.execute(f'''
+        CREATE FUNCTION bot_bump_data_version() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF current_setting('application_name') <> '{BOT_APPLICATION_NAME}' THEN
+                UPDATE bot_data_version SET version = version + 1 WHERE id = 1;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    ''')
+    for model in apps.get_app_config('training').get_models():
+        schema_editor.execute(
+            f'CREATE TRIGGER bot_data_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE '
+            f'ON {schema_editor.quote_name(model._meta.db_table)} '
+            f'FOR EACH STATEMENT EXECUTE FUNCTION bot_bump_data_version()'
+        )
+
+
+def drop_data_version(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP FUNCTION bot_bump_data_version() CASCADE')
+    schema_editor.execute('DROP TABLE bot_data_version')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0010_training_sessions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_data_version, drop_data_version),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.13 on 2026-10-18 04:48
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0011_bot_data_version'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='attendance',
+            name='attendance_date_training_idx',
+        ),
+    ]
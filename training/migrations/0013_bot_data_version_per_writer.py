@@ -0,0 +1,54 @@
+from django.db import migrations
+
+
+def count_writes_per_writer(apps, schema_editor):
+    """
+    bot_data_version считает записи по каждому application_name: у каждого процесса бота он свой
+    (bot.pg.APPLICATION_NAME), у админки и manage.py — общий. Процесс бота складывает счетчики
+    всех, кроме себя, поэтому его кэши сбрасывают и правки в админке, и записи других воркеров,
+    а собственные коммиты — нет, как PRAGMA data_version в SQLite. Строки остановленных процессов
+    остаются и больше не меняются, на сумму это не влияет. Отдельная строка на писателя нужна и
+    для того, чтобы записи разных процессов не ждали друг друга на одной строке счетчика.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP TABLE bot_data_version')
+    schema_editor.execute('CREATE TABLE bot_data_version (writer text PRIMARY KEY, version bigint NOT NULL)')
+    schema_editor.execute('''
+        CREATE OR REPLACE FUNCTION bot_bump_data_version() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO bot_data_version (writer, version) VALUES (current_setting('application_name'), 1)
+            ON CONFLICT (writer) DO UPDATE SET version = bot_data_version.version + 1;
+            RETURN NULL;
+        END
+        $$
+    ''')
+
+
+def count_writes_together(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP TABLE bot_data_version')
+    schema_editor.execute('CREATE TABLE bot_data_version (id integer PRIMARY KEY, version bigint NOT NULL)')
+    schema_editor.execute('INSERT INTO bot_data_version (id, version) VALUES (1, 0)')
+    schema_editor.execute('''
+        CREATE OR REPLACE FUNCTION bot_bump_data_version() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF current_setting('application_name') <> 'trainings-bot' THEN
+                UPDATE bot_data_version SET version = version + 1 WHERE id = 1;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    ''')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training', '0012_drop_attendance_date_training_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_writes_per_writer, count_writes_together),
+    ]
@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 
 
 DAYS_OF_WEEK = [
@@ -15,6 +15,43 @@ DAYS_OF_WEEK = [
 ]
 
 
+class PayrollQuerySet(models.QuerySet):
+    """
+    delete() пересчитывает сводку зарплат один раз на всю пачку: месяцы, где была затронутая
+    посещаемость, собираются до удаления, а сама посещаемость удаляется каскадом без сигналов
+    на каждую строку. Затронутая посещаемость — Attendance с attendance_field из значений
+    value_field удаляемых строк; по умолчанию это сами удаляемые записи посещаемости.
+    """
+    attendance_field = 'pk'
+    value_field = 'pk'
+
+    def delete(self):
+        from .payroll import payroll_keys, refresh_payroll_months
+
+        attendances = Attendance.objects.filter(**{f'{self.attendance_field}__in': self.values(self.value_field)})
+        with transaction.atomic(using=self.db):
+            keys = payroll_keys(attendances)
+            result = super().delete()
+            refresh_payroll_months(keys)
+        return result
+
+
+class TrainingQuerySet(PayrollQuerySet):
+    attendance_field = 'training'
+
+
+class PriceQuerySet(PayrollQuerySet):
+    attendance_field = 'training'
+    value_field = 'training_id'
+
+
+class PayrollDeleteMixin:
+    """Удаление одной записи идет через delete() ее QuerySet, чтобы пересчитать сводку зарплат."""
+
+    def delete(self, using=None, keep_parents=False):
+        return type(self)._default_manager.using(using or self._state.db).filter(pk=self.pk).delete()
+
+
 class Trainer(models.Model):
     first_name = models.CharField(verbose_name='Имя', max_length=20)
     last_name = models.CharField(verbose_name='Фамилия', max_length=20)
@@ -45,12 +82,14 @@ class Trainer(models.Model):
         verbose_name_plural = 'Тренера'
 
 
-class Training(models.Model):
+class Training(PayrollDeleteMixin, models.Model):
     name = models.CharField(verbose_name='Занятие', max_length=64)
     trainer = models.ForeignKey(Trainer, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Тренер')
     start_date = models.DateField(verbose_name='Дата начала занятий')
     end_date = models.DateField(verbose_name='Дата конца занятий')
 
+    objects = TrainingQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -58,9 +97,24 @@ class Training(models.Model):
         if self.start_date and self.end_date and self.start_date > self.end_date:
             raise ValidationError("Дата начала должна быть меньше или равна дате окончания.")
 
+    def save(self, *args, **kwargs):
+        from .payroll import refresh_payroll
+
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            previous_trainer_id = Training.objects.filter(pk=self.pk).values_list('trainer_id', flat=True).first()
+            super().save(*args, **kwargs)
+            if previous_trainer_id != self.trainer_id:
+                refresh_payroll({previous_trainer_id, self.trainer_id})
+
     class Meta:
         verbose_name = 'Занятие'
         verbose_name_plural = 'Занятия'
+        indexes = [
+            models.Index(fields=('trainer', 'start_date', 'end_date'), name='training_trainer_dates_idx'),
+        ]
 
 
 class TrainingSchedule(models.Model):
@@ -81,9 +135,43 @@ class TrainingSchedule(models.Model):
         verbose_name = 'Расписание занятия'
         verbose_name_plural = 'Расписания занятий'
         unique_together = ('training', 'day_of_week', 'start_time')
+        indexes = [
+            models.Index(fields=('day_of_week', 'training'), name='schedule_day_training_idx'),
+        ]
 
 
-class Attendance(models.Model):
+class TrainingSession(models.Model):
+    """
+    Занятие по расписанию в конкретный день. Таблицу заполняет training/sessions.py
+    (manage.py sync_sessions) по TrainingSchedule в пределах дат занятия.
+    """
+    training = models.ForeignKey(Training, related_name='sessions', on_delete=models.CASCADE, verbose_name='Занятие')
+    schedule = models.ForeignKey(TrainingSchedule, on_delete=models.CASCADE, verbose_name='Расписание')
+    session_date = models.DateField(verbose_name='Дата')
+    start_time = models.TimeField(verbose_name='Время начала')
+    end_time = models.TimeField(verbose_name='Время конца')
+
+    def __str__(self):
+        return f'{self.training} {self.session_date} {self.start_time:%H:%M}'
+
+    class Meta:
+        verbose_name = 'Проведенное занятие'
+        verbose_name_plural = 'Проведенные занятия'
+        unique_together = ('schedule', 'session_date')
+        indexes = [
+            models.Index(fields=('training', 'session_date'), name='session_training_date_idx'),
+            models.Index(fields=('session_date', 'training'), name='session_date_training_idx'),
+        ]
+
+
+class TrainingSessionState(models.Model):
+    """До какого дня построены TrainingSession занятия и по какой версии его расписания."""
+    training = models.OneToOneField(Training, primary_key=True, on_delete=models.CASCADE, related_name='session_state')
+    fingerprint = models.CharField(max_length=64)
+    generated_until = models.DateField()
+
+
+class Attendance(PayrollDeleteMixin, models.Model):
     training = models.ForeignKey(Training, on_delete=models.CASCADE, verbose_name='Занятие')
     attend_count = models.PositiveSmallIntegerField(verbose_name='Количество участников', default=0)
     recording_day = models.CharField(
@@ -93,9 +181,19 @@ class Attendance(models.Model):
     created_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     update_date = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
+    objects = PayrollQuerySet.as_manager()
+
     def __str__(self):
         return f'На занятие {self.training.name} пришло {self.attend_count} чел. Дата {self.recording_date}'
 
+    def save(self, *args, **kwargs):
+        from .payroll import payroll_keys, refresh_payroll_months
+
+        with transaction.atomic():
+            keys = payroll_keys(Attendance.objects.filter(pk=self.pk)) if self.pk else set()
+            super().save(*args, **kwargs)
+            refresh_payroll_months(keys | payroll_keys(Attendance.objects.filter(pk=self.pk)))
+
     def recording_datetime(self, training_schedule):
         if training_schedule:
             start_time = training_schedule.start_time
@@ -105,15 +203,23 @@ class Attendance(models.Model):
     class Meta:
         verbose_name = 'Посещаемость'
         verbose_name_plural = 'Посещаемость'
+        constraints = [
+            models.UniqueConstraint(fields=('training', 'recording_date'), name='unique_attendance_training_date'),
+        ]
+        indexes = [
+            models.Index(fields=('recording_date', 'id'), name='attendance_date_id_idx'),
+        ]
 
 
-class Price(models.Model):
+class Price(PayrollDeleteMixin, models.Model):
     training = models.ForeignKey(Training, on_delete=models.CASCADE, verbose_name='Занятие')
     quantity_to = models.PositiveSmallIntegerField(verbose_name='Количество участников до включительно')
     price_to = models.PositiveIntegerField(verbose_name='Цена до')
     quantity_from = models.PositiveSmallIntegerField(verbose_name='Количество участников от включительно')
     price_from = models.PositiveIntegerField(verbose_name='Цена от')
 
+    objects = PriceQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.training.name}: До {self.quantity_to} {self.price_to}. От {self.quantity_from} {self.price_from}'
 
@@ -124,6 +230,115 @@ class Price(models.Model):
         if self.price_to and self.price_from and self.price_to > self.price_from:
             raise ValidationError("Цена 'до' не может быть больше цены 'от'.")
 
+    def save(self, *args, **kwargs):
+        from .payroll import refresh_payroll
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            refresh_payroll(Training.objects.filter(pk=self.training_id).values_list('trainer_id', flat=True))
+
     class Meta:
         verbose_name = 'Цена'
         verbose_name_plural = 'Цены'
+
+
+class TrainerMonthlyPayroll(models.Model):
+    trainer = models.ForeignKey(Trainer, on_delete=models.CASCADE, verbose_name='Тренер')
+    month = models.DateField(verbose_name='Месяц', help_text='Первое число месяца')
+    classes = models.PositiveIntegerField(verbose_name='Количество занятий', default=0)
+    participants = models.PositiveIntegerField(verbose_name='Количество участников', default=0)
+    amount = models.PositiveBigIntegerField(verbose_name='Сумма', default=0)
+
+    def __str__(self):
+        return f'{self.trainer_id}: {self.month:%Y-%m} {self.amount}'
+
+    class Meta:
+        verbose_name = 'Зарплата за месяц'
+        verbose_name_plural = 'Зарплаты по месяцам'
+        unique_together = ('trainer', 'month')
+
+
+MESSAGE_STATUSES = [
+    ('pending', 'В очереди'),
+    ('sent', 'Отправлено'),
+    ('failed', 'Ошибка'),
+]
+
+
+class Broadcast(models.Model):
+    text = models.TextField(verbose_name='Текст')
+    created_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    def __str__(self):
+        return f'{self.created_date:%Y-%m-%d %H:%M} {self.text[:40]}'
+
+    class Meta:
+        verbose_name = 'Рассылка'
+        verbose_name_plural = 'Рассылки'
+
+
+class OutboundMessage(models.Model):
+    """Исходящее сообщение бота; отправляет его очередь bot/outbox.py с учетом лимитов Telegram."""
+    broadcast = models.ForeignKey(
+        Broadcast, related_name='messages', on_delete=models.CASCADE, null=True, blank=True, verbose_name='Рассылка'
+    )
+    chat_id = models.CharField(max_length=16, verbose_name='Telegram ID получателя')
+    text = models.TextField(verbose_name='Текст')
+    reply_markup = models.TextField(blank=True, default='', verbose_name='Клавиатура (JSON)')
+    status = models.CharField(max_length=7, choices=MESSAGE_STATUSES, default='pending', verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    error = models.CharField(max_length=255, blank=True, default='', verbose_name='Ошибка')
+    created_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    sent_date = models.DateTimeField(null=True, blank=True, verbose_name='Дата отправки')
+
+    def __str__(self):
+        return f'{self.chat_id}: {self.text[:40]}'
+
+    class Meta:
+        verbose_name = 'Исходящее сообщение'
+        verbose_name_plural = 'Исходящие сообщения'
+        indexes = [
+            models.Index(fields=('status', 'id'), name='outbound_status_idx'),
+            models.Index(fields=('broadcast', 'status'), name='outbound_broadcast_status_idx'),
+        ]
+
+
+# Форматы выгрузки отчета; пишет их training/exports.py
+REPORT_FORMATS = [
+    ('xlsx', 'Excel (.xlsx)'),
+    ('csv', 'CSV'),
+    ('csv.gz', 'CSV (.csv.gz)'),
+]
+
+JOB_STATUSES = [
+    ('pending', 'В очереди'),
+    ('running', 'Формируется'),
+    ('done', 'Готов'),
+    ('failed', 'Ошибка'),
+]
+
+
+class ReportJob(models.Model):
+    """Отчет по зарплате, который формирует фоновый воркер (training/report_jobs.py)."""
+    start_date = models.DateField(verbose_name='Начальная дата')
+    end_date = models.DateField(verbose_name='Конечная дата')
+    training_ids = models.JSONField(default=list, verbose_name='Занятия')
+    report_format = models.CharField(max_length=10, choices=REPORT_FORMATS, default='xlsx', verbose_name='Формат')
+    cache_key = models.CharField(max_length=64, verbose_name='Ключ кэша')
+    status = models.CharField(max_length=7, choices=JOB_STATUSES, default='pending', verbose_name='Статус')
+    file = models.FileField(upload_to='reports/', blank=True, verbose_name='Файл')
+    error = models.TextField(blank=True, default='', verbose_name='Ошибка')
+    created_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    started_date = models.DateTimeField(null=True, blank=True, verbose_name='Начало')
+    finished_date = models.DateTimeField(null=True, blank=True, verbose_name='Окончание')
+
+    def __str__(self):
+        return f'{self.start_date} — {self.end_date} ({self.report_format})'
+
+    class Meta:
+        verbose_name = 'Отчет по зарплате'
+        verbose_name_plural = 'Отчеты по зарплате'
+        indexes = [
+            models.Index(fields=('status', 'id'), name='report_job_status_idx'),
+            models.Index(fields=('cache_key', 'status'), name='report_job_cache_key_idx'),
+        ]
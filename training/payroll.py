@@ -0,0 +1,103 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+from .models import Attendance, TrainerMonthlyPayroll
+from .reports import annotate_payments
+
+
+def next_month(value):
+    return (value.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def payroll_keys(attendances):
+    """Пары (trainer_id, месяц) посещаемости attendances; месяцы сворачиваются в SQL, а не по строкам."""
+    return set(attendances.filter(training__trainer__isnull=False).annotate(
+        month=TruncMonth('recording_date'),
+    ).order_by().values_list('training__trainer_id', 'month').distinct())
+
+
+def compute_payroll(attendances):
+    """
+    Сводка по тренерам и месяцам: {(trainer_id, month): (classes, participants, amount)}.
+    Считаются только занятия с ценой, как и в отчете по зарплате.
+    """
+    rows = annotate_payments(attendances).annotate(
+        month=TruncMonth('recording_date'),
+    ).order_by().values(
+        'training__trainer_id', 'month',
+    ).annotate(
+        classes=Count('pk'),
+        participants=Sum('attend_count'),
+        amount=Sum('payment'),
+    )
+    return {
+        (row['training__trainer_id'], row['month']): (row['classes'], row['participants'], row['amount'])
+        for row in rows
+    }
+
+
+def _payroll_objects(totals):
+    return [
+        TrainerMonthlyPayroll(
+            trainer_id=trainer_id, month=month, classes=classes, participants=participants, amount=amount
+        )
+        for (trainer_id, month), (classes, participants, amount) in totals.items()
+    ]
+
+
+@transaction.atomic
+def refresh_payroll_months(keys):
+    """Пересчитывает строки сводки только для указанных пар (trainer_id, месяц)."""
+    months_by_trainer = {}
+    for trainer_id, month in keys:
+        if trainer_id:
+            months_by_trainer.setdefault(trainer_id, set()).add(month)
+
+    for trainer_id, months in months_by_trainer.items():
+        start, end = min(months), next_month(max(months))
+        totals = {
+            key: value
+            for key, value in compute_payroll(Attendance.objects.filter(
+                training__trainer_id=trainer_id, recording_date__gte=start, recording_date__lt=end,
+            )).items()
+            if key[1] in months
+        }
+        TrainerMonthlyPayroll.objects.filter(trainer_id=trainer_id, month__in=months).delete()
+        TrainerMonthlyPayroll.objects.bulk_create(_payroll_objects(totals))
+
+
+@transaction.atomic
+def refresh_payroll(trainer_ids):
+    """Пересчитывает всю историю тренеров, например после изменения цены занятия."""
+    trainer_ids = {trainer_id for trainer_id in trainer_ids if trainer_id}
+    if not trainer_ids:
+        return
+    TrainerMonthlyPayroll.objects.filter(trainer_id__in=trainer_ids).delete()
+    TrainerMonthlyPayroll.objects.bulk_create(_payroll_objects(
+        compute_payroll(Attendance.objects.filter(training__trainer_id__in=trainer_ids))
+    ))
+
+
+@transaction.atomic
+def rebuild_payroll():
+    TrainerMonthlyPayroll.objects.all().delete()
+    return TrainerMonthlyPayroll.objects.bulk_create(
+        _payroll_objects(compute_payroll(Attendance.objects.all())), batch_size=1000
+    )
+
+
+def verify_payroll():
+    """Возвращает расхождения сводки с пересчетом из посещаемости: {key: (в таблице, пересчитано)}."""
+    expected = compute_payroll(Attendance.objects.all())
+    stored = {
+        (row.trainer_id, row.month): (row.classes, row.participants, row.amount)
+        for row in TrainerMonthlyPayroll.objects.filter(classes__gt=0)
+    }
+    return {
+        key: (stored.get(key), expected.get(key))
+        for key in stored.keys() | expected.keys()
+        if stored.get(key) != expected.get(key)
+    }
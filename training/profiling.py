@@ -0,0 +1,109 @@
+"""
+Профилирование запросов к сайту: сколько SQL-запросов выполнил запрос и сколько времени они заняли.
+
+QueryProfilingMiddleware оборачивает соединение через connection.execute_wrapper, поэтому видит
+все запросы, включая сессию и пользователя из middleware ниже по списку. Итоги уходят в заголовок
+Server-Timing (его видно во вкладке Network браузера) для персонала и в DEBUG. Запросы дольше
+SLOW_REQUEST_MS пишутся в лог training.slow_requests вместе с самыми частыми отпечатками SQL —
+запросами, которые отличаются только значениями: повторяющийся отпечаток и есть N+1.
+
+QUERY_PROFILING_SAMPLE_RATE задает долю профилируемых запросов, остальные проходят без обертки.
+На SQL-запрос профилирование стоит два замера времени и поиск отпечатка: текст SQL от Django
+содержит плейсхолдеры, а не значения, поэтому отпечатки кэшируются и повторно не строятся.
+Хранятся только счетчики по отпечаткам, не больше MAX_FINGERPRINTS на запрос к сайту.
+"""
+import logging
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+
+
+slow_logger = logging.getLogger('training.slow_requests')
+
+TOP_FINGERPRINTS = 5
+MAX_FINGERPRINTS = 200
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql: str) -> str:
+    """SQL без значений: строки и числа заменены на ?, списки IN (?, ?, ...) свернуты в (...)."""
+    sql = _STRING.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDERS.sub('(...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+class QueryProfile:
+    """
+    execute_wrapper: считает запросы и их время, всего и по отпечаткам. Отпечатки сверх
+    MAX_FINGERPRINTS попадают только в общие count и duration.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.counts = Counter()
+        self.durations = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            key = fingerprint(sql)
+            if key in self.counts or len(self.counts) < MAX_FINGERPRINTS:
+                self.counts[key] += 1
+                self.durations[key] += elapsed
+
+    def top_fingerprints(self, limit=TOP_FINGERPRINTS):
+        """[(отпечаток, сколько раз, суммарное время), ...] для отпечатков, повторившихся больше одного раза."""
+        return [(key, count, self.durations[key]) for key, count in self.counts.most_common(limit) if count > 1]
+
+
+class QueryProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = settings.QUERY_PROFILING_SAMPLE_RATE
+        if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+            return self.get_response(request)
+
+        profile = QueryProfile()
+        started = time.perf_counter()
+        with connection.execute_wrapper(profile):
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response['Server-Timing'] = (
+                f'db;desc="{profile.count} queries";dur={profile.duration * 1000:.1f}, total;dur={total * 1000:.1f}'
+            )
+        if total * 1000 >= settings.SLOW_REQUEST_MS:
+            self.log_slow_request(request, response, profile, total)
+        return response
+
+    def log_slow_request(self, request, response, profile, total):
+        lines = [
+            f'{request.method} {request.get_full_path()} {response.status_code}: {total * 1000:.0f} мс, '
+            f'{profile.count} SQL-запросов за {profile.duration * 1000:.0f} мс'
+        ]
+        lines.extend(
+            f'  {count} x {duration * 1000:.1f} мс: {key}' for key, count, duration in profile.top_fingerprints()
+        )
+        slow_logger.warning('\n'.join(lines))
@@ -0,0 +1,138 @@
+"""
+Отчеты по зарплате в фоне.
+
+Действие в админке только ставит задачу в таблицу ReportJob, а файл формирует отдельный процесс
+(manage.py run_report_worker) и кладет его в MEDIA_ROOT/reports/, откуда его отдает nginx
+(location /media/). Ключ кэша — период, выбранные занятия, формат и отпечаток данных, поэтому
+повторный запрос неизменившегося отчета сразу получает готовый файл. Каталог файла содержит
+случайный токен: nginx отдает /media/ без проверки прав, и ссылку нельзя подобрать.
+"""
+import hashlib
+import logging
+import secrets
+import tempfile
+import time
+from datetime import timedelta
+
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from .models import Attendance, Price, ReportJob, Trainer, Training, TrainingSchedule
+from .reports import build_salary_report
+
+
+logger = logging.getLogger(__name__)
+
+
+def data_fingerprint(training_ids, start_date, end_date) -> str:
+    """
+    Меняется при любой правке данных, из которых строится отчет: посещаемости за период
+    (в том числе удалении строк), цен, расписания, названий занятий и имен тренеров.
+    """
+    attendance = Attendance.objects.filter(
+        training_id__in=training_ids, recording_date__range=(start_date, end_date),
+    ).aggregate(rows=Count('pk'), ids=Sum('pk'), people=Sum('attend_count'), updated=Max('update_date'))
+    trainings = list(Training.objects.filter(pk__in=training_ids).order_by('pk').values_list('pk', 'name', 'trainer_id'))
+    parts = [
+        attendance,
+        trainings,
+        list(Trainer.objects.filter(pk__in={row[2] for row in trainings}).order_by('pk').values_list(
+            'pk', 'first_name', 'last_name',
+        )),
+        list(Price.objects.filter(training_id__in=training_ids).order_by('pk').values_list(
+            'pk', 'training_id', 'quantity_to', 'price_to', 'price_from',
+        )),
+        list(TrainingSchedule.objects.filter(training_id__in=training_ids).order_by('pk').values_list(
+            'pk', 'training_id', 'start_time',
+        )),
+    ]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def report_cache_key(training_ids, start_date, end_date, report_format, fingerprint) -> str:
+    key = f'{start_date}|{end_date}|{report_format}|{",".join(map(str, training_ids))}|{fingerprint}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def request_salary_report(training_ids, start_date, end_date, report_format='xlsx') -> ReportJob:
+    """Готовый отчет с тем же ключом, уже поставленная задача или новая задача в очереди."""
+    training_ids = sorted(training_ids)
+    key = report_cache_key(
+        training_ids, start_date, end_date, report_format, data_fingerprint(training_ids, start_date, end_date),
+    )
+    for job in ReportJob.objects.filter(cache_key=key, status__in=('pending', 'running', 'done')).order_by('-pk'):
+        if job.status != 'done' or (job.file and job.file.storage.exists(job.file.name)):
+            return job
+    return ReportJob.objects.create(
+        start_date=start_date, end_date=end_date, training_ids=training_ids, report_format=report_format, cache_key=key,
+    )
+
+
+def claim_job():
+    """Берет самую старую задачу из очереди; UPDATE с проверкой статуса не дает двум воркерам взять одну."""
+    for pk in ReportJob.objects.filter(status='pending').order_by('pk').values_list('pk', flat=True)[:10]:
+        if ReportJob.objects.filter(pk=pk, status='pending').update(status='running', started_date=timezone.now()):
+            return ReportJob.objects.get(pk=pk)
+    return None
+
+
+def run_job(job: ReportJob):
+    # xlsxwriter нужен только воркеру: админка импортирует этот модуль ради request_salary_report
+    from .exports import write_report
+
+    try:
+        with tempfile.TemporaryFile() as output:
+            # одна транзакция — один снимок базы в WAL: отпечаток описывает именно те данные, что попали в файл
+            with transaction.atomic():
+                fingerprint = data_fingerprint(job.training_ids, job.start_date, job.end_date)
+                report = build_salary_report(Training.objects.filter(pk__in=job.training_ids), job.start_date, job.end_date)
+                write_report(report, output, job.report_format)
+            output.seek(0)
+            filename = f'trainer_salary_report_{job.start_date:%Y%m%d}_{job.end_date:%Y%m%d}.{job.report_format}'
+            job.file.save(f'{secrets.token_urlsafe(16)}/{filename}', File(output), save=False)
+    except Exception as e:
+        logger.exception('Не удалось сформировать отчет %s', job.pk)
+        job.status, job.error = 'failed', str(e)
+    else:
+        job.status = 'done'
+        job.cache_key = report_cache_key(
+            job.training_ids, job.start_date, job.end_date, job.report_format, fingerprint,
+        )
+    job.finished_date = timezone.now()
+    job.save(update_fields=['status', 'error', 'file', 'cache_key', 'finished_date'])
+    return job
+
+
+def requeue_stale_jobs(stale_after: float):
+    """Задачи, которые остались в работе после падения воркера, возвращаются в очередь."""
+    return ReportJob.objects.filter(
+        status='running', started_date__lt=timezone.now() - timedelta(seconds=stale_after),
+    ).update(status='pending', started_date=None)
+
+
+def prune_jobs(keep_days: int):
+    """Удаляет старые задачи вместе с файлами."""
+    old = ReportJob.objects.filter(created_date__lt=timezone.now() - timedelta(days=keep_days)).exclude(status='running')
+    for job in old:
+        if job.file:
+            job.file.delete(save=False)
+    return old.delete()[0]
+
+
+def run_worker(*, poll_interval: float = 2, once: bool = False, stale_after: float = 600, keep_days: int = 30):
+    """Выполняет задачи по одной; с once=True выходит, когда очередь опустела."""
+    requeue_stale_jobs(stale_after)
+    pruned_at = 0.0
+    while True:
+        job = claim_job()
+        if job is not None:
+            run_job(job)
+            continue
+        if once:
+            return
+        if time.monotonic() - pruned_at > 3600:
+            prune_jobs(keep_days)
+            pruned_at = time.monotonic()
+        time.sleep(poll_interval)
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+
+from django.db.models import (
+    Case,
+    Count,
+    ExpressionWrapper,
+    F,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Sum,
+    When,
+)
+
+from .models import Attendance, Price, TrainingSchedule, DAYS_OF_WEEK
+
+
+ROWS_CHUNK_SIZE = 2000
+
+
+def current_month_period(today=None):
+    today = today or datetime.now().date()
+    start_of_month = today.replace(day=1)
+    end_of_month = (start_of_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start_of_month, end_of_month
+
+
+def annotate_payments(attendances):
+    """
+    Добавляет к посещаемости цену и сумму за каждое занятие.
+
+    Тарифы и время начала берутся коррелированными подзапросами (первая
+    запись по id, как раньше делал `.first()`), поэтому весь отчет строится
+    одним запросом независимо от количества строк. Занятия без цены
+    отбрасываются.
+    """
+    price = Price.objects.filter(training=OuterRef('training')).order_by('pk')
+    schedule = TrainingSchedule.objects.filter(training=OuterRef('training')).order_by('pk')
+
+    return attendances.filter(
+        training__trainer__isnull=False,
+    ).annotate(
+        quantity_to=Subquery(price.values('quantity_to')[:1]),
+        price_to=Subquery(price.values('price_to')[:1]),
+        price_from=Subquery(price.values('price_from')[:1]),
+        start_time=Subquery(schedule.values('start_time')[:1]),
+    ).filter(
+        price_to__isnull=False,
+    ).annotate(
+        per_class_price=Case(
+            When(attend_count__lte=F('quantity_to'), then=F('price_to')),
+            default=F('price_from'),
+            output_field=IntegerField(),
+        ),
+        payment=ExpressionWrapper(F('attend_count') * F('per_class_price'), output_field=IntegerField()),
+    )
+
+
+def salary_attendances(trainings, start_date, end_date):
+    return annotate_payments(Attendance.objects.filter(
+        training__in=trainings,
+        recording_date__range=(start_date, end_date),
+    ))
+
+
+def salary_rows_queryset(attendances):
+    return attendances.order_by(
+        'training__trainer__last_name', 'training__trainer__first_name', 'training__trainer_id',
+        'recording_date', 'start_time', 'pk',
+    ).values_list(
+        'training__trainer_id',
+        'training__trainer__first_name',
+        'training__trainer__last_name',
+        'training__name',
+        'recording_date',
+        'start_time',
+        'recording_day',
+        'attend_count',
+        'per_class_price',
+        'payment',
+    )
+
+
+def salary_rows(attendances):
+    rows = salary_rows_queryset(attendances).iterator(chunk_size=ROWS_CHUNK_SIZE)
+    days = dict(DAYS_OF_WEEK)
+
+    for (trainer_id, first_name, last_name, training_name, recording_date, start_time,
+         recording_day, attend_count, per_class_price, payment) in rows:
+        if start_time:
+            recorded_at = datetime.combine(recording_date, start_time).strftime("%Y-%m-%d %H:%M")
+        else:
+            recorded_at = str(recording_date)
+        yield {
+            'trainer_id': trainer_id,
+            'trainer': f'{first_name} {last_name}',
+            'training': training_name,
+            'recorded_at': recorded_at,
+            'day': days.get(recording_day, recording_day),
+            'attend_count': attend_count,
+            'price': per_class_price,
+            'payment': payment,
+        }
+
+
+def salary_totals_queryset(attendances):
+    return attendances.order_by().values(
+        'training__trainer_id',
+        'training__trainer__first_name',
+        'training__trainer__last_name',
+    ).annotate(
+        classes=Count('pk'),
+        total=Sum('payment'),
+    ).order_by('training__trainer__last_name', 'training__trainer__first_name', 'training__trainer_id')
+
+
+def salary_totals(attendances):
+    return [
+        {
+            'trainer_id': row['training__trainer_id'],
+            'name': f"{row['training__trainer__first_name']} {row['training__trainer__last_name']}",
+            'classes': row['classes'],
+            'total': row['total'] or 0,
+        }
+        for row in salary_totals_queryset(attendances)
+    ]
+
+
+def build_salary_report(trainings, start_date, end_date):
+    attendances = salary_attendances(trainings, start_date, end_date)
+    trainers = salary_totals(attendances)
+
+    return {
+        'rows': salary_rows(attendances),
+        'trainers': trainers,
+        'total': {
+            'classes': sum(trainer['classes'] for trainer in trainers),
+            'total': sum(trainer['total'] for trainer in trainers),
+        },
+    }
@@ -0,0 +1,118 @@
+"""
+Проведенные занятия: TrainingSchedule, развернутое в даты (TrainingSession).
+
+sync_sessions() достраивает таблицу инкрементально. У каждого занятия хранится отпечаток его
+дат и расписания (TrainingSessionState): если он не изменился, добавляются только дни после
+generated_until, а если изменился — даты этого занятия строятся заново. Поэтому ежедневный
+запуск пишет только новые дни, а правка расписания перестраивает одно занятие.
+
+Пропущенная посещаемость — занятия без строки Attendance на тот же день: NOT EXISTS по
+уникальному индексу (training_id, recording_date), без обхода календаря в Python.
+"""
+import hashlib
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import DAYS_OF_WEEK, Attendance, Training, TrainingSchedule, TrainingSession, TrainingSessionState
+
+
+WEEKDAYS = {day: number for number, (day, label) in enumerate(DAYS_OF_WEEK)}
+
+BATCH_SIZE = 2000
+
+
+def schedule_fingerprint(training, schedules) -> str:
+    parts = (training['start_date'], training['end_date'], sorted(
+        (schedule['pk'], schedule['day_of_week'], schedule['start_time'], schedule['end_time'])
+        for schedule in schedules
+    ))
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def session_dates(day_of_week, start_date, end_date):
+    """Даты дня недели day_of_week от start_date до end_date включительно."""
+    day = start_date + timedelta(days=(WEEKDAYS[day_of_week] - start_date.weekday()) % 7)
+    while day <= end_date:
+        yield day
+        day += timedelta(days=7)
+
+
+def _build_sessions(training_id, schedules, start_date, end_date):
+    return [
+        TrainingSession(
+            training_id=training_id, schedule_id=schedule['pk'], session_date=day,
+            start_time=schedule['start_time'], end_time=schedule['end_time'],
+        )
+        for schedule in schedules
+        for day in session_dates(schedule['day_of_week'], start_date, end_date)
+    ]
+
+
+def sync_sessions(until=None, full=False):
+    """
+    Достраивает TrainingSession до дня until (по умолчанию сегодня) включительно.
+    Возвращает счетчики: сколько занятий перестроено, дополнено и сколько дат добавлено.
+    """
+    until = until or timezone.localdate()
+    schedules = defaultdict(list)
+    for schedule in TrainingSchedule.objects.order_by('pk').values('pk', 'training_id', 'day_of_week', 'start_time', 'end_time'):
+        schedules[schedule['training_id']].append(schedule)
+    states = {state.training_id: state for state in TrainingSessionState.objects.all()}
+    stats = {'rebuilt': 0, 'extended': 0, 'sessions': 0}
+
+    with transaction.atomic():
+        if full:
+            TrainingSession.objects.all().delete()
+            states = {}
+        pending, new_states = [], []
+        for training in Training.objects.order_by('pk').values('pk', 'start_date', 'end_date'):
+            training_id = training['pk']
+            fingerprint = schedule_fingerprint(training, schedules[training_id])
+            last_day = min(training['end_date'], until)
+            state = states.get(training_id)
+
+            if state is None or state.fingerprint != fingerprint:
+                if state is not None:
+                    TrainingSession.objects.filter(training_id=training_id).delete()
+                first_day = training['start_date']
+                stats['rebuilt'] += 1
+            elif state.generated_until < last_day:
+                first_day = state.generated_until + timedelta(days=1)
+                stats['extended'] += 1
+            else:
+                continue
+
+            pending.extend(_build_sessions(training_id, schedules[training_id], first_day, last_day))
+            new_states.append(TrainingSessionState(
+                training_id=training_id, fingerprint=fingerprint,
+                generated_until=max(last_day, first_day - timedelta(days=1)),
+            ))
+            if len(pending) >= BATCH_SIZE:
+                stats['sessions'] += len(TrainingSession.objects.bulk_create(pending, batch_size=BATCH_SIZE))
+                pending = []
+        stats['sessions'] += len(TrainingSession.objects.bulk_create(pending, batch_size=BATCH_SIZE))
+        TrainingSessionState.objects.bulk_create(
+            new_states, batch_size=BATCH_SIZE, update_conflicts=True,
+            unique_fields=['training'], update_fields=['fingerprint', 'generated_until'],
+        )
+    return stats
+
+
+def held_sessions(now=None):
+    """Занятия, которые уже закончились к моменту now."""
+    now = timezone.localtime(now)
+    return TrainingSession.objects.filter(
+        Q(session_date__lt=now.date()) | Q(session_date=now.date(), end_time__lte=now.time())
+    )
+
+
+def missing_attendance(sessions=None):
+    """Занятия без записи посещаемости за свой день."""
+    sessions = held_sessions() if sessions is None else sessions
+    return sessions.filter(~Exists(Attendance.objects.filter(
+        training_id=OuterRef('training_id'), recording_date=OuterRef('session_date'),
+    )))
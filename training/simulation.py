@@ -0,0 +1,180 @@
+"""
+Моделирование зарплат при других тарифах («что, если») по истории посещаемости.
+
+История загружается один раз: SQL сворачивает посещаемость в пары (занятие, количество
+участников) с числом таких занятий. Для каждого занятия пары лежат подряд, отсортированные по
+количеству, и по ним заранее посчитана накопленная сумма участников. Тогда сумма участников
+занятий «до quantity_to включительно» для любого тарифа — это один searchsorted по этим парам,
+и сценарий считается за O(занятий · log пар), а не за проход по всем строкам посещаемости.
+Любое число сценариев считается одной операцией над массивами (сценарии × занятия).
+"""
+from datetime import date, datetime
+from typing import NamedTuple
+
+import numpy as np
+from django.db.models import Count
+
+from .models import Attendance, Price, Trainer, Training
+
+
+TIER_FIELDS = ('quantity_to', 'price_to', 'price_from')
+
+
+class Scenario(NamedTuple):
+    """
+    prices: {training_id: {'quantity_to': .., 'price_to': .., 'price_from': ..}}; поле, которого
+    нет, остается текущим. Ключ None — изменения для всех занятий, у которых сейчас есть цена;
+    явные training_id применяются поверх него.
+    """
+    name: str
+    prices: dict
+
+
+class Tiers(NamedTuple):
+    """Тарифы по занятиям: массивы формы (занятия,) или (сценарии, занятия)."""
+    quantity_to: np.ndarray
+    price_to: np.ndarray
+    price_from: np.ndarray
+
+
+def previous_year_period(today=None):
+    today = today or datetime.now().date()
+    return date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)
+
+
+class PriceSimulator:
+    """
+    training_idx, attend_count, classes — столбцы истории: номер занятия (0..training_count-1),
+    количество участников и сколько раз оно встретилось (для несвернутой истории — единицы).
+    """
+
+    def __init__(self, training_idx, attend_count, classes, training_count: int):
+        training_idx = np.asarray(training_idx, dtype=np.int64)
+        attend_count = np.asarray(attend_count, dtype=np.int64)
+        classes = np.asarray(classes, dtype=np.int64)
+        self.training_count = training_count
+        self.stride = int(attend_count.max(initial=0)) + 1
+
+        keys, inverse = np.unique(training_idx * self.stride + attend_count, return_inverse=True)
+        people = np.bincount(inverse.ravel(), weights=attend_count * classes, minlength=len(keys))
+        self.keys = keys
+        self.cum_people = np.concatenate(([0], np.cumsum(people.astype(np.int64))))
+
+        starts = np.arange(training_count, dtype=np.int64) * self.stride
+        self.segment_start = np.searchsorted(keys, starts)
+        segment_end = np.searchsorted(keys, starts + self.stride)
+        self.people = self.cum_people[segment_end] - self.cum_people[self.segment_start]
+
+    def payments(self, tiers: Tiers) -> np.ndarray:
+        """Сумма выплат по каждому занятию; форма совпадает с формой массивов тарифа."""
+        quantity_to = np.clip(np.asarray(tiers.quantity_to, dtype=np.int64), -1, self.stride - 1)
+        bounds = np.arange(self.training_count, dtype=np.int64) * self.stride + quantity_to
+        # участники занятий, где пришло не больше quantity_to, оплачиваются по price_to
+        below_end = np.searchsorted(self.keys, bounds, side='right')
+        below = self.cum_people[below_end] - self.cum_people[self.segment_start]
+        return tiers.price_to * below + tiers.price_from * (self.people - below)
+
+
+class PriceHistory:
+    """Посещаемость за период, текущие тарифы и справочники имен для отчета."""
+
+    def __init__(self, start_date, end_date):
+        self.start_date, self.end_date = start_date, end_date
+        trainings = list(Training.objects.filter(trainer__isnull=False).order_by('pk').values_list(
+            'pk', 'name', 'trainer_id',
+        ))
+        self.training_ids = np.array([pk for pk, name, trainer_id in trainings], dtype=np.int64)
+        self.training_names = [name for pk, name, trainer_id in trainings]
+        self.index = {pk: i for i, pk in enumerate(self.training_ids.tolist())}
+
+        trainer_ids = sorted({trainer_id for pk, name, trainer_id in trainings})
+        self.trainer_ids = np.array(trainer_ids, dtype=np.int64)
+        self.trainer_names = {trainer.pk: trainer.full_name for trainer in Trainer.objects.filter(pk__in=trainer_ids)}
+        trainer_index = {pk: i for i, pk in enumerate(trainer_ids)}
+        self.training_trainer = np.array(
+            [trainer_index[trainer_id] for pk, name, trainer_id in trainings], dtype=np.int64
+        )
+
+        rows = Attendance.objects.filter(
+            training__trainer__isnull=False, recording_date__range=(start_date, end_date),
+        ).order_by().values_list('training_id', 'attend_count').annotate(classes=Count('pk'))
+        columns = np.array(list(rows), dtype=np.int64).reshape(-1, 3)
+        self.simulator = PriceSimulator(
+            [self.index[pk] for pk in columns[:, 0].tolist()], columns[:, 1], columns[:, 2], len(trainings),
+        )
+        self.priced = np.zeros(len(trainings), dtype=bool)
+        self.baseline = self.current_tiers()
+
+    def current_tiers(self) -> Tiers:
+        """Тарифы из Price; как и в отчете по зарплате, берется первая цена занятия по id."""
+        tiers = Tiers(*(np.zeros(len(self.index), dtype=np.int64) for _ in TIER_FIELDS))
+        for price in Price.objects.filter(training_id__in=self.index).order_by('-pk'):
+            i = self.index[price.training_id]
+            for field in TIER_FIELDS:
+                getattr(tiers, field)[i] = getattr(price, field)
+            self.priced[i] = True
+        return tiers
+
+    def scenario_tiers(self, scenarios) -> Tiers:
+        """Тарифы всех сценариев: массивы (сценарии, занятия) на основе текущих."""
+        tiers = Tiers(*(np.tile(values, (len(scenarios), 1)) for values in self.baseline))
+        for row, scenario in enumerate(scenarios):
+            for training_id, changes in sorted(scenario.prices.items(), key=lambda item: item[0] is not None):
+                if training_id is None:
+                    columns = self.priced
+                elif training_id in self.index:
+                    columns = self.index[training_id]
+                else:
+                    continue
+                for field, value in changes.items():
+                    if value is not None:
+                        getattr(tiers, field)[row, columns] = value
+        return tiers
+
+    def simulate(self, scenarios):
+        baseline = self.simulator.payments(self.baseline)
+        payments = self.simulator.payments(self.scenario_tiers(scenarios))
+        trainer_matrix = np.zeros((len(self.index), len(self.trainer_ids)), dtype=np.int64)
+        trainer_matrix[np.arange(len(self.index)), self.training_trainer] = 1
+        baseline_by_trainer = baseline @ trainer_matrix
+        by_trainer = payments @ trainer_matrix
+
+        return {
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'baseline': int(baseline.sum()),
+            'scenarios': [
+                {
+                    'name': scenario.name,
+                    'total': int(payments[row].sum()),
+                    'delta': int(payments[row].sum() - baseline.sum()),
+                    'trainers': self._rows(
+                        self.trainer_ids, [self.trainer_names[pk] for pk in self.trainer_ids.tolist()],
+                        baseline_by_trainer, by_trainer[row],
+                    ),
+                    'trainings': self._rows(self.training_ids, self.training_names, baseline, payments[row]),
+                }
+                for row, scenario in enumerate(scenarios)
+            ],
+        }
+
+    @staticmethod
+    def _rows(ids, names, baseline, amounts):
+        """Строки с ненулевой суммой, сначала самые большие изменения."""
+        delta = amounts - baseline
+        changed = np.flatnonzero((baseline != 0) | (amounts != 0))
+        order = changed[np.lexsort((ids[changed], -np.abs(delta[changed])))]
+        return [
+            {
+                'id': int(ids[i]),
+                'name': names[i],
+                'baseline': int(baseline[i]),
+                'amount': int(amounts[i]),
+                'delta': int(delta[i]),
+            }
+            for i in order
+        ]
+
+
+def simulate_prices(start_date, end_date, scenarios):
+    return PriceHistory(start_date, end_date).simulate(scenarios)
@@ -0,0 +1,87 @@
+"""
+Синтетические данные для бенчмарков и ручной проверки на больших объемах.
+
+Все значения берутся из random.Random(seed), поэтому одинаковые параметры дают одинаковую базу:
+тренеры (телефоны 996000000000.., Telegram ID 100000..), их занятия с ценами и расписанием
+и посещаемость за years лет до end_date. Примерно каждое двадцатое проведенное занятие остается
+без посещаемости, чтобы отчету о пропущенной посещаемости было что показать. В конце
+пересобираются сводка зарплат и таблица проведенных занятий.
+"""
+import random
+from datetime import time, timedelta
+
+from django.db import transaction
+
+from .models import DAYS_OF_WEEK, Attendance, Price, Trainer, Training, TrainingSchedule
+from .payroll import rebuild_payroll
+from .sessions import session_dates, sync_sessions
+
+
+FIRST_NAMES = ('Азамат', 'Айгуль', 'Бакыт', 'Гульнара', 'Данияр', 'Жылдыз', 'Нурлан', 'Эльвира')
+LAST_NAMES = ('Осмонов', 'Асанова', 'Токтогулов', 'Исаева', 'Абдыкадыров', 'Маматова')
+TRAINING_KINDS = ('Йога', 'Бокс', 'Плавание', 'Танцы', 'Кроссфит', 'Пилатес', 'Борьба', 'Стретчинг')
+
+MISSING_SHARE = 0.05
+BATCH_SIZE = 5000
+
+
+def seed_synthetic_data(end_date, trainers=10, trainings_per_trainer=3, years=1, seed=1):
+    """Заполняет пустую базу; возвращает количество созданных строк по моделям."""
+    rng = random.Random(seed)
+    start_date = end_date - timedelta(days=365 * years)
+    days = [day for day, label in DAYS_OF_WEEK]
+    counts = {'trainers': trainers, 'trainings': 0, 'schedules': 0, 'attendance': 0}
+
+    with transaction.atomic():
+        created_trainers = Trainer.objects.bulk_create([
+            Trainer(
+                first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                phone_number=f'996{i:09d}', tg_id=str(100000 + i),
+            )
+            for i in range(trainers)
+        ])
+        trainings = Training.objects.bulk_create([
+            Training(
+                name=f'{rng.choice(TRAINING_KINDS)} {i}-{j}', trainer=trainer,
+                start_date=start_date + timedelta(days=rng.randrange(60)),
+                end_date=end_date + timedelta(days=365),
+            )
+            for i, trainer in enumerate(created_trainers)
+            for j in range(trainings_per_trainer)
+        ])
+        counts['trainings'] = len(trainings)
+
+        prices, schedules = [], []
+        for training in trainings:
+            quantity_to = rng.randrange(8, 16)
+            price_to = rng.randrange(80, 160, 10)
+            prices.append(Price(
+                training=training, quantity_to=quantity_to, price_to=price_to,
+                quantity_from=quantity_to + 1, price_from=price_to + 50,
+            ))
+            hour = rng.randrange(7, 21)
+            for day in sorted(rng.sample(days, rng.randrange(1, 4)), key=days.index):
+                schedules.append(TrainingSchedule(
+                    training=training, day_of_week=day, start_time=time(hour), end_time=time(hour + 1),
+                ))
+        Price.objects.bulk_create(prices, batch_size=BATCH_SIZE)
+        TrainingSchedule.objects.bulk_create(schedules, batch_size=BATCH_SIZE)
+        counts['schedules'] = len(schedules)
+
+        attendances = []
+        for schedule in schedules:
+            for day in session_dates(schedule.day_of_week, schedule.training.start_date, end_date):
+                if rng.random() < MISSING_SHARE:
+                    continue
+                attendances.append(Attendance(
+                    training=schedule.training, attend_count=rng.randrange(3, 26),
+                    recording_day=schedule.day_of_week, recording_date=day,
+                ))
+            if len(attendances) >= BATCH_SIZE:
+                counts['attendance'] += len(Attendance.objects.bulk_create(attendances))
+                attendances = []
+        counts['attendance'] += len(Attendance.objects.bulk_create(attendances))
+
+        rebuild_payroll()
+        sync_sessions(until=end_date)
+    return counts
@@ -1,3 +1,771 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from datetime import date, time, timedelta
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from .models import (
+    Trainer, Training, Attendance, Price, TrainingSchedule, TrainerMonthlyPayroll, Broadcast, OutboundMessage, ReportJob,
+    TrainingSession,
+)
+from .exports import write_report
+from .pagination import IndexedDatesQuerySet, KeysetPaginator
+from .payroll import rebuild_payroll, verify_payroll
+from .profiling import MAX_FINGERPRINTS, QueryProfile, fingerprint
+from .report_jobs import claim_job, request_salary_report, requeue_stale_jobs, run_job
+from .reports import build_salary_report, salary_attendances, salary_rows_queryset, salary_totals_queryset
+from .sessions import missing_attendance, sync_sessions
+from .simulation import PriceSimulator, Scenario, Tiers, simulate_prices
+
+
+def create_training(trainer, name, quantity_to=10, price_to=100, price_from=150):
+    training = Training.objects.create(
+        name=name, trainer=trainer, start_date=date(2024, 1, 1), end_date=date(2024, 12, 31)
+    )
+    Price.objects.create(
+        training=training, quantity_to=quantity_to, price_to=price_to,
+        quantity_from=quantity_to + 1, price_from=price_from,
+    )
+    TrainingSchedule.objects.create(
+        training=training, day_of_week='mon', start_time=time(18, 0), end_time=time(19, 0)
+    )
+    return training
+
+
+def create_attendances(training, days, attend_count=12, start=date(2024, 3, 1)):
+    Attendance.objects.bulk_create([
+        Attendance(
+            training=training,
+            attend_count=attend_count,
+            recording_day=(start + timedelta(days=i)).strftime('%a').lower(),
+            recording_date=start + timedelta(days=i),
+        )
+        for i in range(days)
+    ])
+
+
+class SalaryReportTests(TestCase):
+    period = (date(2024, 3, 1), date(2024, 3, 31))
+
+    def setUp(self):
+        self.trainer = Trainer.objects.create(first_name='Азамат', last_name='Осмонов', phone_number='996700000001')
+        self.other = Trainer.objects.create(first_name='Бакыт', last_name='Юсупов', phone_number='996700000002')
+        self.training = create_training(self.trainer, 'Йога')
+        self.other_training = create_training(self.other, 'Бокс', quantity_to=5, price_to=50, price_from=80)
+
+    def build(self, trainings=None):
+        if trainings is None:
+            trainings = Training.objects.all()
+        report = build_salary_report(trainings, *self.period)
+        report['rows'] = list(report['rows'])
+        return report
+
+    def test_tiers_and_totals(self):
+        create_attendances(self.training, 2, attend_count=10)
+        create_attendances(self.training, 1, attend_count=11, start=date(2024, 3, 10))
+        create_attendances(self.other_training, 3, attend_count=4)
+
+        report = self.build()
+
+        self.assertEqual(
+            [(row['trainer'], row['price'], row['payment']) for row in report['rows']],
+            [
+                ('Азамат Осмонов', 100, 1000),
+                ('Азамат Осмонов', 100, 1000),
+                ('Азамат Осмонов', 150, 1650),
+                ('Бакыт Юсупов', 50, 200),
+                ('Бакыт Юсупов', 50, 200),
+                ('Бакыт Юсупов', 50, 200),
+            ]
+        )
+        self.assertEqual(report['rows'][0]['recorded_at'], '2024-03-01 18:00')
+        self.assertEqual(
+            [(t['name'], t['classes'], t['total']) for t in report['trainers']],
+            [('Азамат Осмонов', 3, 3650), ('Бакыт Юсупов', 3, 600)]
+        )
+        self.assertEqual(report['total'], {'classes': 6, 'total': 4250})
+
+    def test_honours_selection_and_period(self):
+        create_attendances(self.training, 45, start=date(2024, 2, 20))
+        create_attendances(self.other_training, 3)
+
+        report = self.build(Training.objects.filter(pk=self.training.pk))
+
+        self.assertEqual(report['total']['classes'], 31)
+        self.assertEqual({row['training'] for row in report['rows']}, {'Йога'})
+
+    def test_skips_trainings_without_price(self):
+        training = Training.objects.create(
+            name='Без цены', trainer=self.trainer, start_date=date(2024, 1, 1), end_date=date(2024, 12, 31)
+        )
+        create_attendances(training, 3)
+
+        self.assertEqual(self.build()['rows'], [])
+
+    def test_query_count_does_not_grow_with_attendance(self):
+        create_attendances(self.training, 2)
+        with self.assertNumQueries(2):
+            self.build()
+
+        for i in range(20):
+            training = create_training(self.trainer if i % 2 else self.other, f'Занятие {i}')
+            TrainingSchedule.objects.create(
+                training=training, day_of_week='fri', start_time=time(9, 0), end_time=time(10, 0)
+            )
+            create_attendances(training, 31)
+
+        with self.assertNumQueries(2):
+            report = self.build()
+        self.assertEqual(report['total']['classes'], 2 + 20 * 31)
+
+
+class SalaryReportExportTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+        trainer = Trainer.objects.create(first_name='Азамат', last_name='Осмонов', phone_number='996700000001')
+        self.training = create_training(trainer, 'Йога')
+        create_attendances(self.training, 3, attend_count=11)
+        create_attendances(self.training, 2, start=date(2024, 4, 1))
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+    def request_report(self, report_format):
+        return self.client.post('/admin/training/training/', {
+            'action': 'download_salary_report',
+            '_selected_action': [self.training.pk],
+            'start_date': '2024-03-01',
+            'end_date': '2024-03-31',
+            'report_format': report_format,
+            'index': 0,
+        })
+
+    def download(self, report_format):
+        response = self.request_report(report_format)
+        job = ReportJob.objects.latest('pk')
+        self.assertRedirects(response, f'/admin/training/reportjob/{job.pk}/change/')
+        call_command('run_report_worker', '--once')
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done', job.error)
+        self.assertTrue(job.file.name.endswith(f'.{report_format}'))
+        with job.file.open('rb') as f:
+            return f.read()
+
+    def test_csv(self):
+        lines = self.download('csv').decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(';')[0], 'Тренер')
+        self.assertEqual(lines[1].split(';'), ['Азамат Осмонов', 'Йога', '2024-03-01 18:00', 'Пятница', '11', '150', '1650'])
+        self.assertEqual(lines[4].split(';')[-1], '4950')
+        self.assertEqual(lines[-1].split(';'), ['ОБЩИЙ ИТОГ', '3', '4950'])
+
+    def test_xlsx_has_detail_and_summary_sheets(self):
+        workbook = load_workbook(BytesIO(self.download('xlsx')))
+        detail = list(workbook['Детализация'].values)
+        summary = list(workbook['Итоги'].values)
+        self.assertEqual(len(detail), 1 + 3 + 1)
+        self.assertEqual(detail[-1][0], 'ИТОГО Азамат Осмонов')
+        self.assertEqual(summary[-1], ('ОБЩИЙ ИТОГ', 3, 4950))
+
+    def test_csv_gz(self):
+        content = gzip.decompress(self.download('csv.gz')).decode('utf-8-sig')
+        self.assertIn('ОБЩИЙ ИТОГ;3;4950', content)
+
+    def test_app_load_does_not_import_xlsxwriter(self):
+        # xlsxwriter нужен только воркеру отчетов, а не каждому процессу, загружающему модели
+        code = 'import sys, django; django.setup(); import training.models; print("xlsxwriter" in sys.modules)'
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'trainingmanager.settings', 'SECRET_KEY': 'test'},
+        )
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            write_report({'rows': [], 'trainers': [], 'total': {}}, BytesIO(), 'pdf')
+
+    def test_unchanged_report_is_served_from_cache(self):
+        self.download('csv')
+        job = ReportJob.objects.get()
+
+        response = self.request_report('csv')
+        self.assertRedirects(response, job.file.url, fetch_redirect_response=False)
+        self.assertEqual(ReportJob.objects.count(), 1)
+
+        # другой формат и правка посещаемости за период — новые задачи
+        self.request_report('xlsx')
+        Attendance.objects.filter(recording_date=date(2024, 3, 2)).update(attend_count=12)
+        self.request_report('csv')
+        self.assertEqual(ReportJob.objects.filter(status='pending').count(), 2)
+
+        # правка за пределами периода кэш не сбрасывает
+        ReportJob.objects.filter(status='pending').delete()
+        Attendance.objects.filter(recording_date=date(2024, 4, 1)).update(attend_count=1)
+        Attendance.objects.filter(recording_date=date(2024, 3, 2)).update(attend_count=11)
+        self.assertRedirects(self.request_report('csv'), job.file.url, fetch_redirect_response=False)
+
+    def test_failed_and_stale_jobs(self):
+        self.request_report('pdf')
+        self.assertFalse(ReportJob.objects.exists())
+
+        job = request_salary_report([self.training.pk], date(2024, 3, 1), date(2024, 3, 31), 'csv')
+        ReportJob.objects.filter(pk=job.pk).update(status='running', started_date=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(600), 1)
+
+        ReportJob.objects.filter(pk=job.pk).update(training_ids='not a list')
+        with self.assertLogs('training.report_jobs', 'ERROR'):
+            run_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(job.error)
+        self.assertIsNone(claim_job())
+
+
+class BroadcastAdminTests(TestCase):
+    def setUp(self):
+        self.trainers = [
+            Trainer.objects.create(first_name='Азамат', last_name='Осмонов', phone_number='996700000001', tg_id='101'),
+            Trainer.objects.create(first_name='Бакыт', last_name='Юсупов', phone_number='996700000002', tg_id='102'),
+            Trainer.objects.create(first_name='Чынара', last_name='Алиева', phone_number='996700000003'),
+        ]
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+    def broadcast(self, message):
+        return self.client.post('/admin/training/trainer/', {
+            'action': 'send_broadcast',
+            '_selected_action': [trainer.pk for trainer in self.trainers],
+            'message': message,
+            'index': 0,
+        })
+
+    def test_enqueues_for_connected_trainers_and_shows_progress(self):
+        response = self.broadcast('Завтра занятий не будет')
+
+        broadcast = Broadcast.objects.get()
+        self.assertRedirects(response, f'/admin/training/broadcast/{broadcast.pk}/change/')
+        self.assertEqual(
+            sorted(broadcast.messages.values_list('chat_id', 'status')), [('101', 'pending'), ('102', 'pending')]
+        )
+
+        broadcast.messages.filter(chat_id='101').update(status='sent')
+        response = self.client.get('/admin/training/broadcast/')
+        self.assertContains(response, '50%')
+
+    def test_requires_text(self):
+        self.broadcast('  ')
+        self.assertFalse(OutboundMessage.objects.exists())
+
+
+class PriceSimulationTests(TestCase):
+    period = (date(2024, 3, 1), date(2024, 3, 31))
+
+    def setUp(self):
+        self.trainer = Trainer.objects.create(first_name='Азамат', last_name='Осмонов', phone_number='996700000001')
+        self.other = Trainer.objects.create(first_name='Бакыт', last_name='Юсупов', phone_number='996700000002')
+        self.training = create_training(self.trainer, 'Йога')
+        self.other_training = create_training(self.other, 'Бокс', quantity_to=5, price_to=50, price_from=80)
+        self.unpriced = Training.objects.create(
+            name='Танцы', trainer=self.other, start_date=date(2024, 1, 1), end_date=date(2024, 12, 31)
+        )
+        for i, count in enumerate([3, 10, 11, 15, 10]):
+            create_attendances(self.training, 1, attend_count=count, start=date(2024, 3, 1 + i))
+            create_attendances(self.other_training, 1, attend_count=count // 2, start=date(2024, 3, 1 + i))
+            create_attendances(self.unpriced, 1, attend_count=count, start=date(2024, 3, 1 + i))
+
+    def expected(self, training, quantity_to, price_to, price_from):
+        return sum(
+            count * (price_to if count <= quantity_to else price_from)
+            for count in Attendance.objects.filter(training=training).values_list('attend_count', flat=True)
+        )
+
+    def test_baseline_matches_salary_report(self):
+        result = simulate_prices(*self.period, [])
+        report = build_salary_report(Training.objects.all(), *self.period)
+        self.assertEqual(result['baseline'], report['total']['total'])
+
+    def test_scenarios_change_only_selected_tiers(self):
+        result = simulate_prices(*self.period, [
+            Scenario('Порог 12', {self.training.pk: {'quantity_to': 12}}),
+            Scenario('Всем +10', {None: {'price_to': 110}, self.other_training.pk: {'price_to': 60}}),
+            Scenario('Цена для танцев', {self.unpriced.pk: {'quantity_to': 10, 'price_to': 40, 'price_from': 60}}),
+        ])
+        threshold, raise_all, dances = result['scenarios']
+        baseline = self.expected(self.training, 10, 100, 150) + self.expected(self.other_training, 5, 50, 80)
+        self.assertEqual(result['baseline'], baseline)
+
+        self.assertEqual(
+            threshold['total'],
+            self.expected(self.training, 12, 100, 150) + self.expected(self.other_training, 5, 50, 80),
+        )
+        self.assertEqual([row['id'] for row in threshold['trainings'] if row['delta']], [self.training.pk])
+
+        self.assertEqual(
+            raise_all['total'],
+            self.expected(self.training, 10, 110, 150) + self.expected(self.other_training, 5, 60, 80),
+        )
+        self.assertEqual(raise_all['delta'], raise_all['total'] - baseline)
+
+        trainers = {row['id']: row for row in dances['trainers']}
+        self.assertEqual(trainers[self.other.pk]['delta'], self.expected(self.unpriced, 10, 40, 60))
+        self.assertEqual(trainers[self.trainer.pk]['delta'], 0)
+
+    def test_simulator_matches_rows(self):
+        training_idx = [0, 0, 1, 1, 1, 2]
+        attend_count = [4, 9, 0, 7, 7, 30]
+        simulator = PriceSimulator(training_idx, attend_count, [1] * 6, 4)
+        tiers = Tiers(quantity_to=[[5, 7, 40, 0]], price_to=[[10, 20, 30, 40]], price_from=[[11, 21, 31, 41]])
+        expected = [0, 0, 0, 0]
+        for training, count in zip(training_idx, attend_count):
+            tier = tiers.price_to if count <= tiers.quantity_to[0][training] else tiers.price_from
+            expected[training] += count * tier[0][training]
+        self.assertEqual(simulator.payments(tiers).tolist(), [expected])
+
+    def test_admin_view_and_command(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.post('/admin/training/training/simulate-prices/', {
+            'start_date': '2024-03-01', 'end_date': '2024-03-31',
+            'scenario-TOTAL_FORMS': 2, 'scenario-INITIAL_FORMS': 0,
+            'scenario-0-name': 'Порог 12', 'scenario-0-trainings': [self.training.pk], 'scenario-0-quantity_to': 12,
+        })
+        self.assertEqual(response.status_code, 200)
+        [scenario] = response.context['result']['scenarios']
+        self.assertEqual(
+            scenario['delta'], self.expected(self.training, 12, 100, 150) - self.expected(self.training, 10, 100, 150)
+        )
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump([{'name': 'Порог 12', 'prices': {str(self.training.pk): {'quantity_to': 12}}}], f)
+            f.flush()
+            output = StringIO()
+            call_command(
+                'simulate_prices', f.name, '--start', '2024-03-01', '--end', '2024-03-31', '--json', stdout=output
+            )
+        self.assertEqual(json.loads(output.getvalue())['scenarios'][0]['delta'], scenario['delta'])
+
+
+class AttendanceAdminTests(TestCase):
+    def setUp(self):
+        trainer = Trainer.objects.create(first_name='Азамат', last_name='Осмонов', phone_number='996700000001')
+        self.trainings = [create_training(trainer, f'Занятие {i}') for i in range(3)]
+        for training in self.trainings:
+            create_attendances(training, 50)
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+    def get_page(self, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/training/attendance/' + query)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        _, small = self.get_page()
+        for training in self.trainings:
+            create_attendances(training, 300, start=date(2023, 1, 1))
+        response, large = self.get_page()
+        _, next_page = self.get_page(response.context['cl'].next_page_url)
+
+        self.assertEqual(small, large)
+        self.assertEqual(large, next_page)
+        self.assertLessEqual(large, 10)
+
+    def test_next_page_links_walk_all_rows_in_order(self):
+        expected = list(Attendance.objects.order_by('-recording_date', '-id').values_list('pk', flat=True))
+        seen, query = [], ''
+        while query is not None:
+            response, _ = self.get_page(query)
+            cl = response.context['cl']
+            seen.extend(row.pk for row in cl.result_list)
+            query = cl.next_page_url
+        self.assertEqual(seen, expected)
+
+    def test_count_is_capped(self):
+        paginator = KeysetPaginator(Attendance.objects.order_by('-recording_date', '-id'), 20, 'recording_date')
+        paginator.COUNT_LIMIT = 100
+        self.assertEqual(paginator.count, 100)
+        self.assertTrue(paginator.approximate)
+
+    def test_date_hierarchy_buckets(self):
+        Attendance.objects.filter(recording_date__month=4).delete()
+        create_attendances(self.trainings[0], 3, start=date(2022, 12, 30))
+        queryset = IndexedDatesQuerySet(Attendance)
+        for kind in ('year', 'month'):
+            self.assertEqual(
+                list(queryset.dates('recording_date', kind)),
+                list(Attendance.objects.dates('recording_date', kind)),
+            )
+        self.assertEqual(list(queryset.dates('recording_date', 'month', 'DESC'))[0], date(2024, 3, 1))
+
+    def test_foreign_keys_use_autocomplete(self):
+        self.assertContains(self.client.get('/admin/training/attendance/add/'), 'admin-autocomplete')
+        self.assertContains(self.client.get('/admin/training/training/add/'), 'admin-autocomplete')
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/admin/training/attendance/?p=2&after=вчера')
+        self.assertRedirects(response, '/admin/training/attendance/?e=1', fetch_redirect_response=False)
+
+
+class TrainingSessionTests(TestCase):
+    def setUp(self):
+        trainer = Trainer.objects.create(first_name='Азамат', last_name='Осмонов', phone_number='996700000001')
+        self.trainings = [create_training(trainer, f'Занятие {i}') for i in range(3)]
+        TrainingSchedule.objects.create(
+            training=self.trainings[0], day_of_week='thu', start_time=time(9, 0), end_time=time(10, 0)
+        )
+
+    def session_dates(self, training):
+        return list(TrainingSession.objects.filter(training=training).order_by('session_date').values_list(
+            'session_date', flat=True,
+        ))
+
+    def test_sessions_follow_schedule_within_training_dates(self):
+        stats = sync_sessions(until=date(2024, 1, 31))
+
+        self.assertEqual(stats, {'rebuilt': 3, 'extended': 0, 'sessions': 5 * 3 + 4})
+        self.assertEqual(self.session_dates(self.trainings[1]), [
+            date(2024, 1, 1), date(2024, 1, 8), date(2024, 1, 15), date(2024, 1, 22), date(2024, 1, 29),
+        ])
+        self.assertEqual(
+            [day for day in self.session_dates(self.trainings[0]) if day.weekday() == 3],
+            [date(2024, 1, 4), date(2024, 1, 11), date(2024, 1, 18), date(2024, 1, 25)],
+        )
+        # не дальше конца занятия
+        sync_sessions(until=date(2025, 6, 30))
+        self.assertEqual(self.session_dates(self.trainings[1])[-1], date(2024, 12, 30))
+
+    def test_sync_is_incremental(self):
+        sync_sessions(until=date(2024, 1, 31))
+        ids = set(TrainingSession.objects.filter(training__in=self.trainings[1:]).values_list('pk', flat=True))
+
+        self.assertEqual(sync_sessions(until=date(2024, 1, 31)), {'rebuilt': 0, 'extended': 0, 'sessions': 0})
+        self.assertEqual(sync_sessions(until=date(2024, 2, 7)), {'rebuilt': 0, 'extended': 3, 'sessions': 4})
+
+        schedule = TrainingSchedule.objects.get(training=self.trainings[0], day_of_week='thu')
+        schedule.day_of_week = 'fri'
+        schedule.save()
+        with CaptureQueriesContext(connection) as queries:
+            stats = sync_sessions(until=date(2024, 2, 7))
+        self.assertEqual(stats, {'rebuilt': 1, 'extended': 0, 'sessions': 6 + 5})
+        self.assertLessEqual(len(queries), 8)
+        self.assertIn(date(2024, 1, 5), self.session_dates(self.trainings[0]))
+        self.assertNotIn(date(2024, 1, 4), self.session_dates(self.trainings[0]))
+        # остальные занятия не перестраивались
+        self.assertLessEqual(ids, set(TrainingSession.objects.values_list('pk', flat=True)))
+
+        TrainingSchedule.objects.filter(training=self.trainings[2]).delete()
+        self.assertEqual(sync_sessions(until=date(2024, 2, 7))['rebuilt'], 1)
+        self.assertEqual(self.session_dates(self.trainings[2]), [])
+
+    def test_missing_attendance(self):
+        sync_sessions(until=date(2024, 1, 31))
+        create_attendances(self.trainings[1], 10, start=date(2024, 1, 1))
+        Attendance.objects.create(training=self.trainings[0], recording_day='thu', recording_date=date(2024, 1, 4))
+
+        missing = missing_attendance(TrainingSession.objects.filter(session_date__range=(date(2024, 1, 1), date(2024, 1, 14))))
+        self.assertEqual(
+            sorted(missing.values_list('training_id', 'session_date')),
+            [
+                (self.trainings[0].pk, date(2024, 1, 1)), (self.trainings[0].pk, date(2024, 1, 8)),
+                (self.trainings[0].pk, date(2024, 1, 11)),
+                (self.trainings[2].pk, date(2024, 1, 1)), (self.trainings[2].pk, date(2024, 1, 8)),
+            ],
+        )
+
+    def test_admin_missing_attendance(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        call_command('sync_sessions', until=date(2024, 1, 31), stdout=StringIO())
+        create_attendances(self.trainings[1], 31, start=date(2024, 1, 1))
+
+        response = self.client.get('/admin/training/trainingsession/?attendance=missing')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {row.training_id for row in response.context['cl'].result_list},
+            {self.trainings[0].pk, self.trainings[2].pk},
+        )
+        self.assertEqual(response.context['cl'].result_count, 9 + 5)
+        self.assertContains(self.client.get('/admin/training/training/'), '?attendance=missing')
+
+
+class SyntheticDataTests(TestCase):
+    def seed(self, *args):
+        call_command(
+            'seed_data', '--trainers', '3', '--trainings-per-trainer', '2', '--end-date', '2024-06-30', *args,
+            stdout=StringIO(),
+        )
+        return list(Attendance.objects.order_by('training__name', 'recording_date').values_list(
+            'training__name', 'recording_date', 'attend_count',
+        ))
+
+    def test_same_seed_same_data(self):
+        first = self.seed()
+        self.assertEqual(self.seed('--flush'), first)
+        self.assertNotEqual(self.seed('--flush', '--seed', '2'), first)
+
+        self.assertEqual(Trainer.objects.count(), 3)
+        self.assertEqual(Training.objects.count(), 6)
+        self.assertFalse(Training.objects.filter(price__isnull=True).exists())
+        self.assertEqual(verify_payroll(), {})
+        self.assertEqual(Attendance.objects.latest('recording_date').recording_date, date(2024, 6, 30))
+        # часть проведенных занятий оставлена без посещаемости
+        self.assertTrue(missing_attendance(TrainingSession.objects.all()).exists())
+
+    def test_refuses_to_mix_with_existing_data(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class TrainerMonthlyPayrollTests(TestCase):
+    def setUp(self):
+        self.trainer = Trainer.objects.create(first_name='Азамат', last_name='Осмонов', phone_number='996700000001')
+        self.training = create_training(self.trainer, 'Йога')
+
+    def payroll(self, month=date(2024, 3, 1)):
+        row = TrainerMonthlyPayroll.objects.filter(trainer=self.trainer, month=month).first()
+        return row and (row.classes, row.participants, row.amount)
+
+    def test_attendance_save_and_delete(self):
+        attendance = Attendance.objects.create(
+            training=self.training, attend_count=10, recording_day='fri', recording_date=date(2024, 3, 1)
+        )
+        Attendance.objects.create(
+            training=self.training, attend_count=12, recording_day='sat', recording_date=date(2024, 3, 2)
+        )
+        self.assertEqual(self.payroll(), (2, 22, 1000 + 1800))
+
+        attendance.recording_date = date(2024, 4, 5)
+        attendance.save()
+        self.assertEqual(self.payroll(), (1, 12, 1800))
+        self.assertEqual(self.payroll(date(2024, 4, 1)), (1, 10, 1000))
+
+        attendance.delete()
+        self.assertIsNone(self.payroll(date(2024, 4, 1)))
+        self.assertEqual(verify_payroll(), {})
+
+    def test_price_change_refreshes_history(self):
+        create_attendances(self.training, 3, attend_count=5)
+        price = self.training.price_set.get()
+        price.price_to = 200
+        price.save()
+
+        self.assertEqual(self.payroll(), (3, 15, 3000))
+
+    def test_bulk_delete_and_rebuild(self):
+        create_attendances(self.training, 3, attend_count=5)
+        self.assertIsNone(self.payroll())
+        self.assertEqual(len(verify_payroll()), 1)
+
+        rebuild_payroll()
+        self.assertEqual(self.payroll(), (3, 15, 1500))
+
+        Attendance.objects.filter(recording_date=date(2024, 3, 1)).delete()
+        self.assertEqual(self.payroll(), (2, 10, 1000))
+        self.assertEqual(verify_payroll(), {})
+
+    def test_training_delete_refreshes_payroll_in_one_pass(self):
+        small = create_training(self.trainer, 'Бег')
+        large = create_training(self.trainer, 'Бокс')
+        create_attendances(self.training, 3, attend_count=5)
+        create_attendances(small, 3, start=date(2024, 1, 1))
+        create_attendances(large, 200, start=date(2024, 1, 1))
+        rebuild_payroll()
+
+        # число запросов не зависит от количества удаляемой посещаемости
+        with CaptureQueriesContext(connection) as small_queries:
+            small.delete()
+        with CaptureQueriesContext(connection) as large_queries:
+            large.delete()
+        self.assertEqual(len(large_queries), len(small_queries))
+        self.assertLessEqual(len(large_queries), 20)
+        self.assertEqual(self.payroll(), (3, 15, 1500))
+        self.assertIsNone(self.payroll(date(2024, 5, 1)))
+        self.assertEqual(verify_payroll(), {})
+
+        with CaptureQueriesContext(connection) as queries:
+            Training.objects.all().delete()
+        self.assertLessEqual(len(queries), 20)
+        self.assertFalse(TrainerMonthlyPayroll.objects.exists())
+
+    def test_price_delete_and_admin_bulk_delete(self):
+        create_attendances(self.training, 3, attend_count=5)
+        self.training.price_set.get().delete()
+        self.assertIsNone(self.payroll())
+
+        Price.objects.create(training=self.training, quantity_to=10, price_to=100, quantity_from=11, price_from=150)
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.client.post('/admin/training/attendance/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': list(Attendance.objects.filter(recording_date__lt=date(2024, 3, 3)).values_list('pk', flat=True)),
+        })
+        self.assertEqual(Attendance.objects.count(), 1)
+        self.assertEqual(self.payroll(), (1, 5, 500))
+        self.assertEqual(verify_payroll(), {})
+
+
+class QueryPlanTests(TestCase):
+    """Запросы отчета по зарплате и сводки на большой таблице посещаемости должны идти по индексам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        trainers = [
+            Trainer.objects.create(first_name=f'Тренер{i}', last_name='Тестов', phone_number=f'99670000{i:04d}')
+            for i in range(20)
+        ]
+        for i in range(60):
+            training = create_training(trainers[i % len(trainers)], f'Занятие {i}')
+            create_attendances(training, 200, start=date(2024, 1, 1))
+        cls.trainings = Training.objects.order_by('pk')
+        cls.trainer = trainers[0]
+
+    def assertNoScans(self, queryset):
+        plan = queryset.explain()
+        scans = re.findall(r'SCAN (\S+)', plan)
+        self.assertEqual([table for table in scans if table != 'CONSTANT'], [], plan)
+
+    def test_salary_report_selected_trainings(self):
+        attendances = salary_attendances(
+            self.trainings.filter(pk__in=list(self.trainings.values_list('pk', flat=True)[:5])),
+            date(2024, 3, 1), date(2024, 3, 31),
+        )
+        self.assertNoScans(salary_rows_queryset(attendances))
+        self.assertNoScans(salary_totals_queryset(attendances))
+
+    def test_salary_report_all_trainings(self):
+        attendances = salary_attendances(Training.objects.all(), date(2024, 3, 1), date(2024, 3, 31))
+        self.assertNoScans(salary_rows_queryset(attendances))
+        self.assertNoScans(salary_totals_queryset(attendances))
+
+    def test_payroll_refresh(self):
+        self.assertNoScans(Attendance.objects.filter(
+            training__trainer_id=self.trainer.pk,
+            recording_date__gte=date(2024, 3, 1),
+            recording_date__lt=date(2024, 4, 1),
+        ))
+        self.assertNoScans(TrainerMonthlyPayroll.objects.filter(trainer=self.trainer, month__in=[date(2024, 3, 1)]))
+
+    def test_missing_attendance(self):
+        sync_sessions(until=date(2024, 12, 31))
+        sessions = TrainingSession.objects.filter(session_date__range=(date(2024, 3, 1), date(2024, 3, 31)))
+        self.assertNoScans(missing_attendance(sessions.filter(training__trainer=self.trainer)))
+        self.assertNoScans(missing_attendance(sessions))
+
+    def test_admin_attendance_pages(self):
+        queryset = Attendance.objects.select_related('training').order_by('-recording_date', '-id')
+        last = queryset[150]
+        self.assertNoScans(queryset.filter(
+            recording_date__lte=last.recording_date,
+        ).exclude(recording_date=last.recording_date, id__gte=last.pk)[:100])
+
+
+@override_settings(QUERY_PROFILING_SAMPLE_RATE=1)
+class QueryProfilingTests(TestCase):
+    def setUp(self):
+        trainer = Trainer.objects.create(first_name='Азамат', last_name='Осмонов', phone_number='996700000001')
+        for i in range(3):
+            create_training(trainer, f'Занятие {i}')
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s,%s) AND name = 'O''Brien'\n  LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+        self.assertEqual(fingerprint('SELECT t0.id FROM training_t0 t0'), 'SELECT t0.id FROM training_t0 t0')
+
+    def test_repeated_queries_are_grouped(self):
+        profile = QueryProfile()
+        with connection.execute_wrapper(profile):
+            for training in Training.objects.all():
+                training.trainer.phone_number
+        self.assertEqual(profile.count, 4)
+        (key, count, duration), = profile.top_fingerprints()
+        self.assertEqual(count, 3)
+        self.assertIn('FROM "training_trainer" WHERE "training_trainer"."id" = ?', key)
+
+    def test_fingerprints_are_bounded(self):
+        profile = QueryProfile()
+        with connection.execute_wrapper(profile), connection.cursor() as cursor:
+            for i in range(MAX_FINGERPRINTS + 10):
+                cursor.execute(f'SELECT 1 AS c{i}')
+        self.assertEqual(profile.count, MAX_FINGERPRINTS + 10)
+        self.assertEqual(len(profile.counts), MAX_FINGERPRINTS)
+
+    def test_server_timing_for_staff_only(self):
+        self.assertNotIn('Server-Timing', self.client.get('/admin/training/training/'))
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get('/admin/training/training/')
+        self.assertRegex(response['Server-Timing'], r'^db;desc="\d+ queries";dur=[\d.]+, total;dur=[\d.]+$')
+
+        with override_settings(QUERY_PROFILING_SAMPLE_RATE=0):
+            self.assertNotIn('Server-Timing', self.client.get('/admin/training/training/'))
+
+    def test_slow_request_log(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        with self.assertNoLogs('training.slow_requests'):
+            self.client.get('/admin/training/training/')
+        with override_settings(SLOW_REQUEST_MS=0), self.assertLogs('training.slow_requests', 'WARNING') as logs:
+            self.client.get('/admin/training/training/?o=1')
+        self.assertRegex(logs.output[0], r'GET /admin/training/training/\?o=1 200: \d+ мс, \d+ SQL-запросов')
+
+
+class AttendanceIndexTests(TestCase):
+    """
+    Запросы к посещаемости обходятся двумя индексами: уникальным (training, recording_date) и
+    attendance_date_id_idx (recording_date, id); третий индекс на каждую запись не нужен.
+    """
+
+    def setUp(self):
+        trainer = Trainer.objects.create(first_name='Азамат', last_name='Осмонов', phone_number='996700000001')
+        for i in range(5):
+            create_attendances(create_training(trainer, f'Занятие {i}'), 30)
+        self.trainer = trainer
+
+    def attendance_plan(self, queryset):
+        return [line for line in queryset.explain().splitlines() if 'training_attendance' in line]
+
+    def assertSearches(self, queryset, index):
+        plan = self.attendance_plan(queryset)
+        self.assertTrue(plan)
+        for line in plan:
+            self.assertIn('SEARCH', line)
+            self.assertIn(f'INDEX {index} ', line)
+
+    def test_queries_use_remaining_indexes(self):
+        period = (date(2024, 3, 1), date(2024, 3, 31))
+        # отчет по зарплате и пересчет сводки: диапазон дат по каждому занятию
+        self.assertSearches(
+            salary_attendances(Training.objects.all(), *period), 'sqlite_autoindex_training_attendance_1',
+        )
+        self.assertSearches(
+            Attendance.objects.filter(training__trainer=self.trainer, recording_date__range=period),
+            'sqlite_autoindex_training_attendance_1',
+        )
+        # список посещаемости в админке: новые сверху по всем занятиям
+        self.assertSearches(
+            Attendance.objects.filter(recording_date__gte=period[0]).order_by('-recording_date', '-id')[:100],
+            'attendance_date_id_idx',
+        )
+        # незаполненные занятия: NOT EXISTS по (training_id, recording_date)
+        self.assertSearches(missing_attendance(TrainingSession.objects.all()), 'sqlite_autoindex_training_attendance_1')
@@ -24,7 +24,7 @@ load_dotenv()
 SECRET_KEY = os.getenv('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = os.getenv('DEBUG')
+DEBUG = os.getenv('DEBUG', '').lower() in ('1', 'true', 'yes', 'on')
 
 ALLOWED_HOSTS = ['82.146.38.189', 'ulankurmanbekov83.fvds.ru', 'localhost', '127.0.0.1']
 
@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # первым, чтобы учесть и запросы сессии и пользователя из middleware ниже
+    'training.profiling.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,16 +76,54 @@ TEMPLATES = [
 WSGI_APPLICATION = 'trainingmanager.wsgi.application'
 
 
+# Профилирование SQL (training.profiling): доля профилируемых запросов (1 — все, 0.05 — каждый
+# двадцатый, 0 — выключено; по умолчанию все при DEBUG и каждый двадцатый в продакшене) и порог,
+# после которого запрос попадает в лог медленных запросов.
+# SLOW_REQUEST_LOG — файл этого лога; без него записи уходят в stderr (логи gunicorn)
+QUERY_PROFILING_SAMPLE_RATE = float(os.getenv('QUERY_PROFILING_SAMPLE_RATE', 1 if DEBUG else 0.05))
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 1000))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'timestamped': {'format': '[%(asctime)s] %(message)s'},
+    },
+    'handlers': {
+        'slow_requests': {
+            'formatter': 'timestamped',
+            **({'class': 'logging.FileHandler', 'filename': os.getenv('SLOW_REQUEST_LOG')}
+               if os.getenv('SLOW_REQUEST_LOG') else {'class': 'logging.StreamHandler'}),
+        },
+    },
+    'loggers': {
+        'training.slow_requests': {'handlers': ['slow_requests'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# DB_ENGINE=postgresql переключает сайт и бота (bot.db.create_database) на PostgreSQL
+if os.getenv('DB_ENGINE') == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB', 'trainingmanager'),
+        'USER': os.getenv('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators